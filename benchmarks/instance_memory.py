@@ -0,0 +1,96 @@
+"""
+Measure the memory overhead of model instances loaded from documents,
+with and without the `compact` option.
+
+    $ python benchmarks/instance_memory.py [count]
+"""
+
+import sys
+import tracemalloc
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from monom import Model, EmbeddedModel, List
+
+
+def define_models():
+    class User(EmbeddedModel):
+        name: str
+        email: str
+
+    class Post(Model):
+        user: User
+        title: str
+        content: str
+        tags: List[str]
+        rank: int
+        visible: bool = True
+        created_on: datetime = datetime.utcnow
+
+    return Post
+
+
+def define_compact_models():
+    class User(EmbeddedModel):
+        compact = True
+        name: str
+        email: str
+
+    class Post(Model):
+        compact = True
+        user: User
+        title: str
+        content: str
+        tags: List[str]
+        rank: int
+        visible: bool = True
+        created_on: datetime = datetime.utcnow
+
+    return Post
+
+
+def make_documents(count: int) -> list:
+    return [
+        {
+            '_id': ObjectId(),
+            'user': {'name': 'Lucy', 'email': 'lucy@example.com'},
+            'title': 'hello world',
+            'content': 'monom is awesome...',
+            'tags': ['life', 'art'],
+            'rank': i,
+            'visible': True,
+            'created_on': datetime(2020, 1, 1),
+        }
+        for i in range(count)
+    ]
+
+
+def measure(model, docs: list, touch: bool) -> float:
+    """Return the bytes allocated per instance on top of the documents."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [model.from_document(doc) for doc in docs]
+    if touch:
+        # wrappers of embedded documents are created on first access
+        for obj in objs:
+            _ = obj.user.name
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(objs)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    models = [('default', define_models()), ('compact', define_compact_models())]
+
+    print('{} documents, bytes per instance:'.format(count))
+    for touch in (False, True):
+        for name, model in models:
+            docs = make_documents(count)
+            label = '{} (embedded accessed)'.format(name) if touch else name
+            print('  {:<30}{:>8.1f}'.format(label, measure(model, docs, touch)))
+
+
+if __name__ == '__main__':
+    main()
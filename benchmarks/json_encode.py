@@ -0,0 +1,61 @@
+"""
+Compare encoding documents to JSON by `bson.json_util.dumps` and by the encoder compiled for the model,
+as `Model.to_json()` and `Cursor.iter_ndjson()` do.
+
+    $ python benchmarks/json_encode.py [count]
+"""
+
+import sys
+import time
+from datetime import datetime
+
+from bson import json_util
+from bson.objectid import ObjectId
+
+from monom import Model, EmbeddedModel, List
+from monom import serialization
+
+
+class Comment(EmbeddedModel):
+    author: ObjectId
+    content: str
+    created_on: datetime
+
+
+class Post(Model):
+    title: str
+    rank: int
+    score: float
+    tags: List[str]
+    created_on: datetime
+    comments: List[Comment]
+
+
+def make_document(i: int) -> dict:
+    return {
+        '_id': ObjectId(), 'title': 'title %d' % i, 'rank': i, 'score': i / 3, 'tags': ['a', 'b', 'c'],
+        'created_on': datetime(2020, 1, 1), 'extra': {'note': 'note %d' % i},
+        'comments': [{'author': ObjectId(), 'content': 'comment %d' % j, 'created_on': datetime(2020, 1, 2)}
+                     for j in range(10)],
+    }
+
+
+def run(label: str, docs: list, encode) -> None:
+    start = time.perf_counter()
+    for doc in docs:
+        encode(doc)
+    elapsed = time.perf_counter() - start
+    print('  {:<20}{:>8.2f} us/doc'.format(label, elapsed / len(docs) * 1e6))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    docs = [make_document(i) for i in range(count)]
+    encoder = Post._get_plan().json_encoder
+    print('{} documents, orjson {}:'.format(count, 'installed' if serialization.orjson else 'not installed'))
+    run('json_util.dumps', docs, json_util.dumps)
+    run('compiled encoder', docs, lambda doc: serialization.dumps(encoder(doc)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare decoding wide documents eagerly and lazily when only a few fields are read,
+as `Model.find(..., lazy=True)` does for each document of the cursor.
+
+    $ python benchmarks/lazy_decode.py [count]
+"""
+
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import bson
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from monom import Model, EmbeddedModel, List
+from monom.lazy import LazyDocument
+
+
+class Profile(EmbeddedModel):
+    bio: str
+    website: str
+
+
+class Wide(Model):
+    title: str
+    rank: int
+    profile: Profile
+    payload: bytes
+
+
+def make_document(i: int) -> dict:
+    doc = {'_id': ObjectId(), 'title': 'title %d' % i, 'rank': i, 'payload': b'x' * 1024}
+    for j in range(32):
+        doc['field%d' % j] = 'value %d of document %d' % (j, i)
+    doc['profile'] = {'bio': 'bio %d' % i, 'website': 'https://example.com/%d' % i}
+    for j in range(4):
+        doc['history%d' % j] = {'version': j, 'created_on': datetime(2020, 1, 1), 'note': 'note ' * 20}
+    doc['comments'] = [{'author': 'user %d' % j, 'content': 'comment %d' % j} for j in range(10)]
+    return doc
+
+
+def read(obj) -> None:
+    _ = obj.title, obj.rank, obj.payload
+
+
+def load_all(raws: list, load) -> list:
+    objs = []
+    for raw in raws:
+        obj = Wide.from_document(load(raw))
+        read(obj)
+        objs.append(obj)
+    return objs
+
+
+def run(label: str, raws: list, load) -> None:
+    start = time.perf_counter()
+    load_all(raws, load)
+    elapsed = time.perf_counter() - start
+
+    # tracing slows down allocations, so the memory is measured in another pass
+    tracemalloc.start()
+    objs = load_all(raws, load)
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('  {:<8}{:>8.2f} us/doc {:>10.1f} bytes/doc kept'.format(label, elapsed / len(raws) * 1e6, kept / len(objs)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    raws = [bson.encode(make_document(i)) for i in range(count)]
+    print('{} documents of {} fields, {} bytes each:'.format(count, len(make_document(0)), len(raws[0])))
+    run('eager', raws, bson.decode)
+    run('lazy', raws, lambda raw: LazyDocument(RawBSONDocument(raw)))
+
+
+if __name__ == '__main__':
+    main()
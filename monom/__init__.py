@@ -3,9 +3,12 @@ An object mapper for MongoDB with type hints.
 ~~~~~~~~~~~~
 """
 
+from .fields import Ref
 from .model import BaseModel, EmbeddedModel
 from .mongo import MongoModel as Model
+from .aio import AsyncMongoModel as AsyncModel
 from .helpers import switch_collection, switch_db
+from .session import Session
 from .utils import DotSon, get_logger, set_logger
 
 from pymongo import MongoClient, ASCENDING, DESCENDING
@@ -0,0 +1,277 @@
+"""
+Command line tools of monom.
+
+    $ python -m monom sync-indexes myapp.models --uri mongodb://localhost:27017 --db mydb
+    $ python -m monom export myapp.models:Post --format bsonl --output posts.bson
+    $ python -m monom import myapp.models:Post --format bsonl --input posts.bson
+"""
+
+import argparse
+import bisect
+import contextlib
+import importlib
+import sys
+import time
+from typing import BinaryIO, ContextManager, Iterator, List, MutableMapping, Tuple
+
+import bson
+import bson.errors
+from bson import json_util
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+
+from .batch import BatchValidationError, InsertStreamResult
+from .indexes import IndexManager, describe_change, registered_models
+from .mongo import Cursor, MongoModel
+
+# the number of errors of an import which are printed
+MAX_PRINTED_ERRORS = 10
+
+
+def sync_indexes(args: argparse.Namespace) -> int:
+    for module in args.modules:
+        importlib.import_module(module)
+
+    db = None
+    if args.db is not None:
+        db = MongoClient(args.uri).get_database(args.db)
+
+    models = []
+    for model in registered_models():
+        # only the models defined in the modules, or their submodules
+        if not any(model.__module__ == module or model.__module__.startswith(module + '.')
+                   for module in args.modules):
+            continue
+        if model.get_db() is None and db is not None:
+            model.set_db(db)
+        if model.get_db() is not None:
+            models.append(model)
+
+    if not models:
+        print('No models with a database found in {}; pass --db if necessary.'.format(', '.join(args.modules)),
+              file=sys.stderr)
+        return 1
+
+    manager = IndexManager(max_workers=args.workers, store_fingerprints=args.store_fingerprints)
+    for result in manager.sync(models, force=args.force, dry_run=args.dry_run):
+        if result.skipped:
+            status = 'unchanged since the last synchronization'
+        elif result.changes:
+            status = ', '.join(map(describe_change, result.changes))
+        else:
+            status = 'up to date'
+        print('{} ({}): {}'.format(result.collection, result.model.__qualname__, status))
+    return 0
+
+
+def load_model(spec: str, uri: str, db_name: str = None) -> type:
+    """Import a model by `module:name`, and set the database of its collection if its module sets none."""
+    module_name, _, name = spec.partition(':')
+    if not name:
+        raise ValueError('Expected a model as module:name, e.g. myapp.models:Post, got {!r}.'.format(spec))
+    model = importlib.import_module(module_name)
+    for attr in name.split('.'):
+        model = getattr(model, attr)
+    if not (isinstance(model, type) and issubclass(model, MongoModel)):
+        raise ValueError('{} is not a model with a collection.'.format(spec))
+
+    if model.get_db() is None:
+        if db_name is None:
+            raise ValueError('No database is set for {}; pass --db.'.format(spec))
+        model.set_db(MongoClient(uri).get_database(db_name))
+    return model
+
+
+def _open(path: str, mode: str) -> ContextManager[BinaryIO]:
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin.buffer if 'r' in mode else sys.stdout.buffer)
+    return open(path, mode)
+
+
+def _report(verb: str, count: int, model: type, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed > 0 else 0
+    print('{} {} documents of {} in {:.2f}s ({:.0f} documents/s)'.format(
+        verb, count, model.__qualname__, elapsed, rate
+    ), file=sys.stderr)
+
+
+def export(args: argparse.Namespace) -> int:
+    """Write the documents of a model to a file, batch by batch, so the memory used doesn't grow with the collection.
+
+    Documents are written as they are stored, as newline-delimited Extended JSON, or as concatenated BSON
+    like `mongodump` writes, copied from the raw batches without being decoded.
+    """
+    try:
+        model = load_model(args.model, args.uri, args.db)
+    except (ImportError, AttributeError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+
+    query = json_util.loads(args.filter) if args.filter else None
+    # the collection is not set by `get_collection`, which would build the indexes of the model implicitly
+    # noinspection PyProtectedMember
+    collection = IndexManager._collection_of(model)
+    if args.format == 'bsonl':
+        collection = collection.with_options(
+            codec_options=collection.codec_options.with_options(document_class=RawBSONDocument))
+    cursor = Cursor(model, collection, query).batch_size(args.batch_size)
+    count = 0
+    started = time.perf_counter()
+    with _open(args.output, 'wb') as file:
+        if args.format == 'bsonl':
+            while True:
+                # noinspection PyProtectedMember
+                docs = cursor._next_batch()
+                if not docs:
+                    break
+                file.write(b''.join([doc.raw for doc in docs]))
+                count += len(docs)
+        else:
+            for lines in cursor.iter_ndjson():
+                file.write(lines)
+                # newlines in strings are escaped in JSON
+                count += lines.count(b'\n')
+        file.flush()
+    _report('Exported', count, model, started)
+    return 0
+
+
+class _DocumentReader:
+    """Read the documents of a file written by `export`. Malformed lines of NDJSON are skipped;
+    corrupt BSON stops the reading, as the documents after it cannot be located.
+    The errors are kept with their line numbers, or with the indexes of the documents for BSON.
+    """
+
+    def __init__(self, file: BinaryIO, fmt: str, model: type):
+        self.file = file
+        self.fmt = fmt
+        self.model = model
+        self.errors: List[Tuple[int, Exception]] = []
+        # the indexes of the documents after which documents and lines are shifted by blank or malformed lines,
+        # and the line numbers of those documents
+        self._indexes: List[int] = []
+        self._lines: List[int] = []
+
+    def __iter__(self) -> Iterator[MutableMapping]:
+        if self.fmt == 'bsonl':
+            return self._read_bson()
+        return self._read_json()
+
+    def _read_bson(self) -> Iterator[MutableMapping]:
+        index = 0
+        try:
+            for doc in bson.decode_file_iter(self.file, self.model.get_collection().codec_options):
+                yield doc
+                index += 1
+        except bson.errors.BSONError as err:
+            self.errors.append((index, err))
+
+    def _read_json(self) -> Iterator[MutableMapping]:
+        index = 0
+        for number, line in enumerate(self.file, 1):
+            if not line.strip():
+                continue
+            try:
+                doc = json_util.loads(line)
+            except (ValueError, TypeError, bson.errors.BSONError) as err:
+                self.errors.append((number, err))
+                continue
+            if number - index != (self._lines[-1] - self._indexes[-1] if self._lines else 1):
+                self._indexes.append(index)
+                self._lines.append(number)
+            yield doc
+            index += 1
+
+    def line_of(self, index: int) -> int:
+        """Return the line number of a document of NDJSON by its index."""
+        pos = bisect.bisect_right(self._indexes, index) - 1
+        if pos < 0:
+            return index + 1
+        return self._lines[pos] + index - self._indexes[pos]
+
+    def messages(self, result: InsertStreamResult) -> List[str]:
+        """Return the messages of the errors of reading the file and inserting its documents, in their order."""
+        where = 'Document #{}' if self.fmt == 'bsonl' else 'Line {}'
+        located = [(position, '{}: {}'.format(where.format(position), err)) for position, err in self.errors]
+        others = []
+        for error in result.errors:
+            if isinstance(error.error, BatchValidationError) and self.fmt != 'bsonl':
+                line = self.line_of(error.error.index)
+                located.append((line, 'Line {}: {}'.format(line, error.error)))
+            else:
+                others.append('Chunk {}: {}'.format(error.chunk, error.error))
+        located.sort(key=lambda item: item[0])
+        return [message for _, message in located] + others
+
+
+def import_(args: argparse.Namespace) -> int:
+    """Insert the documents of a file written by `export` in chunks, which are converted and validated
+    by the model, and inserted with `ordered=False`; malformed, invalid or duplicate documents are reported
+    and skipped.
+    """
+    try:
+        model = load_model(args.model, args.uri, args.db)
+    except (ImportError, AttributeError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    with _open(args.input, 'rb') as file:
+        reader = _DocumentReader(file, args.format, model)
+        result = model.insert_stream(reader, chunk_size=args.chunk_size, ordered=False)
+    _report('Imported', result.inserted_count, model, started)
+
+    messages = reader.messages(result)
+    for message in messages[:MAX_PRINTED_ERRORS]:
+        print(message, file=sys.stderr)
+    if len(messages) > MAX_PRINTED_ERRORS:
+        print('... and {} more errors'.format(len(messages) - MAX_PRINTED_ERRORS), file=sys.stderr)
+    return 1 if messages else 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m monom')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    parser_sync = commands.add_parser('sync-indexes', help='synchronize the indexes declared by models')
+    parser_sync.add_argument('modules', nargs='+', help='modules defining the models, e.g. myapp.models')
+    parser_sync.add_argument('--uri', default='mongodb://localhost:27017',
+                             help='MongoDB URI used with --db (default: %(default)s)')
+    parser_sync.add_argument('--db', help='database of the models which have none set by their modules')
+    parser_sync.add_argument('--force', action='store_true', help='check all indexes even if unchanged')
+    parser_sync.add_argument('--dry-run', action='store_true', help='print the changes without applying them')
+    parser_sync.add_argument('--workers', type=int, help='number of models synchronized in parallel')
+    parser_sync.add_argument('--store-fingerprints', action='store_true',
+                             help='store the fingerprints of the indexes in the collection _monom_indexes, '
+                                  'to skip the comparison of unchanged models next time')
+    parser_sync.set_defaults(func=sync_indexes)
+
+    parser_export = commands.add_parser('export', help='write the documents of a model to a file')
+    parser_import = commands.add_parser('import', help='insert the documents of a file written by export')
+    for sub in (parser_export, parser_import):
+        sub.add_argument('model', help='the model as module:name, e.g. myapp.models:Post')
+        sub.add_argument('--uri', default='mongodb://localhost:27017',
+                         help='MongoDB URI used with --db (default: %(default)s)')
+        sub.add_argument('--db', help='database of the model if its module sets none')
+        sub.add_argument('--format', choices=['ndjson', 'bsonl'], default='ndjson',
+                         help='newline-delimited Extended JSON, or concatenated BSON documents (default: %(default)s)')
+
+    parser_export.add_argument('--output', '-o', default='-', help='file written (default: stdout)')
+    parser_export.add_argument('--filter', help='query of the documents exported, in Extended JSON')
+    parser_export.add_argument('--batch-size', type=int, default=1000,
+                               help='number of documents per batch fetched (default: %(default)s)')
+    parser_export.set_defaults(func=export)
+
+    parser_import.add_argument('--input', '-i', default='-', help='file read (default: stdin)')
+    parser_import.add_argument('--chunk-size', type=int, default=1000,
+                               help='number of documents per insert_many (default: %(default)s)')
+    parser_import.set_defaults(func=import_)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
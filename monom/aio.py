@@ -0,0 +1,544 @@
+"""
+Models driven by asyncio, on the async client of pymongo (4.9+) or Motor.
+
+The schema, conversion and validation are shared with :class:`~monom.mongo.MongoModel`;
+only the calls to MongoDB are awaitable.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import inspect
+from functools import wraps
+from typing import Any, Callable, Iterable, List, MutableMapping, Optional, Tuple, Type, TypeVar, Union
+
+from pymongo import IndexModel
+from pymongo.collation import Collation
+from pymongo.collection import ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+from bson.raw_bson import RawBSONDocument
+
+from .batch import InsertStreamResult, SaveResult, validate_many
+from .cache import _missing
+from .lazy import LazyDocument
+from .model import BaseModel
+from .mongo import AggregateCursor, ConflictError, MongoModel, MongoModelType, _aggregate_options, _InsertStream, \
+    _plan_save, _SaveGroup
+from .projection import CallSite, loaded_names
+from .session import current_session
+from .utils import hybridmethod
+
+try:
+    from pymongo.asynchronous.collection import AsyncCollection
+except ImportError:  # pragma: no cover
+    AsyncCollection = None
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorCollection
+except ImportError:  # pragma: no cover
+    AsyncIOMotorCollection = None
+
+__all__ = [
+    'AsyncAggregateCursor',
+    'AsyncCursor',
+    'AsyncMongoModel',
+]
+
+T = TypeVar('T', bound='AsyncMongoModel')
+
+_collection_types = tuple(tp for tp in (AsyncCollection, AsyncIOMotorCollection) if tp is not None)
+
+
+async def _resolve(value: Any) -> Any:
+    # some methods return cursors by coroutines in pymongo, but directly in Motor
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncCursor:
+    """Wrap an async cursor of pymongo or Motor, and yield models by `async for`.
+
+    The methods of the underlying cursor (`sort`, `skip`, `limit`, etc.) are available, and chainable.
+    """
+
+    def __init__(self, model_cls: Type[T], cursor: Any, projection=None, profile: Optional[CallSite] = None):
+        self.model_cls = model_cls
+        self.cursor = cursor
+        # noinspection PyProtectedMember
+        self.loaded = loaded_names(projection, model_cls._get_plan().names)
+        self.profile = profile
+        self._iterator = None
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.cursor, name)
+        if not callable(attr):
+            return attr
+
+        @wraps(attr)
+        def method(*args, **kw):
+            rv = attr(*args, **kw)
+            return self if rv is self.cursor else rv
+        return method
+
+    def __aiter__(self) -> AsyncCursor:
+        return self
+
+    async def __anext__(self) -> T:
+        if self._iterator is None:
+            self._iterator = self.cursor.__aiter__()
+        rv = await self._iterator.__anext__()
+        if isinstance(rv, RawBSONDocument):
+            rv = LazyDocument(rv)
+        obj = self.model_cls.from_document(rv)
+        if self.loaded is not None:
+            obj._loaded = self.loaded
+        if self.profile is not None:
+            self.profile.observe(obj)
+        session = current_session()
+        if session is not None:
+            obj = session.merge(obj)
+        return obj
+
+    async def to_list(self, length: int = None) -> List[T]:
+        """Return a list of at most `length` models, or all the remaining models if `length` is None."""
+        objs = []
+        if length is not None and length <= 0:
+            return objs
+        async for obj in self:
+            objs.append(obj)
+            if length is not None and len(objs) >= length:
+                break
+        return objs
+
+
+class AsyncAggregateCursor(AggregateCursor):
+    """Wrap the documents of an async aggregation into models, to be iterated by `async for`;
+    see :class:`~monom.mongo.AggregateCursor`.
+    """
+
+    def __init__(self, model_cls: Type[BaseModel], cursor: Any, validate: bool = False):
+        super().__init__(model_cls, cursor, validate)
+        self._iterator = None
+
+    def __iter__(self):
+        raise TypeError('{} should be iterated by `async for`.'.format(type(self).__name__))
+
+    def batches(self):
+        raise TypeError('{} has no batches; use `await to_list()`.'.format(type(self).__name__))
+
+    def __aiter__(self) -> AsyncAggregateCursor:
+        return self
+
+    async def __anext__(self) -> Any:
+        if self._iterator is None:
+            self._iterator = self.cursor.__aiter__()
+        return self._load_batch([await self._iterator.__anext__()])[0]
+
+    async def __aenter__(self) -> AsyncAggregateCursor:
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await _resolve(self.cursor.close())
+
+    async def to_list(self, length: int = None) -> List[Any]:
+        """Return a list of at most `length` models, or all the remaining models if `length` is None."""
+        if length is not None and length <= 0:
+            return []
+        return self._load_batch(await self.cursor.to_list(length))
+
+
+# noinspection PyShadowingBuiltins,PyMethodParameters
+class AsyncCollectionMixin(type):
+    """Awaitable counterparts of the methods of :class:`~monom.mongo.CollectionMixin`.
+    """
+
+    #################################
+    # Insertion
+    #################################
+
+    async def insert_one(cls: Type[T],
+                         document: MutableMapping,
+                         bypass_document_validation: bool = False,
+                         session=None) -> InsertOneResult:
+        doc = cls._get_clean_data(document, bypass_validation=bypass_document_validation)
+        rv = await cls.get_collection().insert_one(
+            doc, bypass_document_validation=bypass_document_validation, session=session
+        )
+        cls._invalidate_docs([doc])
+        return rv
+
+    async def insert_many(cls: Type[T],
+                          documents: Iterable[MutableMapping],
+                          ordered: bool = True,
+                          bypass_document_validation: bool = False,
+                          session=None) -> InsertManyResult:
+        docs = [cls._get_clean_data(document, bypass_validation=True) for document in documents]
+        if not bypass_document_validation:
+            validate_many(cls, docs)
+        try:
+            return await cls.get_collection().insert_many(
+                docs, ordered=ordered, bypass_document_validation=bypass_document_validation, session=session
+            )
+        finally:
+            cls._invalidate_docs(docs)
+
+    async def insert_stream(cls: Type[T],
+                            documents: Iterable[MutableMapping],
+                            chunk_size: int = 1000,
+                            max_bytes: int = None,
+                            ordered: bool = True,
+                            bypass_document_validation: bool = False,
+                            session=None) -> InsertStreamResult:
+        """See :meth:`~monom.mongo.CollectionMixin.insert_stream`."""
+
+        collection = cls.get_collection()
+        stream = _InsertStream(cls, ordered, not bypass_document_validation)
+        for chunk in stream.chunks(documents, chunk_size, max_bytes, collection.codec_options):
+            try:
+                rv = await collection.insert_many(
+                    chunk, ordered=ordered, bypass_document_validation=bypass_document_validation, session=session
+                )
+            except BulkWriteError as err:
+                stream.record_error(chunk, err)
+            else:
+                stream.record(chunk, rv)
+        return stream.result
+
+    #################################
+    # Query
+    #################################
+
+    def _profile_projection(cls: Type[T], projection) -> Tuple[Any, Optional[CallSite]]:
+        # a field outside of a derived projection cannot be fetched without being awaited,
+        # so the projections of the profiler are suggested but never applied
+        profile = None
+        if projection is None and cls.projection_profiler is not None:
+            profile = cls.projection_profiler.site(cls)
+        return cls._versioned_projection(projection), profile
+
+    async def find_one(cls: Type[T], filter: dict = None, projection=None, *args, **kw) -> Optional[T]:
+        cache = cls.pk_cache
+        if cache is not None and projection is None and not args and not kw:
+            pk = cache.pk_of(filter)
+            if pk is not _missing:
+                collection = cls.get_collection()
+                result = await cache.fetch_async(collection, pk, lambda: collection.find_one({'_id': pk}))
+                if result is not None:
+                    return cls._get_loaded_model(result, None, None)
+                return None
+
+        projection, profile = cls._profile_projection(projection)
+
+        result = await cls.get_collection().find_one(filter, projection, *args, **kw)
+        if result is not None:
+            return cls._get_loaded_model(result, projection, profile)
+
+    def find(cls: Type[T], filter: dict = None, projection=None, *args, lazy: bool = False, **kw) -> AsyncCursor:
+        """Return an :class:`AsyncCursor`, which should be iterated by `async for`.
+        If `lazy` is true, the documents are fetched as raw BSON and their fields are decoded on first access.
+        """
+        projection, profile = cls._profile_projection(projection)
+
+        collection = cls.get_collection()
+        if lazy:
+            codec_options = collection.codec_options.with_options(document_class=RawBSONDocument)
+            collection = collection.with_options(codec_options=codec_options)
+        return AsyncCursor(cls, collection.find(filter, projection, *args, **kw), projection, profile)
+
+    #################################
+    # Deletion
+    #################################
+
+    async def delete_one(cls: Type[T], filter: dict, collation: Collation = None, session=None) -> DeleteResult:
+        rv = await cls.get_collection().delete_one(filter, collation=collation, session=session)
+        cls._invalidate(filter)
+        return rv
+
+    async def delete_many(cls: Type[T], filter: dict, collation: Collation = None, session=None) -> DeleteResult:
+        rv = await cls.get_collection().delete_many(filter, collation=collation, session=session)
+        cls._invalidate(filter)
+        return rv
+
+    #################################
+    # Update
+    #################################
+
+    async def replace_one(cls: Type[T],
+                          filter: dict,
+                          replacement: MutableMapping,
+                          upsert: bool = False,
+                          bypass_document_validation: bool = False,
+                          collation: Collation = None,
+                          session=None) -> UpdateResult:
+        doc = cls._get_clean_data(replacement, bypass_validation=bypass_document_validation)
+        rv = await cls.get_collection().replace_one(
+            filter, doc, upsert=upsert, bypass_document_validation=bypass_document_validation,
+            collation=collation, session=session
+        )
+        cls._invalidate(filter)
+        return rv
+
+    async def update_one(cls: Type[T],
+                         filter: dict,
+                         update: MutableMapping,
+                         upsert: bool = False,
+                         bypass_document_validation: bool = False,
+                         collation: Collation = None,
+                         array_filters: List[dict] = None,
+                         session=None) -> UpdateResult:
+        update = cls._get_clean_update(update, bypass_document_validation)
+        rv = await cls.get_collection().update_one(
+            filter, update, upsert=upsert, bypass_document_validation=bypass_document_validation,
+            collation=collation, array_filters=array_filters, session=session
+        )
+        cls._invalidate(filter)
+        return rv
+
+    async def update_many(cls: Type[T],
+                          filter: dict,
+                          update: MutableMapping,
+                          upsert: bool = False,
+                          array_filters: List[dict] = None,
+                          bypass_document_validation: bool = False,
+                          collation: Collation = None,
+                          session=None) -> UpdateResult:
+        update = cls._get_clean_update(update, bypass_document_validation)
+        rv = await cls.get_collection().update_many(
+            filter, update, upsert=upsert, array_filters=array_filters,
+            bypass_document_validation=bypass_document_validation, collation=collation, session=session
+        )
+        cls._invalidate(filter)
+        return rv
+
+    #################################
+    # FindAndXXX
+    #################################
+
+    async def find_one_and_delete(cls: Type[T],
+                                  filter: dict,
+                                  projection: Union[list, dict] = None,
+                                  sort: List[tuple] = None,
+                                  session=None, **kw) -> Optional[T]:
+        result = await cls.get_collection().find_one_and_delete(
+            filter, projection=projection, sort=sort, session=session, **kw
+        )
+        cls._invalidate(filter)
+        if result is not None:
+            return cls.from_document(result)
+
+    async def find_one_and_replace(cls: Type[T],
+                                   filter: dict,
+                                   replacement: MutableMapping,
+                                   bypass_document_validation: bool = False,  # extra argument
+                                   projection: Union[list, dict] = None,
+                                   sort: List[tuple] = None,
+                                   upsert: bool = False,
+                                   return_document: bool = ReturnDocument.BEFORE,
+                                   session=None, **kw) -> Optional[T]:
+        doc = cls._get_clean_data(replacement, bypass_validation=bypass_document_validation)
+        projection = cls._versioned_projection(projection)
+        result = await cls.get_collection().find_one_and_replace(
+            filter, doc, projection=projection, sort=sort, upsert=upsert, return_document=return_document,
+            session=session, **kw
+        )
+        cls._invalidate(filter)
+        if result is not None:
+            return cls.from_document(result)
+
+    async def find_one_and_update(cls: Type[T],
+                                  filter: dict,
+                                  update: dict,
+                                  bypass_document_validation: bool = False,  # extra argument
+                                  projection: Union[list, dict] = None,
+                                  sort: List[tuple] = None,
+                                  upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE,
+                                  array_filters: List[dict] = None,
+                                  session=None, **kw) -> Optional[T]:
+        update = cls._get_clean_update(update, bypass_document_validation)
+        projection = cls._versioned_projection(projection)
+        result = await cls.get_collection().find_one_and_update(
+            filter, update, projection=projection, sort=sort, upsert=upsert, return_document=return_document,
+            array_filters=array_filters, session=session, **kw
+        )
+        cls._invalidate(filter)
+        if result is not None:
+            return cls.from_document(result)
+
+    #################################
+    # Aggregation
+    #################################
+
+    async def aggregate(cls: Type[T], pipeline: List[dict], session=None, **kw) -> Any:
+        """Return the async command cursor of the driver."""
+        return await _resolve(cls.get_collection().aggregate(pipeline, session=session, **kw))
+
+    async def aggregate_models(cls: Type[T], pipeline: List[dict], as_: Type[BaseModel] = None, validate: bool = False,
+                               allow_disk_use: bool = None, batch_size: int = None, session=None,
+                               **kw) -> AsyncAggregateCursor:
+        """See :meth:`~monom.mongo.CollectionMixin.aggregate_models`; return an :class:`AsyncAggregateCursor`."""
+        kw = _aggregate_options(allow_disk_use, batch_size, kw)
+        cursor = await _resolve(cls.get_collection().aggregate(pipeline, session=session, **kw))
+        return AsyncAggregateCursor(cls if as_ is None else as_, cursor, validate=validate)
+
+    async def estimated_document_count(cls: Type[T], **kw) -> int:
+        return await cls.get_collection().estimated_document_count(**kw)
+
+    async def count_documents(cls: Type[T], filter: dict, session=None, **kw) -> int:
+        return await cls.get_collection().count_documents(filter, session=session, **kw)
+
+    async def distinct(cls: Type[T], key: str, filter: dict = None, session=None, **kw) -> list:
+        return await cls.get_collection().distinct(key, filter=filter, session=session, **kw)
+
+
+class AsyncMongoModelType(AsyncCollectionMixin, MongoModelType):
+    """Base class of `AsyncMongoModel`."""
+
+    def _register(cls) -> None:
+        # the index manager is synchronous; the indexes of async models are built by `build_indexes`
+        pass
+
+
+class AsyncMongoModel(MongoModel, metaclass=AsyncMongoModelType):
+    """A model whose calls to MongoDB are awaitable; set an async database of pymongo or Motor by `set_db`.
+
+    Indexes are not built automatically, since it cannot be awaited when the collection is set;
+    call `await build_indexes()` instead.
+    """
+
+    auto_build_index: bool = False
+
+    _db: Any = None
+    _collection: Any = None
+
+    _no_parse_hints: bool = True
+    __slots__ = ()
+
+    @hybridmethod
+    async def get(cls: Type[T], pk: Any) -> Optional[T]:
+        """See :meth:`~monom.mongo.MongoModel.get`."""
+        session = current_session()
+        if session is not None:
+            obj = session.lookup(cls, pk)
+            if obj is not None:
+                return obj
+        return await cls.find_one({'_id': pk})
+
+    @get.instancemethod
+    def get(self, name: str, default=None) -> Any:
+        return BaseModel.get(self, name, default)
+
+    async def save(self, full_update: bool = False, on_conflict: Callable[[Any], Any] = None,
+                   max_retries: int = 3, **kw):
+        """See :meth:`~monom.mongo.MongoModel.save`; `on_conflict` may be a coroutine function."""
+
+        while True:
+            try:
+                return await self._save(full_update, **kw)
+            except ConflictError:
+                if on_conflict is None or max_retries <= 0:
+                    raise
+            max_retries -= 1
+            await self.reload()
+            await _resolve(on_conflict(self))
+
+    async def _save(self, full_update: bool, **kw):
+        if self._state == 'marked_for_deletion':
+            await self.delete(**kw)
+            return self
+
+        write = self._prepare_save(full_update)
+        if write is not None:
+            method, args = write
+            self._finish_save(method, await getattr(type(self).get_collection(), method)(*args, **kw))
+        return self
+
+    async def reload(self):
+        """See :meth:`~monom.mongo.MongoModel.reload`."""
+        if self.pk is None:
+            raise RuntimeError("The document without an '_id' cannot be reloaded.")
+        self._reset(await type(self).get_collection().find_one({'_id': self.pk}))
+        return self
+
+    @classmethod
+    async def save_multiple(cls: Type[T],
+                            objs: Iterable[MongoModel],
+                            full_update: bool = False,
+                            upsert: bool = False,
+                            ordered: bool = True,
+                            chunk_size: int = 1000,
+                            raise_on_error: bool = True,
+                            **kw) -> SaveResult:
+        """See :meth:`~monom.mongo.MongoModel.save_multiple`; the collections are written concurrently."""
+
+        result, groups = _plan_save(objs, full_update, upsert)
+
+        async def flush(collection: Any, writes: List[tuple]) -> None:
+            group = _SaveGroup(result, ordered)
+            for requests in group.chunks(writes, chunk_size):
+                try:
+                    rv = await collection.bulk_write([request for *_, request in requests], ordered=ordered, **kw)
+                except BulkWriteError as err:
+                    details = err.details
+                else:
+                    details = rv.bulk_api_result
+                query = group.record(requests, details)
+                if query is not None:
+                    cursor = await _resolve(collection.find(*query, session=kw.get('session')))
+                    group.record_conflicts([doc async for doc in cursor])
+
+        # the models written are updated even if the writes of another collection raised
+        try:
+            # a session cannot be used by concurrent operations
+            if kw.get('session') is None:
+                rvs = await asyncio.gather(*(flush(collection, writes) for collection, writes in groups.items()),
+                                           return_exceptions=True)
+                for rv in rvs:
+                    if isinstance(rv, BaseException):
+                        raise rv
+            else:
+                for collection, writes in groups.items():
+                    await flush(collection, writes)
+        finally:
+            result.finish()
+
+        return result.raise_errors() if raise_on_error else result
+
+    async def delete(self, **kw) -> None:
+        """Delete the document from MongoDB"""
+        rv = await type(self).get_collection().delete_one(self._prepare_delete(), **kw)
+        self._finish_delete(rv)
+
+    def _load_field(self, name: str) -> Any:
+        # a missing field cannot be fetched without being awaited
+        return BaseModel._load_field(self, name)
+
+    @classmethod
+    def set_collection(cls, collection: Any, **options) -> None:
+        if isinstance(collection, str):
+            cls._collection = cls.get_db().get_collection(collection, **options)
+        elif not _collection_types or isinstance(collection, _collection_types):
+            cls._collection = collection
+        else:
+            raise ValueError('expect a string or an async collection, not type {!r}'.format(type(collection)))
+        cls._routed_collections = {}
+
+    @classmethod
+    async def build_indexes(cls) -> None:
+        """Create, drop or modify the indexes of the collection according to `Meta.indexes`."""
+        collection = cls.get_collection()
+        cursor = await _resolve(collection.list_indexes())
+        old = [index async for index in cursor]
+
+        creations = []
+        for method, args, kw in cls._index_changes(old, collection.name):
+            if method == 'create_index':
+                creations.append(IndexModel(*args, **kw))
+            elif method == 'command':
+                await collection.database.command(*args, **kw)
+            else:
+                await getattr(collection, method)(*args, **kw)
+        if creations:
+            await collection.create_indexes(creations)
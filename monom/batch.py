@@ -0,0 +1,384 @@
+"""
+Validate converted documents in batches.
+
+Documents are pivoted into columns, one per field, and each check of a field
+(required, type, validator, bounds) runs over the whole column at once.
+NumPy is used to compare numbers and lengths when it is installed.
+"""
+
+from collections import abc
+from itertools import repeat
+from typing import Any, Dict, List, MutableMapping, NamedTuple, Optional, Sequence, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from .fields import *
+from .fields import _missing
+from .utils import Missing, warn
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+__all__ = [
+    'BatchValidationError',
+    'ChunkError',
+    'InsertStreamResult',
+    'SaveError',
+    'SaveOutcome',
+    'SaveResult',
+    'validate_many',
+]
+
+# columns shorter than this are not worth being converted to numpy arrays
+NUMPY_MIN_SIZE = 64
+
+_plain_validators = {Field.validate, StringField.validate, NumberField.validate}
+
+
+class BatchValidationError(ValidationError):
+    """A :class:`ValidationError` telling which document and field are invalid."""
+
+    def __init__(self, msg, index: int, field: Optional[str]):
+        self.index = index
+        self.field = field
+        if field is None:
+            super().__init__('Document #{}: {}'.format(index, msg))
+        else:
+            super().__init__('Document #{}, field {!r}: {}'.format(index, field, msg))
+
+    @classmethod
+    def from_conversion(cls, model, document: Any, index: int, err: Exception) -> 'BatchValidationError':
+        """Make an error of a document failed to be converted, telling the first field that cannot be converted."""
+        field = None
+        if isinstance(document, abc.Mapping):
+            # noinspection PyProtectedMember
+            for fld in model._get_plan().fields.values():
+                try:
+                    fld.convert(document.get(fld.name, _missing))
+                except (TypeError, ValueError):
+                    field = fld.name
+                    break
+        return cls(str(err), index, field)
+
+
+class ChunkError(NamedTuple):
+    """An error occurred in a chunk of :meth:`~monom.mongo.CollectionMixin.insert_stream`."""
+
+    # the number of the chunk, counting from 0
+    chunk: int
+    # a :class:`BatchValidationError` of a document failed to be converted or validated,
+    # or a :class:`pymongo.errors.BulkWriteError`
+    error: Exception
+
+
+class InsertStreamResult:
+    """The aggregated result of :meth:`~monom.mongo.CollectionMixin.insert_stream`."""
+
+    def __init__(self):
+        self.inserted_count = 0
+        self.chunk_count = 0
+        self.errors: List[ChunkError] = []
+
+    def __repr__(self):
+        return '<{} inserted_count={} chunk_count={} errors={}>'.format(
+            self.__class__.__name__, self.inserted_count, self.chunk_count, len(self.errors)
+        )
+
+
+class SaveOutcome(NamedTuple):
+    """What happened to a model in :meth:`~monom.mongo.MongoModel.save_multiple`."""
+
+    obj: Any
+    # 'insert', 'update', 'replace', 'delete', or 'none' if nothing was changed
+    operation: str
+    # 'ok', 'failed', 'conflict' if the version of a versioned document was changed by another writer,
+    # or 'skipped' if it wasn't executed because of a preceding error
+    status: str
+    # the write error returned by MongoDB
+    error: Optional[dict] = None
+
+
+class SaveResult:
+    """The aggregated result of :meth:`~monom.mongo.MongoModel.save_multiple`.
+    It has the attributes of :class:`pymongo.results.BulkWriteResult`, indexed by the positions of the models.
+    """
+
+    _counts = ('nInserted', 'nMatched', 'nModified', 'nRemoved', 'nUpserted')
+
+    acknowledged = True
+
+    def __init__(self, size: int = 0):
+        # in the same order as the models
+        self.outcomes: List[Optional[SaveOutcome]] = [None] * size
+        self.counts = dict.fromkeys(self._counts, 0)
+        # the positions of the models upserted, and the `_id`s of their documents
+        self.upserted_ids: Dict[int, Any] = {}
+
+    def add_counts(self, result: dict) -> None:
+        for key in self._counts:
+            self.counts[key] += result.get(key, 0)
+
+    def finish(self) -> 'SaveResult':
+        """Update the states of the models written successfully."""
+        for outcome in self.outcomes:
+            # the models of a collection not written because another one raised have no outcomes
+            if outcome is not None and outcome.status == 'ok':
+                # noinspection PyProtectedMember
+                outcome.obj._after_write(outcome.operation)
+        return self
+
+    def raise_errors(self) -> 'SaveResult':
+        """Raise :class:`SaveError` if any write failed."""
+        if self.errors:
+            raise SaveError(self)
+        return self
+
+    @property
+    def inserted_count(self) -> int:
+        return self.counts['nInserted']
+
+    @property
+    def matched_count(self) -> int:
+        return self.counts['nMatched']
+
+    @property
+    def modified_count(self) -> int:
+        return self.counts['nModified']
+
+    @property
+    def deleted_count(self) -> int:
+        return self.counts['nRemoved']
+
+    @property
+    def upserted_count(self) -> int:
+        return self.counts['nUpserted']
+
+    @property
+    def errors(self) -> List[SaveOutcome]:
+        return [outcome for outcome in self.outcomes if outcome is not None and outcome.status == 'failed']
+
+    @property
+    def conflicts(self) -> List[SaveOutcome]:
+        return [outcome for outcome in self.outcomes if outcome is not None and outcome.status == 'conflict']
+
+    @property
+    def bulk_api_result(self) -> Dict[str, Any]:
+        """The counts, upserts and write errors in the format of a bulk write,
+        indexed by the positions of the models.
+        """
+        rv: Dict[str, Any] = dict(self.counts)
+        rv['upserted'] = [{'index': position, '_id': pk} for position, pk in sorted(self.upserted_ids.items())]
+        rv['writeErrors'] = [dict(outcome.error, index=position) for position, outcome in enumerate(self.outcomes)
+                             if outcome is not None and outcome.status == 'failed']
+        rv['writeConcernErrors'] = []
+        return rv
+
+    def __repr__(self):
+        return '<{} {} errors={}>'.format(
+            self.__class__.__name__, ' '.join('{}={}'.format(k, v) for k, v in self.counts.items()), len(self.errors)
+        )
+
+
+class SaveError(BulkWriteError):
+    """Raised by :meth:`~monom.mongo.MongoModel.save_multiple` if any write failed, after the models written
+    are updated; `details` are indexed by the positions of the models, and `result` is the :class:`SaveResult`.
+    """
+
+    def __init__(self, result: SaveResult):
+        self.result = result
+        super().__init__(result.bulk_api_result)
+
+    def __reduce__(self):
+        return self.__class__, (self.result,)
+
+
+def validate_many(model, docs: Sequence[MutableMapping], offset: int = 0) -> None:
+    """Validate converted documents of a model; an error is raised on the first invalid document,
+    as if the documents were validated one by one. `offset` is added to the index of the invalid document.
+    """
+
+    index, field = _first_invalid_document(model, docs, len(docs))
+    if index is None:
+        return
+
+    try:
+        field.validate(docs[index].get(field.name, _missing))
+    except ValidationError as err:
+        raise BatchValidationError(err.msg, index + offset, field.name) from None
+
+
+def _first_invalid_document(model, docs: Sequence[MutableMapping], limit: int) -> Tuple[Optional[int], Optional[Field]]:
+    # noinspection PyProtectedMember
+    plan = model._get_plan()
+    found, found_field = None, None
+
+    for field in plan.fields.values():
+        if limit == 0:
+            break
+        column = [doc.get(field.name, _missing) for doc in docs[:limit]]
+        # only the documents before the invalid one found so far need to be checked;
+        # so an invalid field wins over the fields after it in the same document
+        index = _first_invalid(field, column, limit)
+        if index is not None:
+            found, found_field, limit = index, field, index
+
+    if model.warn_extra_data:
+        names = plan.names
+        for doc in docs[:limit]:
+            for name in doc:
+                if name not in names:
+                    warn('{!r} not defined in model {!r}. Did you misspell it?'.format(name, model))
+
+    return found, found_field
+
+
+def _first_invalid(field: Field, values: List, limit: int) -> Optional[int]:
+    validate = type(field).validate
+    if validate in _plain_validators:
+        return _first_invalid_plain(field, values, limit)
+    if validate is ArrayField.validate:
+        return _first_invalid_array(field, values, limit)
+    if validate is EmbeddedField.validate:
+        return _first_invalid_embedded(field, values, limit)
+    return _first_invalid_value(field.validate, values, limit)
+
+
+def _first_invalid_value(validate, values: List, limit: int) -> Optional[int]:
+    for idx in range(limit):
+        try:
+            validate(values[idx])
+        except ValidationError:
+            return idx
+    return None
+
+
+def _first_index(values: List, predicate) -> Optional[int]:
+    for idx, value in enumerate(values):
+        if value is not _missing and predicate(value):
+            return idx
+    return None
+
+
+def _first_invalid_plain(field: Field, values: List, limit: int) -> Optional[int]:
+    values = values[:limit]
+    found = None
+
+    def shrink(idx: Optional[int]) -> None:
+        nonlocal values, found
+        if idx is not None:
+            values = values[:idx]
+            found = idx
+
+    if field.required:
+        shrink(next((idx for idx, value in enumerate(values) if value is _missing), None))
+
+    # check the distinct types first, which is much faster than checking every value
+    expected_types = field.expected_types
+    if not all(tp is Missing or issubclass(tp, expected_types) for tp in set(map(type, values))):
+        shrink(_first_index(values, lambda x: not isinstance(x, expected_types)))
+
+    validator = field.validator
+    if validator is not None:
+        shrink(_first_index(values, lambda x: not validator(x)))
+
+    for attr, measure in (('max_length', len), ('min_length', len), ('max_value', None), ('min_value', None)):
+        bound = getattr(field, attr, None)
+        if bound is None:
+            continue
+
+        present = [value for value in values if value is not _missing]
+        if measure is not None:
+            present = list(map(measure, present))
+        if not present:
+            break
+
+        if attr.startswith('max'):
+            if _exceeds_max(present, bound):
+                shrink(_first_index(values, lambda x: (measure(x) if measure else x) > bound))
+        else:
+            if _exceeds_min(present, bound):
+                shrink(_first_index(values, lambda x: (measure(x) if measure else x) < bound))
+
+    return found
+
+
+# integers beyond it lose precision as `float64`
+MAX_EXACT_FLOAT_INT = 2 ** 53
+
+
+def _as_array(values: List, bound: Any) -> Optional[Any]:
+    """Return the values as an array compared exactly with the bound, or `None` if they are compared in Python."""
+    if numpy is None or len(values) < NUMPY_MIN_SIZE:
+        return None
+    # mixed ints and floats would be cast to `float64`, and huge ints would compare wrongly;
+    # `bool` is a type of its own here, as `True > 0`, etc. is not a bounds check of numbers
+    types = set(map(type, values))
+    if types == {int} and type(bound) is int and -2 ** 63 <= bound < 2 ** 63:
+        try:
+            return numpy.array(values, dtype='int64')
+        except OverflowError:
+            return None
+    if types == {float} and (type(bound) is float or (type(bound) is int and abs(bound) <= MAX_EXACT_FLOAT_INT)):
+        return numpy.array(values, dtype='float64')
+    return None
+
+
+def _exceeds_max(values: List, bound: Any) -> bool:
+    arr = _as_array(values, bound)
+    if arr is not None:
+        return bool((arr > bound).any())
+    # not `max`, which may return a NaN hiding the values after it
+    return any(value > bound for value in values)
+
+
+def _exceeds_min(values: List, bound: Any) -> bool:
+    arr = _as_array(values, bound)
+    if arr is not None:
+        return bool((arr < bound).any())
+    return any(value < bound for value in values)
+
+
+def _first_invalid_array(field: ArrayField, values: List, limit: int) -> Optional[int]:
+    # the list itself is checked like a plain field
+    found = _first_invalid_plain(field, values, limit)
+    if found is not None:
+        limit = found
+
+    # flatten the items of all lists, and remember where they come from
+    items, owners = [], []
+    for idx in range(limit):
+        value = values[idx]
+        if value is not _missing:
+            items.extend(value)
+            owners.extend(repeat(idx, len(value)))
+
+    idx = _first_invalid(field.field, items, len(items))
+    if idx is not None:
+        return owners[idx]
+    return found
+
+
+def _first_invalid_embedded(field: EmbeddedField, values: List, limit: int) -> Optional[int]:
+    found = None
+    docs, owners = [], []
+
+    for idx in range(limit):
+        value = values[idx]
+        # embedded models have been validated already
+        if hasattr(value, '_skip_validate'):
+            continue
+        try:
+            Field.validate(field, value)
+        except ValidationError:
+            found = idx
+            break
+        if isinstance(value, abc.Mapping):
+            docs.append(value)
+            owners.append(idx)
+
+    idx, _ = _first_invalid_document(field.model, docs, len(docs))
+    if idx is not None:
+        return owners[idx]
+    return found
@@ -0,0 +1,467 @@
+"""
+Read-through caches of documents: looked up by primary keys, or queried by cursors.
+"""
+
+import hashlib
+import time
+from collections import abc, OrderedDict
+from operator import itemgetter
+from threading import Lock, Thread
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+from pymongo.errors import PyMongoError
+
+from .utils import LRUCache, warn
+
+__all__ = [
+    'CacheBackend',
+    'LRUBackend',
+    'PkCache',
+    'QueryCache',
+    'query_cache',
+    'query_fields',
+]
+
+_missing = object()
+
+
+class CacheBackend:
+    """The storage of :class:`PkCache`; the values are BSON bytes, or `None` for missing documents."""
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        """Return the value of the key; raise `KeyError` if it's not cached or expired."""
+        raise NotImplementedError
+
+    def set(self, key: Tuple, value: Optional[bytes], ttl: Optional[float]) -> None:
+        """Cache a value for `ttl` seconds, or until it's evicted if `ttl` is None."""
+        raise NotImplementedError
+
+    def delete(self, key: Tuple) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LRUBackend(CacheBackend):
+    """An in-process backend holding at most `maxsize` items, discarding the least recently used ones."""
+
+    def __init__(self, maxsize: int = 1024):
+        self._items = LRUCache(maxsize)
+
+    def get(self, key: Tuple) -> Optional[bytes]:
+        item = self._items.get(key)
+        if item is None:
+            raise KeyError(key)
+        expires, value = item
+        if expires is not None and expires < time.monotonic():
+            self._items.pop(key)
+            raise KeyError(key)
+        return value
+
+    def set(self, key: Tuple, value: Optional[bytes], ttl: Optional[float]) -> None:
+        self._items[key] = (None if ttl is None else time.monotonic() + ttl, value)
+
+    def delete(self, key: Tuple) -> None:
+        self._items.pop(key)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PkCache:
+    """Cache the documents looked up by `Model.get(pk)` or `Model.find_one({'_id': pk})` without other arguments.
+
+    Documents are cached as BSON, so every lookup gets its own copy. Misses are cached for `negative_ttl`
+    seconds if it's given. The cached documents are invalidated by the writes issued through the models;
+    a write whose filter isn't a primary key invalidates all documents of the collection.
+    A cache may be shared by models of different collections.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, negative_ttl: float = None,
+                 backend: CacheBackend = None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.backend = backend if backend is not None else LRUBackend(maxsize)
+        self.hits = 0
+        self.misses = 0
+        # bumped to invalidate all documents of a collection
+        self._generations: Dict[str, int] = {}
+        # bumped by every invalidation of a collection; a document read during an invalidation is not cached
+        self._versions: Dict[str, int] = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def pk_of(filter: Any) -> Any:
+        """Return the primary key if the filter matches a single primary key, else a sentinel.
+
+        >>> PkCache.pk_of({'_id': 1})
+        1
+        >>> PkCache.pk_of({'_id': {'$in': [1, 2]}}) is PkCache.pk_of({'_id': 1, 'a': 2}) is _missing
+        True
+        """
+        if not isinstance(filter, abc.Mapping) or len(filter) != 1 or '_id' not in filter:
+            return _missing
+        pk = filter['_id']
+        if isinstance(pk, (abc.Mapping, list)):
+            return _missing
+        try:
+            hash(pk)
+        except TypeError:
+            return _missing
+        return pk
+
+    def _key(self, collection, pk: Hashable) -> Tuple:
+        name = collection.full_name
+        return name, self._generations.get(name, 0), pk
+
+    def _lookup(self, collection, pk: Hashable) -> Tuple[Any, Tuple, int]:
+        key = self._key(collection, pk)
+        version = self._versions.get(collection.full_name, 0)
+        try:
+            value = self.backend.get(key)
+        except KeyError:
+            self.misses += 1
+            return _missing, key, version
+
+        self.hits += 1
+        if value is None:
+            return None, key, version
+        return bson.decode(value, codec_options=collection.codec_options), key, version
+
+    def _store(self, collection, key: Tuple, version: int, doc: Optional[abc.Mapping]) -> None:
+        if doc is None:
+            if self.negative_ttl is None:
+                return
+            value, ttl = None, self.negative_ttl
+        else:
+            value, ttl = bson.encode(doc, codec_options=collection.codec_options), self.ttl
+
+        with self._lock:
+            if self._versions.get(collection.full_name, 0) == version:
+                self.backend.set(key, value, ttl)
+
+    def fetch(self, collection, pk: Hashable, load: Callable[[], Optional[abc.Mapping]]) -> Optional[abc.Mapping]:
+        """Return the cached document of the primary key, or load and cache it."""
+        doc, key, version = self._lookup(collection, pk)
+        if doc is _missing:
+            doc = load()
+            self._store(collection, key, version, doc)
+        return doc
+
+    async def fetch_async(self, collection, pk: Hashable,
+                          load: Callable[[], Awaitable[Optional[abc.Mapping]]]) -> Optional[abc.Mapping]:
+        doc, key, version = self._lookup(collection, pk)
+        if doc is _missing:
+            doc = await load()
+            self._store(collection, key, version, doc)
+        return doc
+
+    def invalidate(self, collection, filter: Any = None) -> None:
+        """Invalidate the document matched by a filter of primary key, or all documents of the collection."""
+        name = collection.full_name
+        pk = self.pk_of(filter)
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            if pk is _missing:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            else:
+                self.backend.delete(self._key(collection, pk))
+
+    def invalidate_pk(self, collection, pk: Any) -> None:
+        self.invalidate(collection, {'_id': pk})
+
+    def clear(self) -> None:
+        with self._lock:
+            self.backend.clear()
+            self._generations.clear()
+            self._versions = {name: version + 1 for name, version in self._versions.items()}
+
+
+# the operators whose values are lists of filters
+_LOGICAL_OPERATORS = ('$and', '$or', '$nor')
+
+
+def query_fields(filter: Any) -> Optional[FrozenSet[str]]:
+    """Return the top-level fields referenced by a filter, or `None` if they cannot be told, e.g. by `$expr`.
+
+    >>> sorted(query_fields({'a': 1, '$or': [{'b.c': 2}, {'d': {'$gt': 1}}]}))
+    ['a', 'b', 'd']
+    >>> query_fields({'$expr': {'$gt': ['$a', '$b']}}) is None
+    True
+    """
+    fields = set()
+    for key, value in (filter or {}).items():
+        if key in _LOGICAL_OPERATORS:
+            for clause in value:
+                clause_fields = query_fields(clause)
+                if clause_fields is None:
+                    return None
+                fields |= clause_fields
+        elif key == '$comment':
+            continue
+        elif key.startswith('$'):
+            return None
+        else:
+            fields.add(key.split('.', 1)[0])
+    return frozenset(fields)
+
+
+def _canonical_filter(filter: Any) -> Any:
+    # the order of fields and operators doesn't matter, unlike that of embedded documents matched as a whole
+    if not isinstance(filter, abc.Mapping):
+        return filter
+    return SON(sorted(((key, _canonical_value(key, value)) for key, value in filter.items()), key=itemgetter(0)))
+
+
+def _canonical_value(key: str, value: Any) -> Any:
+    if key in _LOGICAL_OPERATORS and isinstance(value, list):
+        return [_canonical_filter(clause) for clause in value]
+    if key == '$elemMatch' or (isinstance(value, abc.Mapping) and value and
+                               all(str(name).startswith('$') for name in value)):
+        return _canonical_filter(value)
+    return value
+
+
+def _cursor_option(cursor, name: str) -> Any:
+    # pymongo 3 mangles the names of the options
+    try:
+        return getattr(cursor, '_' + name)
+    except AttributeError:
+        for cls in type(cursor).__mro__:
+            try:
+                return getattr(cursor, '_{}__{}'.format(cls.__name__, name))
+            except AttributeError:
+                pass
+    return None
+
+
+class _Entry(NamedTuple):
+    namespace: str
+    expires: Optional[float]
+    data: bytes
+    # the `_id`s of the documents, or `None` if unknown
+    ids: Optional[FrozenSet[Hashable]]
+    # the top-level fields referenced by the filter and sort, or `None` if unknown
+    fields: Optional[FrozenSet[str]]
+    skip: int
+
+
+class _Watcher(Thread):
+    """Tail the change stream of a collection, and evict the cached queries affected by the changes."""
+
+    # how long a wait for changes lasts, so a closed watcher stops in time
+    max_await_time_ms = 1000
+
+    def __init__(self, cache: 'QueryCache', collection):
+        super().__init__(name='monom-watch-{}'.format(collection.full_name), daemon=True)
+        self.cache = cache
+        self.namespace = collection.full_name
+        codec_options = collection.codec_options.with_options(document_class=dict)
+        # opened here, so the changes made after it returns are seen
+        self.stream = collection.with_options(codec_options=codec_options).watch(
+            max_await_time_ms=self.max_await_time_ms
+        )
+        self.closed = False
+
+    def run(self) -> None:
+        try:
+            while not self.closed and self.stream.alive:
+                change = self.stream.try_next()
+                if change is not None:
+                    self.cache._on_change(self.namespace, change)
+        except PyMongoError as err:
+            if not self.closed:
+                warn('The change stream of {!r} failed, its cached queries are dropped: {}'.format(
+                    self.namespace, err
+                ))
+        finally:
+            self.stream.close()
+            self.cache._unwatch(self)
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class QueryCache:
+    """Cache the documents of the queries run by `Model.find(...).cached()`.
+
+    A query is keyed by a canonical hash of its collection, filter, projection, sort, skip, limit, hint and collation,
+    so filters differing only in the order of their fields share an entry. Documents are cached as BSON, so every
+    query gets its own models. At most `maxsize` queries are cached, for `ttl` seconds if it's given.
+
+    The cache tails a change stream of each collection queried, which requires a replica set or a sharded cluster,
+    so the writes of any process evict the queries they may affect. Queries of collections without a change stream
+    are not cached. A cache may be shared by models of different collections.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[bytes, _Entry]' = OrderedDict()
+        # bumped by every change of a collection; a query run during a change is not cached
+        self._versions: Dict[str, int] = {}
+        self._watchers: Dict[str, _Watcher] = {}
+        # the collections whose change streams cannot be opened
+        self._unwatchable = set()
+        self._lock = Lock()
+        self._watch_lock = Lock()
+
+    @staticmethod
+    def key_of(cursor) -> bytes:
+        """Return the canonical hash of the query of a cursor."""
+        ordering = _cursor_option(cursor, 'ordering')
+        query = SON([
+            ('ns', cursor.collection.full_name),
+            ('filter', _canonical_filter(_cursor_option(cursor, 'spec'))),
+            ('projection', _canonical_filter(_cursor_option(cursor, 'projection'))),
+            ('sort', None if ordering is None else [list(item) for item in ordering.items()]),
+            ('skip', _cursor_option(cursor, 'skip')),
+            ('limit', _cursor_option(cursor, 'limit')),
+            ('hint', _cursor_option(cursor, 'hint')),
+            ('collation', _cursor_option(cursor, 'collation')),
+        ])
+        return hashlib.sha1(bson.encode(query)).digest()
+
+    def fetch(self, cursor, load: Callable[[], Iterable[abc.Mapping]], ttl: float = None) -> List[abc.Mapping]:
+        """Return the cached documents of the query of a cursor, or load them and cache them for `ttl` seconds,
+        by default `self.ttl`.
+        """
+        collection = cursor.collection
+        key = self.key_of(cursor)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires is None or entry.expires >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return bson.decode_all(entry.data, collection.codec_options)
+                del self._entries[key]
+            self.misses += 1
+
+        if not self._watch(collection):
+            return list(load())
+        version = self._versions.get(collection.full_name, 0)
+        docs = list(load())
+        self._store(cursor, key, version, docs, self.ttl if ttl is None else ttl)
+        return docs
+
+    def _store(self, cursor, key: bytes, version: int, docs: List[abc.Mapping], ttl: Optional[float]) -> None:
+        collection = cursor.collection
+        data = b''.join(doc.raw if isinstance(doc, RawBSONDocument) else
+                        bson.encode(doc, codec_options=collection.codec_options) for doc in docs)
+        try:
+            ids = frozenset(doc['_id'] for doc in docs)
+        except (KeyError, TypeError):
+            ids = None
+        fields = query_fields(_cursor_option(cursor, 'spec'))
+        ordering = _cursor_option(cursor, 'ordering')
+        if fields is not None and ordering:
+            fields |= {name.split('.', 1)[0] for name in ordering}
+        entry = _Entry(collection.full_name, None if ttl is None else time.monotonic() + ttl, data, ids, fields,
+                       _cursor_option(cursor, 'skip') or 0)
+
+        with self._lock:
+            if self._versions.get(collection.full_name, 0) != version:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _watch(self, collection) -> bool:
+        """Start watching the collection if not yet; return whether it's watched."""
+        namespace = collection.full_name
+        if namespace in self._watchers:
+            return True
+        if namespace in self._unwatchable:
+            return False
+        with self._watch_lock:
+            if namespace in self._watchers:
+                return True
+            try:
+                watcher = _Watcher(self, collection)
+            except PyMongoError as err:
+                self._unwatchable.add(namespace)
+                warn('Queries of {!r} are not cached, since its change stream cannot be opened: {}'.format(
+                    namespace, err
+                ))
+                return False
+            self._watchers[namespace] = watcher
+            watcher.start()
+            return True
+
+    def _unwatch(self, watcher: _Watcher) -> None:
+        with self._watch_lock:
+            if self._watchers.get(watcher.namespace) is watcher:
+                del self._watchers[watcher.namespace]
+        # the changes are not seen anymore
+        self.invalidate(watcher.namespace)
+
+    @staticmethod
+    def _affects(change: abc.Mapping, entry: _Entry) -> bool:
+        operation = change.get('operationType')
+        if operation not in ('update', 'delete'):
+            # inserted or replaced documents may match any query, and other events invalidate the stream
+            return True
+        try:
+            pk = change['documentKey']['_id']
+            if entry.ids is None or pk in entry.ids:
+                return True
+        except (KeyError, TypeError):
+            return True
+        if operation == 'delete':
+            # the documents skipped by the query may be deleted
+            return entry.skip > 0
+
+        # an updated document not in the results comes into them only if the fields it's matched or sorted by change
+        if entry.fields is None:
+            return True
+        description = change.get('updateDescription') or {}
+        names = [*(description.get('updatedFields') or {}), *(description.get('removedFields') or []),
+                 *(array['field'] for array in description.get('truncatedArrays') or [])]
+        return any(name.split('.', 1)[0] in entry.fields for name in names)
+
+    def _on_change(self, namespace: str, change: abc.Mapping) -> None:
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            for key, entry in list(self._entries.items()):
+                if entry.namespace == namespace and self._affects(change, entry):
+                    del self._entries[key]
+
+    def invalidate(self, namespace: str = None) -> None:
+        """Evict the queries of a collection by its full name, or all queries."""
+        with self._lock:
+            for name in {*self._versions, *self._watchers} if namespace is None else [namespace]:
+                self._versions[name] = self._versions.get(name, 0) + 1
+            for key, entry in list(self._entries.items()):
+                if namespace is None or entry.namespace == namespace:
+                    del self._entries[key]
+
+    def clear(self) -> None:
+        self.invalidate()
+
+    def close(self) -> None:
+        """Stop watching the collections, and evict all queries."""
+        with self._watch_lock:
+            watchers = list(self._watchers.values())
+            self._watchers.clear()
+            self._unwatchable.clear()
+        for watcher in watchers:
+            watcher.close()
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# used by `Cursor.cached` unless a cache is given
+query_cache = QueryCache()
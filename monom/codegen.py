@@ -0,0 +1,260 @@
+"""
+Generate specialized functions to convert and validate the data of a model,
+the way `dataclasses` generates `__init__`.
+"""
+
+from collections import abc
+from typing import Any, Callable, Dict, List, Tuple
+
+from .fields import *
+from .fields import _missing, validate_type, validate_max_length, validate_min_length, \
+    validate_max_value, validate_min_value
+from .utils import warn
+
+__all__ = [
+    'compile_plan',
+]
+
+# fields whose `convert` and `validate` are fully understood by the generator;
+# the others (embedded fields, arrays of models and user-defined fields) are called as they are.
+_plain_validators = {Field.validate, StringField.validate, NumberField.validate}
+
+_bounds = (
+    ('max_length', 'len(value) >', 'validate_max_length'),
+    ('min_length', 'len(value) <', 'validate_min_length'),
+    ('max_value', 'value >', 'validate_max_value'),
+    ('min_value', 'value <', 'validate_min_value'),
+)
+
+
+def _is_plain(field: Field) -> bool:
+    cls = type(field)
+    return cls.convert is Field.convert and cls.validate in _plain_validators
+
+
+def _is_bare(field: Field) -> bool:
+    """A plain field without any option; only its type needs to be checked."""
+    return _is_plain(field) and field.default is _missing and not field.required and \
+        field.converter is None and field.validator is None and \
+        all(getattr(field, attr, None) is None for attr, _, _ in _bounds)
+
+
+def _is_simple_array(field: Field) -> bool:
+    """An array of bare fields, e.g. `List[str]`; its items can be copied and checked in a tight loop."""
+    return type(field) is ArrayField and _is_bare(field.field)
+
+
+def _is_inlined(field: Field) -> bool:
+    return _is_plain(field) or _is_simple_array(field)
+
+
+def _indent(lines: List[str], level: int = 1) -> List[str]:
+    return ['    ' * level + line for line in lines]
+
+
+def _make_function(name: str, lines: List[str], namespace: Dict[str, Any]) -> Callable:
+    source = '\n'.join(lines)
+    exec(compile(source, '<monom generated {}>'.format(name), 'exec'), namespace)
+    return namespace[name]
+
+
+def _convert_lines(idx: int, attr: str, field: Field, namespace: Dict[str, Any]) -> Tuple[List[str], bool]:
+    """Return lines leaving the converted value in `value`, and whether the value may be missing."""
+
+    default = field.default
+    converter = field.converter
+    namespace['d{}'.format(idx)] = default
+    namespace['c{}'.format(idx)] = converter
+
+    if default is not _missing and not callable(default):
+        lines = ['value = get({!r}, d{})'.format(attr, idx)]
+        may_be_missing = False
+    else:
+        lines = ['value = get({!r}, _missing)'.format(attr)]
+        if default is not _missing:
+            lines += ['if value is _missing:', '    value = d{}()'.format(idx)]
+        may_be_missing = True
+
+    after = []
+    if converter is not None:
+        after.append('value = c{}(value)'.format(idx))
+    if _is_simple_array(field):
+        after += [
+            'if not isinstance(value, list_types):',
+            "    raise ValueError('{!r} must be a list-like object, not a {!r}.'.format(value, type(value)))",
+            'value = list(value)',
+        ]
+
+    if after and may_be_missing:
+        lines.append('if value is not _missing:')
+        lines += _indent(after)
+    else:
+        lines += after
+    return lines, may_be_missing
+
+
+def _validate_lines(idx: int, field: Field, namespace: Dict[str, Any]) -> List[str]:
+    """Return lines validating the converted value in `value`."""
+
+    checks = []
+    expected_types = field.expected_types
+    if expected_types != (object,):
+        namespace['t{}'.format(idx)] = expected_types
+        checks += [
+            'if not isinstance(value, t{}):'.format(idx),
+            '    validate_type(value, t{})'.format(idx),
+        ]
+    if field.validator is not None:
+        namespace['v{}'.format(idx)] = field.validator
+        checks += [
+            'if not v{}(value):'.format(idx),
+            "    raise ValidationError('{{!r}} was not accepted by validator {{!r}}.'.format(value, v{}))".format(idx),
+        ]
+    for attr, compare, func in _bounds:
+        bound = getattr(field, attr, None)
+        if bound is not None:
+            namespace['{}{}'.format(attr, idx)] = bound
+            checks += [
+                'if {} {}{}:'.format(compare, attr, idx),
+                '    {}(value, {}{})'.format(func, attr, idx),
+            ]
+    if _is_simple_array(field):
+        item_types = field.field.expected_types
+        if item_types != (object,):
+            namespace['it{}'.format(idx)] = item_types
+            checks += [
+                'for item in value:',
+                '    if not isinstance(item, it{}):'.format(idx),
+                '        validate_type(item, it{})'.format(idx),
+            ]
+
+    lines = []
+    if field.required:
+        lines += [
+            'if value is _missing:',
+            "    raise ValidationError('Field {{!r}} is missing.'.format({!r}))".format(field.name),
+        ]
+    if checks:
+        lines.append('if value is not _missing:')
+        lines += _indent(checks)
+    return lines
+
+
+def _assign_lines(field: Field, may_be_missing: bool) -> List[str]:
+    if may_be_missing:
+        return ['if value is not _missing:', '    rv[{!r}] = value'.format(field.name)]
+    return ['rv[{!r}] = value'.format(field.name)]
+
+
+def _gen_convert(plan, namespace: Dict[str, Any]) -> List[str]:
+    lines = [
+        'def convert(obj):',
+        '    rv = model.dict_class()',
+        '    get = obj.get',
+    ]
+
+    for idx, (attr, field) in enumerate(plan.fields.items()):
+        if _is_inlined(field):
+            converted, may_be_missing = _convert_lines(idx, attr, field, namespace)
+        else:
+            namespace['f{}'.format(idx)] = field
+            converted, may_be_missing = ['value = f{}.convert(get({!r}, _missing))'.format(idx, attr)], True
+        lines += _indent(converted + _assign_lines(field, may_be_missing))
+
+    lines += [
+        '    for key, value in obj.items():',
+        '        if key not in attrs:',
+        '            rv[key] = value',
+        '    return rv',
+    ]
+    return lines
+
+
+def _gen_validate(plan, namespace: Dict[str, Any]) -> List[str]:
+    lines = [
+        'def validate(obj):',
+        '    get = obj.get',
+    ]
+
+    for idx, field in enumerate(plan.fields.values()):
+        if not _is_inlined(field):
+            namespace['f{}'.format(idx)] = field
+            lines += _indent(['f{}.validate(get({!r}, _missing))'.format(idx, field.name)])
+            continue
+
+        validated = _validate_lines(idx, field, namespace)
+        if validated:
+            lines += _indent(['value = get({!r}, _missing)'.format(field.name)] + validated)
+
+    lines += [
+        '    if model.warn_extra_data:',
+        '        for key in obj:',
+        '            if key not in names:',
+        "                warn('{!r} not defined in model {!r}. Did you misspell it?'.format(key, model))",
+    ]
+    return lines
+
+
+def _gen_clean(plan, namespace: Dict[str, Any]) -> List[str]:
+    lines = [
+        'def clean(obj):',
+    ]
+    if plan.aliases:
+        # items keyed by aliases are copied by `convert`, and validated as the fields
+        lines += [
+            '    if not aliases.isdisjoint(obj):',
+            '        rv = convert(obj)',
+            '        validate(rv)',
+            '        return rv',
+        ]
+    lines += [
+        '    rv = model.dict_class()',
+        '    get = obj.get',
+    ]
+
+    for idx, (attr, field) in enumerate(plan.fields.items()):
+        if _is_inlined(field):
+            converted, may_be_missing = _convert_lines(idx, attr, field, namespace)
+            converted += _validate_lines(idx, field, namespace)
+        else:
+            namespace['f{}'.format(idx)] = field
+            converted, may_be_missing = ['value = f{}.clean(get({!r}, _missing))'.format(idx, attr)], True
+        lines += _indent(converted + _assign_lines(field, may_be_missing))
+
+    lines += [
+        '    warn_extra_data = model.warn_extra_data',
+        '    for key, value in obj.items():',
+        '        if key not in attrs:',
+        '            rv[key] = value',
+        '            if warn_extra_data and key not in names:',
+        "                warn('{!r} not defined in model {!r}. Did you misspell it?'.format(key, model))",
+        '    return rv',
+    ]
+    return lines
+
+
+def compile_plan(plan) -> Tuple[Callable, Callable, Callable]:
+    """Generate the `convert`, `validate` and `clean` functions for a :class:`~monom.model.ModelPlan`.
+    Options of fields are inlined into the source, so changing them afterwards has no effect.
+    """
+
+    namespace = {
+        '_missing': _missing,
+        'ValidationError': ValidationError,
+        'validate_type': validate_type,
+        'validate_max_length': validate_max_length,
+        'validate_min_length': validate_min_length,
+        'validate_max_value': validate_max_value,
+        'validate_min_value': validate_min_value,
+        'warn': warn,
+        'list_types': (abc.MutableSequence, tuple),
+        'model': plan.model,
+        'attrs': frozenset(plan.fields),
+        'names': plan.names,
+        'aliases': plan.aliases,
+    }
+
+    convert = _make_function('convert', _gen_convert(plan, namespace), namespace)
+    validate = _make_function('validate', _gen_validate(plan, namespace), namespace)
+    clean = _make_function('clean', _gen_clean(plan, namespace), namespace)
+    return convert, validate, clean
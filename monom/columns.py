@@ -0,0 +1,186 @@
+"""
+Export the documents of a query to NumPy arrays, one per field.
+
+The arrays are typed by the declared fields, and filled batch by batch from the documents
+received from the server, without constructing models. A column with values of other types than
+its declared field, e.g. strings in an `IntField`, is kept as Python objects.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from bson.int64 import Int64
+
+from .fields import BooleanField, DateTimeField, EmbeddedField, Field, FloatField, IntField, NumberField
+from .utils import warn
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+__all__ = [
+    'column_dtype',
+    'to_columns',
+]
+
+# the first matching class decides; other fields are kept as Python objects
+_dtypes = (
+    (BooleanField, 'bool'),
+    (IntField, 'int64'),
+    (FloatField, 'float64'),
+    (NumberField, 'float64'),
+    (DateTimeField, 'datetime64[ms]'),
+)
+
+# the types of the values stored in the columns of each dtype, besides `None`
+_types: Dict[str, FrozenSet[type]] = {
+    'bool': frozenset([bool, type(None)]),
+    'int64': frozenset([int, Int64, type(None)]),
+    'float64': frozenset([float, int, Int64, type(None)]),
+    'datetime64[ms]': frozenset([datetime, type(None)]),
+}
+
+
+def column_dtype(field: Field) -> str:
+    """Return the dtype of the column of a field.
+
+    >>> column_dtype(IntField()), column_dtype(DateTimeField()), column_dtype(Field())
+    ('int64', 'datetime64[ms]', 'object')
+    """
+    for cls, dtype in _dtypes:
+        if isinstance(field, cls):
+            return dtype
+    return 'object'
+
+
+def _resolve(model, path: str) -> Tuple[Field, Tuple[str, ...]]:
+    """Return the field of a dot path of attributes, and the keys of its value in documents."""
+    field = None
+    keys = []
+    for attr in path.split('.'):
+        if field is not None:
+            if not isinstance(field, EmbeddedField):
+                raise ValueError('{!r} is not an embedded document, in {!r}.'.format(field.name, path))
+            model = field.model
+        field = getattr(model, attr, None)
+        if not isinstance(field, Field):
+            raise ValueError('{!r} is not a field of {!r}, in {!r}.'.format(attr, model, path))
+        keys.append(field.name)
+    return field, tuple(keys)
+
+
+def _values(docs: Sequence, keys: Tuple[str, ...]) -> List[Any]:
+    if len(keys) == 1:
+        key = keys[0]
+        return [doc.get(key) for doc in docs]
+
+    rv = []
+    for doc in docs:
+        value = doc
+        for key in keys:
+            value = value.get(key) if hasattr(value, 'get') else None
+        rv.append(value)
+    return rv
+
+
+def _utc(value: datetime) -> datetime:
+    # numpy takes naive datetimes as UTC, and deprecates aware ones
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _chunk(values: List[Any], dtype: str) -> Tuple[Any, Any]:
+    """Return the data and mask of a batch of values of a column;
+    raise `TypeError` if a value is not of the types of the dtype.
+    """
+    count = len(values)
+    mask = numpy.fromiter((value is None for value in values), bool, count)
+    if dtype == 'object':
+        data = numpy.empty(count, dtype=object)
+        data[:] = values
+        return data, mask
+
+    # numpy would parse strings, truncate floats, etc. silently
+    drifted = set(map(type, values)) - _types[dtype]
+    if drifted:
+        raise TypeError('Values of {} cannot be stored as {}.'.format(
+            ', '.join(sorted(cls.__name__ for cls in drifted)), dtype
+        ))
+    if dtype.startswith('datetime64'):
+        # `None` becomes `NaT`
+        data = numpy.array([None if value is None else _utc(value) for value in values], dtype=dtype)
+    else:
+        try:
+            data = numpy.fromiter((0 if value is None else value for value in values), dtype, count)
+        except OverflowError as err:
+            raise TypeError('Values out of the range of {}: {}'.format(dtype, err)) from None
+    return data, mask
+
+
+class _Column:
+    """The values of a field in the documents, appended batch by batch to arrays which grow by doubling."""
+
+    def __init__(self, path: str, keys: Tuple[str, ...], dtype: str):
+        self.path = path
+        self.keys = keys
+        self.dtype = dtype
+        self.size = 0
+        self.data = numpy.empty(0, dtype=dtype)
+        self.mask = numpy.empty(0, dtype=bool)
+
+    def append(self, docs: Sequence) -> None:
+        values = _values(docs, self.keys)
+        try:
+            data, mask = _chunk(values, self.dtype)
+        except TypeError as err:
+            warn('The column {!r} is kept as Python objects: {}'.format(self.path, err))
+            self.dtype = 'object'
+            # the values of the previous batches are converted to Python objects too
+            self.data = self.data.astype(object)
+            data, mask = _chunk(values, self.dtype)
+
+        end = self.size + len(values)
+        if end > len(self.data):
+            self._resize(max(end, 2 * len(self.data)))
+        self.data[self.size:end] = data
+        self.mask[self.size:end] = mask
+        self.size = end
+
+    def _resize(self, capacity: int) -> None:
+        # in place, so the old arrays are not kept besides the new ones
+        self.data.resize(capacity, refcheck=False)
+        self.mask.resize(capacity, refcheck=False)
+
+    def to_array(self) -> Any:
+        self._resize(self.size)
+        return numpy.ma.MaskedArray(self.data, mask=self.mask)
+
+
+def to_columns(cursor, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Return the values of the fields (dot paths of attributes, by default all fields of the model)
+    in the documents of a :class:`~monom.mongo.Cursor`, as masked arrays keyed by the paths.
+    Missing and `None` values are masked; a column with values of other types than its field is
+    of Python objects, and a warning is logged.
+    """
+    if numpy is None:
+        raise RuntimeError('`to_columns` requires NumPy; install it by `pip install monom[numpy]`.')
+
+    model = cursor.model_cls
+    if fields is None:
+        # noinspection PyProtectedMember
+        fields = list(model._get_plan().fields)
+    columns = []
+    for path in fields:
+        field, keys = _resolve(model, path)
+        columns.append(_Column(path, keys, column_dtype(field)))
+
+    while True:
+        # noinspection PyProtectedMember
+        docs = cursor._next_batch()
+        if not docs:
+            break
+        for column in columns:
+            column.append(docs)
+    return {column.path: column.to_array() for column in columns}
@@ -4,6 +4,7 @@ from typing import Any, Callable, MutableMapping, MutableSequence, Union, Dict
 
 from bson.objectid import ObjectId
 
+from .tracking import Tracker, TrackedModelList, track
 from .utils import *
 
 __all__ = [
@@ -21,6 +22,8 @@ __all__ = [
     'ListField',
     'ArrayField',
     'AnyField',
+    'ReferenceField',
+    'Ref',
     'ValidationError'
 ]
 
@@ -104,50 +107,71 @@ class Field:
             if self.validator is not None:
                 validate_fn(value, self.validator)
 
+    def clean(self, value: Any) -> Any:
+        """Convert and validate the value in one pass over it."""
+        value = self.convert(value)
+        self.validate(value)
+        return value
+
     def __get__(self, instance, cls) -> Any:
         if instance is None:
             return self
 
-        dk = instance.__dict__
         name = self.name
 
+        profile = instance._profile
+        if profile is not None:
+            profile.read(name)
+
         try:
-            value = dk['_data'][name]
+            value = instance._data[name]
         except KeyError:
-            raise AttributeError('Field {!r} has no value; '
-                                 'did you filter it out using projection query?'.format(name)) from None
+            # noinspection PyProtectedMember
+            value = instance._load_field(name)
 
-        if not isinstance(self, (EmbeddedField, ArrayField)):
+        if not isinstance(self, (DictField, ListField)):
             return value
 
-        if name not in dk:
-            if isinstance(self, EmbeddedField):
-                # noinspection PyProtectedMember
-                rv = self.model._from_clean_data(value)
-            else:
-                rv = self._convert_data_in_list_to_model(value)
-            dk[name] = rv
+        # wrappers of embedded documents and tracked containers are cached on first access
+        wrappers = instance._wrappers
+        if name in wrappers:
+            rv = wrappers[name]
+            # noinspection PyProtectedMember
+            if not isinstance(rv, Tracker) or rv._tracks(value):
+                return rv
 
-        return dk[name]
+        if isinstance(self, EmbeddedField):
+            # noinspection PyProtectedMember
+            rv = self.model._from_clean_data(value)
+        elif isinstance(self, ArrayField) and isinstance(self.field, EmbeddedField) and isinstance(value, list):
+            rv = TrackedModelList(self.field, value)
+        elif isinstance(self, ArrayField) and isinstance(self.innermost(), (EmbeddedField, ReferenceField)):
+            rv = self._convert_data_in_list_to_model(value)
+        else:
+            if isinstance(self, ArrayField):
+                # raises if the value is not a list
+                self._convert_data_in_list_to_model(value)
+            rv = track(value)
+            if rv is not value:
+                instance._data[name] = rv
+        wrappers[name] = rv
+        return rv
 
     def __set__(self, instance, value):
-        value = self.convert(value)
-        self.validate(value)
-
-        dk = instance.__dict__
+        value = self.clean(value)
         name = self.name
 
-        dk['_data'][name] = value
+        instance._data[name] = value
         if isinstance(self, EmbeddedField):
             # noinspection PyProtectedMember
-            dk[name] = self.model._from_clean_data(value)
-        if isinstance(self, ArrayField):
-            dk[name] = self._convert_data_in_list_to_model(value)
+            instance._wrappers[name] = self.model._from_clean_data(value)
+        elif isinstance(self, (DictField, ListField)):
+            # arrays of models and tracked containers are made on access
+            instance._wrappers.pop(name, None)
 
     def __delete__(self, instance):
-        dk = instance.__dict__
-        dk['_data'].pop(self.name, None)
-        dk.pop(self.name, None)
+        instance._data.pop(self.name, None)
+        instance._wrappers.pop(self.name, None)
 
     def __str__(self):
         string = []
@@ -254,6 +278,30 @@ class ArrayField(ListField):
         for value in values:
             self.field.validate(value)
 
+    def clean(self, values: Any) -> Union[MutableSequence, Missing]:
+        values = super().convert(values)
+        if values is _missing:
+            super().validate(values)
+            return _missing
+
+        if not isinstance(values, (abc.MutableSequence, tuple)):
+            raise ValueError('{!r} must be a list-like object, not a {!r}.'.format(values, type(values)))
+
+        field = self.field
+        if type(field).clean is Field.clean:
+            convert, validate = field.convert, field.validate
+            rv = []
+            for value in values:
+                value = convert(value)
+                validate(value)
+                rv.append(value)
+        else:
+            clean = field.clean
+            rv = [clean(value) for value in values]
+
+        super().validate(rv)
+        return rv
+
     def innermost(self) -> Field:
         def inner(array_field: ArrayField):
             field = array_field.field
@@ -268,7 +316,7 @@ class ArrayField(ListField):
             if not isinstance(vals, abc.MutableSequence):
                 raise ValueError('{!r} must be a list-like object, not a {!r}.'.format(vals, type(vals)))
 
-            if not isinstance(self.innermost(), EmbeddedField):
+            if not isinstance(self.innermost(), (EmbeddedField, ReferenceField)):
                 return vals
 
             field = array_field.field
@@ -277,6 +325,9 @@ class ArrayField(ListField):
                 cls = field.model
                 return [cls._from_clean_data(value) for value in vals]
 
+            if isinstance(field, ReferenceField):
+                return field.dereference_many(vals)
+
             if isinstance(field, ArrayField):
                 return [walk(field, value) for value in vals]
 
@@ -308,41 +359,31 @@ class EmbeddedField(DictField):
         self.model = model
         return self
 
-    @cachedproperty
+    @property
     def fields(self) -> Dict[str, Field]:
-        # dict preserves insertion order from Python 3.6
-        # https://mail.python.org/pipermail/python-dev/2017-December/151283.html
-        field_names = self.model.__dict__['_field_order']
-        return {name: getattr(self.model, name) for name in field_names}
+        # noinspection PyProtectedMember
+        return self.model._get_plan().fields
 
     def convert(self, obj: Any) -> Union[MutableMapping, Missing]:
         if isinstance(obj, self.model):
             # we can safely skip `convert` and 'validate` because it must have been done before.
-            # `dict` cannot be used because setting an attr on it is invalid.
             dk = obj.to_dict()
-            dk._skip_validate = True
+            try:
+                dk._skip_validate = True
+            except AttributeError:
+                # setting an attr on a plain `dict` is invalid, so it will be validated again
+                pass
             return dk
 
         obj = super().convert(obj)
         if obj is _missing:
             return _missing
 
-        if not isinstance(obj, MutableMapping):
+        if not isinstance(obj, abc.MutableMapping):
             raise ValueError('{!r} must be a dict-like object, not a {!r}.'.format(obj, type(obj)))
 
-        fields = self.fields
-        rv = self.model.dict_class()
-
-        for name, field in fields.items():
-            value = field.convert(obj.get(name, _missing))
-            if value is not _missing:
-                rv[field.name] = value
-
-        for name, value in obj.items():
-            if name not in fields:
-                rv[name] = value
-
-        return rv
+        # noinspection PyProtectedMember
+        return self.model._get_plan().convert(obj)
 
     def validate(self, obj: Union[MutableMapping, Missing]) -> None:
         if hasattr(obj, '_skip_validate'):
@@ -352,16 +393,25 @@ class EmbeddedField(DictField):
         if obj is _missing:
             return
 
-        fields = self.fields
+        # noinspection PyProtectedMember
+        self.model._get_plan().validate(obj)
+
+    def clean(self, obj: Any) -> Union[MutableMapping, Missing]:
+        if isinstance(obj, self.model):
+            return self.convert(obj)
+
+        obj = super().convert(obj)
+        if obj is _missing:
+            super().validate(obj)
+            return _missing
 
-        for field in fields.values():
-            field.validate(obj.get(field.name, _missing))
+        if not isinstance(obj, abc.MutableMapping):
+            raise ValueError('{!r} must be a dict-like object, not a {!r}.'.format(obj, type(obj)))
 
-        if self.model.warn_extra_data:
-            names = {field.name for field in fields.values()}
-            for name, value in obj.items():
-                if name not in names:
-                    warn('{!r} not defined in model {!r}. Did you misspell it?'.format(name, self.model))
+        # noinspection PyProtectedMember
+        obj = self.model._get_plan().clean(obj)
+        super().validate(obj)
+        return obj
 
     def __str__(self):
         return '<{} model={!r}>'.format(self.__class__.__name__, self.model)
@@ -371,3 +421,97 @@ class EmbeddedField(DictField):
 
 class AnyField(Field):
     expected_types = (object,)
+
+
+class ReferenceField(Field):
+    """The primary key of a document of another model, which is dereferenced on first access.
+    The model may be given by its name, if it's defined later.
+
+    The primary key is returned by `obj.get(name)`; a model assigned to the field is stored as its primary key.
+    """
+
+    expected_types = (object,)
+
+    def __init__(self, model, **kw):
+        super().__init__(**kw)
+        self._model = model
+
+    @property
+    def model(self):
+        model = self._model
+        if isinstance(model, str):
+            from .indexes import registered_models
+            for candidate in reversed(registered_models()):
+                if model in (candidate.__name__, candidate.__qualname__,
+                             '{}.{}'.format(candidate.__module__, candidate.__qualname__)):
+                    self._model = model = candidate
+                    break
+            else:
+                raise LookupError('Model {!r} referenced by field {!r} is not defined.'.format(model, self.name))
+        return model
+
+    def convert(self, value: Any) -> Any:
+        from .mongo import MongoModel
+        if isinstance(value, MongoModel):
+            if value.pk is None:
+                raise ValueError('{!r} must be saved before it is referenced.'.format(value))
+            return value.pk
+        return super().convert(value)
+
+    def dereference(self, pk: Any) -> Any:
+        """Return the model of the primary key, or `None` if it doesn't exist."""
+        if pk is None:
+            return None
+        return self.model.get(pk)
+
+    def dereference_many(self, pks: MutableSequence) -> MutableSequence:
+        """Return the models of the primary keys by one query, with `None` for those don't exist."""
+        pks = list(pks)
+        try:
+            unique = list(dict.fromkeys(pk for pk in pks if pk is not None))
+        except TypeError:
+            # unhashable primary keys are looked up one by one
+            return [self.dereference(pk) for pk in pks]
+        if not unique:
+            return [None] * len(pks)
+        found = {obj.pk: obj for obj in self.model.find({'_id': {'$in': unique}})}
+        return [found.get(pk) for pk in pks]
+
+    def __get__(self, instance, cls) -> Any:
+        if instance is None:
+            return self
+
+        pk = super().__get__(instance, cls)
+        wrappers = instance._wrappers
+        name = self.name
+        if name not in wrappers:
+            wrappers[name] = self.dereference(pk)
+        return wrappers[name]
+
+    def __set__(self, instance, value):
+        super().__set__(instance, value)
+        wrappers = instance._wrappers
+        from .mongo import MongoModel
+        if isinstance(value, MongoModel):
+            wrappers[self.name] = value
+        else:
+            wrappers.pop(self.name, None)
+
+    def __str__(self):
+        model = self._model
+        return '<{} model={!r}>'.format(self.__class__.__name__,
+                                        model if isinstance(model, str) else model.__qualname__)
+
+    __repr__ = __str__
+
+
+class _RefType(type):
+    def __getitem__(cls, model) -> type:
+        name = model if isinstance(model, str) else model.__qualname__
+        return type(cls)('Ref[{}]'.format(name), (cls,), {'model': model})
+
+
+class Ref(metaclass=_RefType):
+    """The type hint of a :class:`ReferenceField`, e.g. `author: Ref[User]` or `parent: Ref['Category']`."""
+
+    model = None
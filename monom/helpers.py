@@ -14,32 +14,23 @@ __all__ = [
 
 @contextmanager
 def switch_db(model: Type[Model], db: Database):
-    """Switch database and collection temporarily, not thread safe"""
-
-    prev_db = model.get_db()
-    prev_coll = model.get_collection()
-
-    coll_name = prev_coll.name
-    coll_options = prev_coll.options()
-
-    model.set_db(db)
-    model.set_collection(coll_name, **coll_options)
+    """Switch database temporarily in the current thread or asyncio task;
+    the collection keeps its name and options.
+    """
 
+    token = model._push_route(db=db)
     try:
         yield
     finally:
-        model.set_db(prev_db)
-        model.set_collection(prev_coll)
+        model._pop_route(token)
 
 
 @contextmanager
 def switch_collection(model: Type[Model], collection: Union[str, Collection], **option):
-    """Switch collection temporarily, not thread safe"""
-
-    prev = model.get_collection()
-    model.set_collection(collection, **option)
+    """Switch collection temporarily in the current thread or asyncio task."""
 
+    token = model._push_route(collection=collection, **option)
     try:
         yield
     finally:
-        model.set_collection(prev)
+        model._pop_route(token)
@@ -0,0 +1,209 @@
+"""
+Synchronize the indexes declared in `Meta.indexes` of models with MongoDB.
+
+With `store_fingerprints=True`, a fingerprint of the declared indexes is stored in the collection
+`_monom_indexes` of the database after they are synchronized, so the indexes of an unchanged model are
+only checked to exist, instead of being compared option by option.
+"""
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+from pymongo import IndexModel
+
+from .utils import default_index_name, info
+
+__all__ = [
+    'IndexManager',
+    'IndexSync',
+    'index_fingerprint',
+    'index_manager',
+    'registered_models',
+]
+
+# the keys keep the order of definition
+_registry = WeakKeyDictionary()
+
+
+def register(model) -> None:
+    _registry[model] = None
+
+
+def registered_models() -> List[Any]:
+    """Return the defined subclasses of :class:`~monom.mongo.MongoModel`, in the order of definition."""
+    return list(_registry.keys())
+
+
+def index_fingerprint(model) -> str:
+    """Return a hash of the indexes declared by the model."""
+    # noinspection PyProtectedMember
+    indexes = model._declared_indexes()
+    return hashlib.sha1(json.dumps(indexes, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+def describe_change(change: Tuple[str, tuple, dict]) -> str:
+    """Describe a change of :meth:`~monom.mongo.MongoModel._index_changes`.
+
+    >>> describe_change(('create_index', ([('a', 1)],), {}))
+    'create a_1'
+    >>> describe_change(('drop_index', ('b_1',), {}))
+    'drop b_1'
+    """
+
+    method, args, kw = change
+    if method == 'create_index':
+        return 'create {}'.format(kw.get('name') or default_index_name(args[0]))
+    if method == 'drop_index':
+        return 'drop {}'.format(args[0])
+    return 'modify {}'.format(args[0]['index']['name'])
+
+
+def _have_indexes(model, indexes: List[dict]) -> bool:
+    """Return whether the indexes declared by the model are among the existing ones, by their keys."""
+    names = {default_index_name(index['key']) for index in indexes}
+    # noinspection PyProtectedMember
+    return all(default_index_name(index['key']) in names for index in model._declared_indexes())
+
+
+class IndexSync(NamedTuple):
+    """The result of synchronizing the indexes of a model."""
+
+    model: Any
+    # the full name of the collection, i.e. `<database>.<collection>`
+    collection: str
+    changes: List[Tuple[str, tuple, dict]]
+    # whether the check was skipped, since the indexes are unchanged since the last synchronization
+    skipped: bool = False
+
+
+class IndexManager:
+    """Compare the indexes declared by models with those in MongoDB, and apply the differences.
+
+    The changes of a collection are applied with a `dropIndexes` per index to be dropped, and
+    a single `createIndexes` for all the indexes to be created; models are synchronized in parallel.
+    A collection is checked once per process, unless `force` is true.
+
+    If `store_fingerprints` is true, the fingerprints of the synchronized indexes are written to
+    the collection :attr:`metadata_collection` of each database; a collection whose stored fingerprint
+    matches the declared indexes is skipped if the declared indexes still exist, by their keys.
+    Nothing is written besides the indexes by default.
+    """
+
+    # the collection storing the fingerprints of the collections in each database
+    metadata_collection = '_monom_indexes'
+
+    def __init__(self, max_workers: int = None, store_fingerprints: bool = False):
+        self.max_workers = max_workers
+        self.store_fingerprints = store_fingerprints
+        # model -> {(database, collection name): fingerprint}
+        self._synced = WeakKeyDictionary()
+        self._lock = Lock()
+
+    def sync(self, models: Iterable[Any] = None, force: bool = False, dry_run: bool = False) -> List[IndexSync]:
+        """Synchronize the indexes of the models, or all registered models with a database."""
+        if models is None:
+            models = [model for model in registered_models() if model.get_db() is not None]
+        targets = [(model, self._collection_of(model)) for model in models]
+
+        # the stored fingerprints are fetched with a query per database
+        stored = {}
+        if self.store_fingerprints and not force:
+            by_db = {}
+            for _, collection in targets:
+                by_db.setdefault(collection.database, []).append(collection.name)
+            for db, names in by_db.items():
+                for doc in db.get_collection(self.metadata_collection).find({'_id': {'$in': names}}):
+                    stored[(db, doc['_id'])] = doc.get('fingerprint')
+
+        def work(target) -> IndexSync:
+            model, collection = target
+            return self._sync(model, collection, stored.get((collection.database, collection.name)), force, dry_run)
+
+        if len(targets) <= 1:
+            return list(map(work, targets))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(work, targets))
+
+    def sync_model(self, model, collection=None, force: bool = False, dry_run: bool = False) -> IndexSync:
+        """Synchronize the indexes of a model in a collection, by default the collection of the model."""
+        if collection is None:
+            collection = self._collection_of(model)
+
+        stored = None
+        if self.store_fingerprints and not force and not self._is_synced(model, collection, index_fingerprint(model)):
+            doc = collection.database.get_collection(self.metadata_collection).find_one({'_id': collection.name})
+            stored = doc and doc.get('fingerprint')
+        return self._sync(model, collection, stored, force, dry_run)
+
+    def forget(self) -> None:
+        """Forget the collections synchronized in this process."""
+        with self._lock:
+            self._synced.clear()
+
+    @staticmethod
+    def _collection_of(model):
+        # the collection is not set by `get_collection`, which would synchronize its indexes implicitly
+        collection = model.__dict__.get('_collection')
+        if collection is None:
+            # noinspection PyProtectedMember
+            collection = model.get_db().get_collection(model._default_collection_name())
+        return collection
+
+    def _is_synced(self, model, collection, fingerprint: str) -> bool:
+        return self._synced.get(model, {}).get((collection.database, collection.name)) == fingerprint
+
+    def _mark_synced(self, model, collection, fingerprint: str) -> None:
+        with self._lock:
+            self._synced.setdefault(model, {})[(collection.database, collection.name)] = fingerprint
+
+    def _sync(self, model, collection, stored: Optional[str], force: bool, dry_run: bool) -> IndexSync:
+        fingerprint = index_fingerprint(model)
+        if not force and self._is_synced(model, collection, fingerprint):
+            return IndexSync(model, collection.full_name, [], skipped=True)
+
+        indexes = list(collection.list_indexes())
+        # the collection, or some of its indexes may have been dropped since the fingerprint was stored
+        if not force and stored == fingerprint and _have_indexes(model, indexes):
+            if not dry_run:
+                self._mark_synced(model, collection, fingerprint)
+            return IndexSync(model, collection.full_name, [], skipped=True)
+
+        # noinspection PyProtectedMember
+        changes = model._index_changes(indexes, collection.name)
+        if not dry_run:
+            self.apply(collection, changes)
+            if self.store_fingerprints:
+                collection.database.get_collection(self.metadata_collection).replace_one(
+                    {'_id': collection.name},
+                    {'fingerprint': fingerprint, 'synced_on': datetime.utcnow()},
+                    upsert=True
+                )
+            self._mark_synced(model, collection, fingerprint)
+            if changes:
+                info('Indexes of {!r} changed: {}.'.format(
+                    collection.full_name, ', '.join(map(describe_change, changes))
+                ))
+        return IndexSync(model, collection.full_name, changes)
+
+    @staticmethod
+    def apply(collection, changes: List[Tuple[str, tuple, dict]]) -> None:
+        """Apply the changes to a collection; the indexes are created at last by a single command."""
+        creations = []
+        for method, args, kw in changes:
+            if method == 'create_index':
+                creations.append(IndexModel(*args, **kw))
+            elif method == 'command':
+                collection.database.command(*args, **kw)
+            else:
+                getattr(collection, method)(*args, **kw)
+        if creations:
+            collection.create_indexes(creations)
+
+
+# used by the models to build their indexes when the collections are set
+index_manager = IndexManager()
@@ -0,0 +1,200 @@
+"""
+Dict-like documents decoded lazily from raw BSON.
+"""
+
+import struct
+from collections import abc
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from bson import ObjectId, decode
+from bson.codec_options import CodecOptions
+from bson.raw_bson import DEFAULT_RAW_BSON_OPTIONS, RawBSONDocument
+
+__all__ = [
+    'LazyDocument',
+]
+
+_unpack_int = struct.Struct('<i').unpack_from
+_pack_int = struct.Struct('<i').pack
+_unpack_double = struct.Struct('<d').unpack_from
+
+# the sizes of the values of fixed size by their BSON types
+_fixed_sizes = {
+    0x01: 8, 0x06: 0, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4, 0x11: 8, 0x12: 8, 0x13: 16, 0x7F: 0, 0xFF: 0,
+}
+# the types whose values are prefixed by their sizes in bytes: a string (after which the size counts),
+# a document or array, and a binary (whose subtype follows the size)
+_string_types = {0x02, 0x0D, 0x0E}
+_document_types = {0x03, 0x04, 0x0F}
+
+
+def _value_end(raw: bytes, kind: int, start: int) -> int:
+    """Return the end of the value of a BSON element, which starts at `start`."""
+    size = _fixed_sizes.get(kind)
+    if size is not None:
+        return start + size
+    if kind in _string_types:
+        return start + 4 + _unpack_int(raw, start)[0]
+    if kind in _document_types:
+        return start + _unpack_int(raw, start)[0]
+    if kind == 0x05:
+        return start + 5 + _unpack_int(raw, start)[0]
+    if kind == 0x0B:
+        # a regular expression: the pattern and the options as C strings
+        return raw.index(b'\x00', raw.index(b'\x00', start) + 1) + 1
+    if kind == 0x0C:
+        # a DBPointer: a string and an ObjectId
+        return start + 4 + _unpack_int(raw, start)[0] + 12
+    raise ValueError('Unknown BSON type 0x{:02x}.'.format(kind))
+
+
+# the raw codec options last seen, and the same options decoding documents as dicts;
+# all documents of a cursor share the options of its collection
+_plain_options = (DEFAULT_RAW_BSON_OPTIONS, DEFAULT_RAW_BSON_OPTIONS.with_options(document_class=dict))
+
+
+def _get_plain_options(options: CodecOptions) -> CodecOptions:
+    global _plain_options
+    raw_options, plain = _plain_options
+    if options is not raw_options:
+        plain = options.with_options(document_class=dict)
+        _plain_options = (options, plain)
+    return plain
+
+
+class LazyDocument(abc.MutableMapping):
+    """A dict-like object backed by a :class:`~bson.raw_bson.RawBSONDocument`.
+
+    Nothing is decoded until an item is accessed; then the elements of the raw buffer are scanned
+    up to that item, which is decoded alone. Embedded documents are kept raw until they are accessed,
+    and generic binary values are exposed as `memoryview` slices of the raw buffer, without copying them.
+    """
+
+    __slots__ = ('_raw', '_codec_options', '_offsets', '_pos', '_doc')
+
+    def __init__(self, raw: RawBSONDocument):
+        self._raw = raw.raw
+        # the options of the embedded documents, which are raw too
+        # noinspection PyUnresolvedReferences
+        self._codec_options = getattr(raw, '_RawBSONDocument__codec_options', DEFAULT_RAW_BSON_OPTIONS)
+        # key -> the start and end of its element in the raw buffer, or `None` if the item is set
+        self._offsets: Dict[str, Optional[Tuple[int, int]]] = {}
+        # the start of the next element to be scanned, or `None` if all elements are scanned
+        self._pos: Optional[int] = 4
+        # the decoded and set values
+        self._doc = None
+
+    @property
+    def raw(self) -> bytes:
+        """The raw BSON bytes of the document."""
+        return self._raw
+
+    def _scan(self, key: str = None) -> Dict[str, Optional[Tuple[int, int]]]:
+        """Scan the elements until `key` is found, or to the end; return the offsets of the scanned ones."""
+        offsets = self._offsets
+        pos = self._pos
+        if pos is None or key in offsets:
+            return offsets
+
+        raw = self._raw
+        end = len(raw) - 1
+        while pos < end:
+            kind = raw[pos]
+            name_end = raw.index(b'\x00', pos + 1)
+            name = raw[pos + 1:name_end].decode()
+            element_end = _value_end(raw, kind, name_end + 1)
+            offsets[name] = (pos, element_end)
+            pos = element_end
+            if name == key:
+                self._pos = pos
+                return offsets
+        self._pos = None
+        return offsets
+
+    def _decode(self, start: int, end: int) -> Any:
+        raw = self._raw
+        kind = raw[start]
+        value_start = raw.index(b'\x00', start + 1) + 1
+        # the most common types are decoded in place
+        if kind == 0x02:
+            return raw[value_start + 4:end - 1].decode('utf-8', self._codec_options.unicode_decode_error_handler)
+        if kind == 0x10:
+            return _unpack_int(raw, value_start)[0]
+        if kind == 0x01:
+            return _unpack_double(raw, value_start)[0]
+        if kind == 0x07:
+            return ObjectId(raw[value_start:end])
+        if kind == 0x08:
+            return raw[value_start] == 1
+        if kind == 0x0A:
+            return None
+        if kind == 0x05 and raw[value_start + 4] == 0:
+            # a generic binary value
+            return memoryview(raw)[value_start + 5:end]
+        if kind == 0x03:
+            return LazyDocument(RawBSONDocument(raw[value_start:end], self._codec_options))
+
+        # a document of the element alone, decoded by the C extension of `bson`
+        element = raw[start:end]
+        element = _pack_int(len(element) + 5) + element + b'\x00'
+        if kind == 0x04:
+            # the embedded documents of arrays are kept raw
+            value = next(iter(RawBSONDocument(element, self._codec_options).values()))
+            return [LazyDocument(item) if isinstance(item, RawBSONDocument) else item for item in value]
+        return next(iter(decode(element, _get_plain_options(self._codec_options)).values()))
+
+    def __getitem__(self, key: str) -> Any:
+        doc = self._doc
+        if doc is None:
+            doc = self._doc = {}
+        try:
+            return doc[key]
+        except KeyError:
+            pass
+        # raises `KeyError` if missing
+        offsets = self._scan(key)[key]
+        value = doc[key] = self._decode(*offsets)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._scan(key).setdefault(key, None)
+        if self._doc is None:
+            self._doc = {}
+        self._doc[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self._scan(key)[key]
+        if self._doc is not None:
+            self._doc.pop(key, None)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._scan(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._scan())
+
+    def __len__(self) -> int:
+        return len(self._scan())
+
+    def to_dict(self) -> dict:
+        """Return a fully decoded dict, in which binary values are copied back to `bytes`."""
+        return {key: _materialize(value) for key, value in self.items()}
+
+    def __repr__(self):
+        if self._doc is None:
+            return '<{} raw={} bytes>'.format(self.__class__.__name__, len(self.raw))
+        return '{}({!r})'.format(self.__class__.__name__, self.to_dict())
+
+
+def _materialize(value: Any) -> Any:
+    if isinstance(value, LazyDocument):
+        return value.to_dict()
+    if isinstance(value, RawBSONDocument):
+        return LazyDocument(value).to_dict()
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, list):
+        return [_materialize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _materialize(item) for key, item in value.items()}
+    return value
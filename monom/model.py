@@ -1,16 +1,22 @@
-from collections import OrderedDict
+from collections import abc, OrderedDict
 from datetime import datetime
-from typing import get_type_hints, Any, MutableMapping, Type, Union, Callable, List, Iterable, Optional, Set, Tuple
+from typing import get_type_hints, Any, Dict, FrozenSet, MutableMapping, Type, Union, Callable, List, Iterable, \
+    Iterator, Optional, Set, Tuple
 
 from bson.json_util import dumps
 from bson.objectid import ObjectId
 
 from .fields import *
+from .fields import _missing
+from .lazy import LazyDocument
+from .serialization import compile_encoder, dumps as dumps_json
+from .tracking import Tracker, TrackedModelList
 from .utils import *
 
 __all__ = [
     'BaseModel',
-    'EmbeddedModel'
+    'EmbeddedModel',
+    'ModelPlan'
 ]
 
 hint_field_map = {
@@ -28,6 +34,8 @@ hint_field_map = {
 
 
 def _hint_to_field(hint_type: Union[Type, Any]) -> Field:
+    if isclass(hint_type) and issubclass(hint_type, Ref) and hint_type.model is not None:
+        return ReferenceField(hint_type.model)
     if hint_type in hint_field_map:
         return hint_field_map[hint_type]()
     if isclass(hint_type) and issubclass(hint_type, EmbeddedModel):
@@ -43,11 +51,293 @@ def _hint_to_field(hint_type: Union[Type, Any]) -> Field:
     raise TypeError('cannot convert {!r} to a field'.format(hint_type))
 
 
+# how many dot notations and update shapes are remembered per model class
+DOT_NOTATION_CACHE_SIZE = 1024
+UPDATE_PLAN_CACHE_SIZE = 256
+
+
+class ModelPlan:
+    """The conversion and validation plan of a model class.
+
+    It is compiled once per class by :meth:`ModelType._get_plan`, and thrown away
+    when the `Meta` or options of the class are changed.
+    """
+
+    def __init__(self, model: Type['BaseModel']):
+        self.model = model
+        self.root = EmbeddedField().init_root(model)
+
+        # dict preserves insertion order from Python 3.6
+        # https://mail.python.org/pipermail/python-dev/2017-December/151283.html
+        field_names = model.__dict__.get('_field_order', [])
+        self.fields: Dict[str, Field] = {name: getattr(model, name) for name in field_names}
+        self.names: FrozenSet[str] = frozenset(field.name for field in self.fields.values())
+        # aliases of fields which aren't attributes too; input keyed by them is converted and validated as it is
+        self.aliases: FrozenSet[str] = frozenset(name for name in self.names if name not in self.fields)
+
+        # the name of the field compared and incremented by the writes of the model (`Meta.version_field`)
+        version = getattr(model.__dict__.get('Meta'), 'version_field', None)
+        self.version: Optional[str] = self.fields[version].name if version else None
+
+        # field name -> the index of its wrapper in the list of wrappers of compact models
+        self.wrapper_indexes: Optional[Dict[str, int]] = None
+        if model._slotted:
+            attrs = [attr for cls in reversed(model.__mro__) for attr in cls.__dict__.get('_field_order', ())]
+            wrapped = [getattr(model, attr).name for attr in attrs if _is_wrapped(getattr(model, attr))]
+            self.wrapper_indexes = {name: index for index, name in enumerate(dict.fromkeys(wrapped))}
+
+        # properties with a setter can be fed as keyword arguments of the constructor
+        self.setters: Tuple[str, ...] = tuple(
+            key for key, value in model.__dict__.items() if isinstance(value, property) and value.fset
+        )
+
+        # resolved fields of dot notations, and plans of updates keyed by their shapes
+        self.dot_notations = LRUCache(DOT_NOTATION_CACHE_SIZE)
+        self.updates = LRUCache(UPDATE_PLAN_CACHE_SIZE)
+
+        # `convert` and `validate` of leaf fields are called directly to save a function call per value
+        self.cleaners: Tuple[Tuple[str, str, Callable, Optional[Callable]], ...] = tuple(
+            (attr, field.name, field.convert, field.validate) if type(field).clean is Field.clean
+            else (attr, field.name, field.clean, None)
+            for attr, field in self.fields.items()
+        )
+
+        if model.compiled:
+            from .codegen import compile_plan
+            self.convert, self.validate, self.clean = compile_plan(self)
+
+    def convert(self, obj: MutableMapping) -> MutableMapping:
+        """Convert the fields of a dict-like object; undeclared items are copied as they are."""
+        fields = self.fields
+        rv = self.model.dict_class()
+
+        for name, field in fields.items():
+            value = field.convert(obj.get(name, _missing))
+            if value is not _missing:
+                rv[field.name] = value
+
+        for name, value in obj.items():
+            if name not in fields:
+                rv[name] = value
+
+        return rv
+
+    def validate(self, obj: MutableMapping) -> None:
+        """Validate the fields of a converted dict-like object."""
+        for field in self.fields.values():
+            field.validate(obj.get(field.name, _missing))
+
+        if self.model.warn_extra_data:
+            names = self.names
+            for name in obj:
+                if name not in names:
+                    warn('{!r} not defined in model {!r}. Did you misspell it?'.format(name, self.model))
+
+    def clean(self, obj: MutableMapping) -> MutableMapping:
+        """Convert and validate the fields of a dict-like object in one pass."""
+        if self.aliases and not self.aliases.isdisjoint(obj):
+            # items keyed by aliases are copied by `convert`, and validated as the fields
+            rv = self.convert(obj)
+            self.validate(rv)
+            return rv
+
+        rv = self.model.dict_class()
+
+        for attr, name, convert, validate in self.cleaners:
+            if validate is None:
+                value = convert(obj.get(attr, _missing))
+            else:
+                value = convert(obj.get(attr, _missing))
+                validate(value)
+            if value is not _missing:
+                rv[name] = value
+
+        fields = self.fields
+        names = self.names
+        warn_extra_data = self.model.warn_extra_data
+        for name, value in obj.items():
+            if name not in fields:
+                rv[name] = value
+                if warn_extra_data and name not in names:
+                    warn('{!r} not defined in model {!r}. Did you misspell it?'.format(name, self.model))
+
+        return rv
+
+    @cachedproperty
+    def renames(self) -> Dict[str, Tuple[str, Optional['ModelPlan']]]:
+        """The fields renamed by :meth:`to_attributes`, or holding embedded documents renamed,
+        as `{name: (attribute, plan of the embedded model)}`.
+        """
+        rv = {}
+        for attr, field in self.fields.items():
+            inner = field.innermost() if isinstance(field, ArrayField) else field
+            plan = inner.model._get_plan() if isinstance(inner, EmbeddedField) else None
+            if plan is not None and not plan.renames:
+                plan = None
+            if field.name != attr or plan is not None:
+                rv[field.name] = (attr, plan)
+        return rv
+
+    @cachedproperty
+    def json_encoder(self) -> Callable[[MutableMapping], Dict[str, Any]]:
+        """Convert the documents of the model to JSON values, see :mod:`monom.serialization`."""
+        return compile_encoder({field.name: field for field in self.fields.values()})
+
+    def to_attributes(self, doc: MutableMapping) -> MutableMapping:
+        """Rename the keys of a document, and of its embedded documents, from the names of fields to their attributes.
+        The document is returned as it is if no field has an alias.
+        """
+        renames = self.renames
+        if not renames:
+            return doc
+
+        rv = {}
+        for name, value in doc.items():
+            try:
+                attr, plan = renames[name]
+            except KeyError:
+                rv[name] = value
+                continue
+            if plan is not None:
+                value = _map_documents(value, plan.to_attributes)
+            rv[attr] = value
+        return rv
+
+
+def _map_documents(value: Any, fn: Callable[[MutableMapping], MutableMapping]) -> Any:
+    if isinstance(value, abc.Mapping):
+        return fn(value)
+    if isinstance(value, list):
+        return [_map_documents(item, fn) for item in value]
+    return value
+
+
+def _inherited(bases: Tuple[type, ...], name: str, default: Any = None) -> Any:
+    for base in bases:
+        if hasattr(base, name):
+            return getattr(base, name)
+    return default
+
+
+def _is_wrapped(field: Any) -> bool:
+    # embedded models, tracked containers and dereferenced models are made on access, and cached
+    return isinstance(field, (DictField, ListField, ReferenceField))
+
+
+def _compact_slots(bases: Tuple[type, ...], attrs: MutableMapping) -> Tuple[str, ...]:
+    """Return the slots of instance attributes which aren't provided by the bases yet."""
+    names = attrs.get('_instance_attrs') or _inherited(bases, '_instance_attrs', ())
+    provided = {slot for base in bases for cls in base.__mro__ for slot in cls.__dict__.get('__slots__', ())}
+    return tuple(name for name in names if name not in provided)
+
+
+class _ExtraAttribute:
+    """An attribute of compact models which is `None` in most instances; the attributes share a list
+    allocated when one of them is set first, instead of a slot each.
+    """
+
+    __slots__ = ('index', 'size')
+
+    def __init__(self, index: int, size: int):
+        self.index = index
+        self.size = size
+
+    def __get__(self, instance, owner) -> Any:
+        if instance is None:
+            return self
+        extra = instance._extra
+        return None if extra is None else extra[self.index]
+
+    def __set__(self, instance, value: Any) -> None:
+        extra = instance._extra
+        if extra is None:
+            if value is None:
+                return
+            extra = instance._extra = [None] * self.size
+        extra[self.index] = value
+
+
+class _ListWrappers:
+    """The wrappers of the fields of a compact model, kept in a list allocated on first use instead of a dict;
+    a transient view with the few methods of a dict used on `_wrappers`.
+    """
+
+    __slots__ = ('instance', 'indexes')
+
+    def __init__(self, instance: 'BaseModel', indexes: Dict[str, int]):
+        self.instance = instance
+        # field name -> index in the list
+        self.indexes = indexes
+
+    def get(self, name: str, default: Any = None) -> Any:
+        wrappers = self.instance._wrapped
+        if wrappers is None:
+            return default
+        index = self.indexes.get(name)
+        if index is None or wrappers[index] is _missing:
+            return default
+        return wrappers[index]
+
+    def __getitem__(self, name: str) -> Any:
+        value = self.get(name, _missing)
+        if value is _missing:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        try:
+            index = self.indexes[name]
+        except KeyError:
+            raise TypeError('{!r} has no wrapper of {!r}.'.format(type(self.instance), name)) from None
+        wrappers = self.instance._wrapped
+        if wrappers is None:
+            wrappers = self.instance._wrapped = [_missing] * len(self.indexes)
+        wrappers[index] = value
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name, _missing) is not _missing
+
+    def pop(self, name: str, default: Any = _missing) -> Any:
+        value = self.get(name, _missing)
+        if value is _missing:
+            if default is _missing:
+                raise KeyError(name)
+            return default
+        self.instance._wrapped[self.indexes[name]] = _missing
+        return value
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        wrappers = self.instance._wrapped
+        if wrappers is None:
+            return
+        for name, index in self.indexes.items():
+            if wrappers[index] is not _missing:
+                yield name, wrappers[index]
+
+    def values(self) -> Iterator[Any]:
+        return (value for _, value in self.items())
+
+    def __bool__(self) -> bool:
+        return any(True for _ in self.items())
+
+
 class ModelType(type):
     def __new__(mcs, name, bases, attrs):
         if '_no_parse_hints' in attrs:
             return super().__new__(mcs, name, bases, attrs)
 
+        if attrs.get('compact', _inherited(bases, 'compact', False)):
+            # `__slots__` only takes effect when it is defined in the class body
+            if '__slots__' not in attrs:
+                attrs['__slots__'] = _compact_slots(bases, attrs)
+                attrs['_slotted'] = True
+                if '_extra' in attrs['__slots__']:
+                    names = attrs.get('_extra_attrs') or _inherited(bases, '_extra_attrs', ())
+                    for index, attr in enumerate(names):
+                        attrs[attr] = _ExtraAttribute(index, len(names))
+            if 'dict_class' not in attrs and _inherited(bases, 'dict_class') is OrderedDict:
+                attrs['dict_class'] = dict
+
         # track the field definition order
         field_order = []
 
@@ -94,6 +384,7 @@ class ModelType(type):
         required = getattr(meta, 'required', [])
         converters = getattr(meta, 'converters', {})
         validators = getattr(meta, 'validators', {})
+        version_field = getattr(meta, 'version_field', None)
 
         def ensure_field_exist(name):
             if name not in fields:
@@ -121,6 +412,9 @@ class ModelType(type):
             ensure_field_exist(field_name)
             fields[field_name].validator = validator
 
+        if version_field is not None:
+            ensure_field_exist(version_field)
+
     def __init__(cls, name, bases, attrs):
         if '_no_parse_hints' not in cls.__dict__:
             cls._parse_type_hints()
@@ -128,6 +422,32 @@ class ModelType(type):
 
         super().__init__(name, bases, attrs)
 
+    def _get_plan(cls) -> ModelPlan:
+        try:
+            return cls.__dict__['_plan']
+        except KeyError:
+            plan = ModelPlan(cls)
+            type.__setattr__(cls, '_plan', plan)
+            return plan
+
+    def _invalidate_plan(cls) -> None:
+        if '_plan' in cls.__dict__:
+            type.__delattr__(cls, '_plan')
+
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        # private attributes (`_db`, `_collection`, etc.) have nothing to do with the plan
+        if name.startswith('_'):
+            return
+        if name == 'Meta' and '_no_parse_hints' not in cls.__dict__:
+            cls._process_meta()
+        cls._invalidate_plan()
+
+    def __delattr__(cls, name):
+        super().__delattr__(name)
+        if not name.startswith('_'):
+            cls._invalidate_plan()
+
     @classmethod
     def __prepare__(mcs, name, bases) -> MutableMapping:
         # class attribute definition order is preserved from python 3.6,
@@ -151,8 +471,35 @@ class BaseModel(metaclass=ModelType):
     # Whether checks extra data that aren't declared in the model and emits some warnings.
     warn_extra_data: bool = True
 
+    # Whether generates specialized functions to convert and validate the data of this model.
+    # It speeds up constructing models, at the cost of freezing the options of fields (`default`,
+    # `converter`, `validator`, etc.) when the functions are generated.
+    compiled: bool = False
+
+    # Whether instances keep their attributes in `__slots__` instead of a `__dict__`,
+    # and their data in a plain `dict` unless `dict_class` is set on the model itself.
+    # It must be set when the class is defined; other attributes cannot be set on the instances.
+    compact: bool = False
+
+    # attributes of instances, which become the slots of compact models
+    _instance_attrs: Tuple[str, ...] = ('_data', '_extra', '_wrapped')
+    # attributes of instances which are `None` unless set; compact models keep them in a list in `_extra`,
+    # allocated when one of them is set, and the wrappers of their fields in a list in `_wrapped`
+    _extra_attrs: Tuple[str, ...] = ('_modified_fields', '_deleted_fields')
+    _slotted: bool = False
+
+    # tracked fields are allocated on first modification
+    _modified_fields: Optional[Set[str]] = None
+    _deleted_fields: Optional[Set[str]] = None
+
+    # names of the fields loaded by the projection of a query, `None` if all are loaded
+    _loaded: Optional[FrozenSet[str]] = None
+    # the call site recording which fields are read, see :class:`~monom.projection.ProjectionProfiler`
+    _profile = None
+
     _no_parse_hints: bool = True
     __no_type_check__: bool = False
+    __slots__ = ()
 
     def __new__(cls, _dirty=True, **kw):
         if _dirty:
@@ -163,25 +510,65 @@ class BaseModel(metaclass=ModelType):
             return instance
 
     def __init__(self, **kw):
-        self._modified_fields: Optional[Set[str]] = None
-        self._deleted_fields: Optional[Set[str]] = None
+        if self._slotted:
+            # slots have no class-level defaults
+            self._extra = None
+            self._wrapped = None
+
+    @property
+    def _wrappers(self) -> MutableMapping[str, Any]:
+        # wrappers of embedded documents are cached in `__dict__`;
+        # compact models keep them in a list allocated on first access, so no dict is allocated per instance
+        if self._slotted:
+            return _ListWrappers(self, type(self)._get_plan().wrapper_indexes)
+        return self.__dict__
 
     # noinspection PyCallByClass
     def to_json(self, *arg, **kw) -> str:
-        """Return a json string. Some specific types (`ObjectId`, `datetime`, etc.) will be handled correctly."""
-        return type(self).json_dumps_func(self.to_dict(), *arg, **kw)
+        """Return a json string. Some specific types (`ObjectId`, `datetime`, etc.) will be handled correctly.
+        Without arguments and a custom `json_dumps_func`, the data are converted by the encoder compiled
+        for the model (see :mod:`monom.serialization`), and formatted the same as `bson.json_util.dumps`.
+        """
+        cls = type(self)
+        if cls.json_dumps_func is dumps and not arg and not kw:
+            return dumps_json(cls._get_plan().json_encoder(self.to_dict()))
+        return cls.json_dumps_func(self.to_dict(), *arg, **kw)
 
     def to_dict(self) -> MutableMapping:
         """Return an ordered dict containing the instance's data with the same order as the field definition order."""
-        return self._data
+        if self._profile is not None:
+            self._profile.read_document()
+        return self._get_document()
 
     def get(self, name: str, default=None) -> Any:
         """Return the value for name if it has a value, else default."""
+        if self._profile is not None:
+            self._profile.read(name)
         try:
             return self._data[name]
         except KeyError:
             return default
 
+    @property
+    def loaded_fields(self) -> Optional[FrozenSet[str]]:
+        """Names of the fields loaded by the projection of the query, or `None` if all fields are loaded."""
+        return self._loaded
+
+    def _get_document(self) -> MutableMapping:
+        data = self._data
+        if isinstance(data, LazyDocument):
+            # lazily decoded data may contain `memoryview`s, which cannot be encoded to BSON
+            return data.to_dict()
+        return data
+
+    def _load_field(self, name: str) -> Any:
+        """Called when a field has no value in the data."""
+        loaded = self._loaded
+        if loaded is not None and name not in loaded:
+            raise AttributeError('Field {!r} was not loaded by the projection {}.'.format(name, sorted(loaded)))
+        raise AttributeError('Field {!r} has no value; '
+                             'did you filter it out using projection query?'.format(name))
+
     @classmethod
     def _from_clean_data(cls, data: MutableMapping):
         instance = cls(_dirty=False)
@@ -190,25 +577,25 @@ class BaseModel(metaclass=ModelType):
 
     @classmethod
     def _from_dirty_data(cls, data: MutableMapping):
-        root = EmbeddedField().init_root(cls)
-        data = root.convert(data)
-        instance = cls._from_clean_data(data)
-
-        for key, value in cls.__dict__.items():
-            if key in data and isinstance(value, property) and value.fset:
-                setattr(instance, key, data[key])
-                data.pop(key)
+        plan = cls._get_plan()
+        if not any(key in data for key in plan.setters):
+            return cls._from_clean_data(plan.root.clean(data))
 
-        root.validate(data)
+        # setters may fill the fields, which are validated after the values of the properties are set
+        data = plan.root.convert(data)
+        instance = cls._from_clean_data(data)
+        for key in plan.setters:
+            if key in data:
+                setattr(instance, key, data.pop(key))
+        plan.root.validate(data)
         return instance
 
     @classmethod
     def _get_clean_data(cls, data: MutableMapping, bypass_validation: bool = False) -> MutableMapping:
-        root = EmbeddedField().init_root(cls)
-        data = root.convert(data)
-        if not bypass_validation:
-            root.validate(data)
-        return data
+        root = cls._get_plan().root
+        if bypass_validation:
+            return root.convert(data)
+        return root.clean(data)
 
     def _init_tracked_fields(self) -> None:
         if self._modified_fields is None:
@@ -219,12 +606,15 @@ class BaseModel(metaclass=ModelType):
     def _clear_tracked_fields(self) -> None:
         if self._modified_fields:
             self._modified_fields.clear()
-        if self._modified_fields:
+        if self._deleted_fields:
             self._deleted_fields.clear()
 
-        for value in self.__dict__.values():
-            if isinstance(value, EmbeddedModel):
-                value._clear_tracked_fields()
+        if self._wrappers:
+            for value in self._wrappers.values():
+                if isinstance(value, EmbeddedModel):
+                    value._clear_tracked_fields()
+                elif isinstance(value, Tracker):
+                    value._reset()
 
     def _combine_tracked_fields(self) -> Tuple[Set[str], Set[str]]:
         modified = set()
@@ -238,7 +628,7 @@ class BaseModel(metaclass=ModelType):
             for name in fields:
                 result.add(prev + name)
 
-            for key, value in instance.__dict__.items():
+            for key, value in (instance._wrappers or {}).items():
                 if isinstance(value, EmbeddedModel) and key not in fields:
                     combine(value, prev + key + '.', attr_name, result)
 
@@ -246,10 +636,49 @@ class BaseModel(metaclass=ModelType):
         combine(self, '', '_deleted_fields', deleted)
         return modified, deleted
 
+    def _combine_tracked_containers(self, prefix: str = '',
+                                    update: Dict[str, Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+        """Return the update operators of the changes of tracked lists and dicts (see :mod:`monom.tracking`),
+        except those in the fields set or deleted as a whole.
+        """
+        if update is None:
+            update = {}
+        wrappers = self._wrappers
+        if not wrappers:
+            return update
+
+        skipped = (self._modified_fields or set()) | (self._deleted_fields or set())
+        for key, value in wrappers.items():
+            if key in skipped:
+                continue
+            if isinstance(value, EmbeddedModel):
+                value._combine_tracked_containers(prefix + key + '.', update)
+            elif isinstance(value, TrackedModelList) or (isinstance(value, Tracker) and value._dirty):
+                value._collect(prefix + key, update)
+        return update
+
+    def _collect_changes(self, prefix: str, update: Dict[str, Dict[str, Any]]) -> None:
+        """Add the update operators of all changes of this model, with the fields prefixed."""
+        modified, deleted = self._combine_tracked_fields()
+        if modified:
+            data = self._get_document()
+            sets = update.setdefault('$set', {})
+            for name in modified:
+                sets[prefix + name] = get_dict_item_with_dot(data, name)
+        if deleted:
+            unsets = update.setdefault('$unset', {})
+            for name in deleted:
+                unsets[prefix + name] = ''
+        self._combine_tracked_containers(prefix, update)
+
     def __setattr__(self, name, value):
         fields = type(self).__dict__['_field_order']
 
         if name in fields:
+            wrappers = self._wrappers
+            if isinstance(value, Tracker) and wrappers and wrappers.get(getattr(type(self), name).name) is value:
+                # an augmented assignment, e.g. `obj.tags += [...]`, which is tracked by the container
+                return
             self._init_tracked_fields()
             self._modified_fields.add(name)
             self._deleted_fields.discard(name)
@@ -271,3 +700,4 @@ class BaseModel(metaclass=ModelType):
 class EmbeddedModel(BaseModel):
     """Base class of user-defined embedded model"""
     _no_parse_hints: bool = True
+    __slots__ = ()
@@ -1,22 +1,43 @@
 from __future__ import annotations
 
-from typing import Optional, Any, Union, List, Iterable, MutableMapping, TypeVar, Type
+from typing import Optional, Any, Dict, Union, List, Iterable, Iterator, MutableMapping, NamedTuple, TypeVar, Type, \
+    Tuple, Deque, Callable
 
-from pymongo import InsertOne, UpdateOne
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, Token
+from copy import deepcopy
+from threading import RLock
+
+from pymongo import DeleteOne, InsertOne, ReplaceOne, UpdateOne
 from pymongo.collation import Collation
 from pymongo.collection import Collection
 from pymongo.collection import ReturnDocument
 from pymongo.command_cursor import CommandCursor
 from pymongo.cursor import Cursor as PymongoCursor
 from pymongo.database import Database
-from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+import bson
+from bson.raw_bson import RawBSONDocument
 
+from .batch import BatchValidationError, ChunkError, InsertStreamResult, SaveOutcome, SaveResult, validate_many
 from .fields import *
+from .indexes import index_manager, register
+from .cache import PkCache, QueryCache, _cursor_option, _missing, query_cache
+from .columns import to_columns
+from .lazy import LazyDocument
 from .model import BaseModel, ModelType
-from .utils import pluralize, info, normalize_indexes, default_index_name, have_same_shape, \
+from .projection import CallSite, ProjectionProfiler, include_field, loaded_names
+from .references import prefetch
+from .serialization import iter_ndjson
+from .session import current_session
+from .snapshot import diff, take_snapshot
+from .utils import chunked, hybridmethod, pluralize, info, normalize_indexes, default_index_name, have_same_shape, \
     not_none, warn, get_dict_item_with_dot
 
 __all__ = [
+    'ConflictError',
     'MongoModel',
 ]
 
@@ -24,14 +45,462 @@ __all__ = [
 T = TypeVar('T', bound=BaseModel)
 
 
+class ConflictError(RuntimeError):
+    """Raised when a versioned document was changed or deleted by another writer since it was loaded."""
+
+    def __init__(self, obj: Any):
+        self.obj = obj
+        version = type(obj)._get_plan().version
+        super().__init__('The document {!r} of {!r} at version {!r} was changed or deleted by another writer.'
+                         .format(obj.pk, type(obj).__name__, obj._data.get(version)))
+
+
+class _Route(NamedTuple):
+    db: Optional[Database]
+    # a name, a collection object, or None to keep the name of the default collection
+    collection: Union[None, str, Collection]
+    options: Dict[str, Any]
+
+
+# the database and collection of models switched in the current context, i.e. a thread or an asyncio task;
+# it's replaced rather than mutated, so contexts copied from it are not affected
+_routes: ContextVar[Dict[type, _Route]] = ContextVar('monom_routes', default={})
+
+_route_lock = RLock()
+
+
+def _take_batch(cursor, fetch: Callable[[], MutableMapping], length: int = None) -> List[MutableMapping]:
+    """Return the documents of the next batch received by a pymongo cursor, at most `length` of them,
+    or an empty list at the end; `fetch` returns the next document of the cursor.
+    """
+    if length is not None and length <= 0:
+        return []
+    try:
+        docs = [fetch()]
+    except StopIteration:
+        return []
+    buffered = _cursor_option(cursor, 'data')
+    if buffered:
+        if length is None or len(buffered) < length:
+            docs.extend(buffered)
+            buffered.clear()
+        else:
+            docs.extend(buffered.popleft() for _ in range(length - 1))
+    return docs
+
+
 class Cursor(PymongoCursor):
-    def __init__(self, model_cls: Type[T], *args, **kw):
-        super().__init__(*args, **kw)
+    def __init__(self, model_cls: Type[T], collection: Collection, filter: dict = None, projection=None,
+                 *args, profile=None, **kw):
+        super().__init__(collection, filter, projection, *args, **kw)
         self.model_cls = model_cls
+        # noinspection PyProtectedMember
+        self.loaded = loaded_names(projection, model_cls._get_plan().names)
+        self.profile = profile
+        self._prefetch_paths: Tuple[str, ...] = ()
+        self._prefetched: Deque[T] = deque()
 
     def __next__(self) -> T:
-        rv = super().__next__()
-        return self.model_cls.from_document(rv)
+        if not self._prefetch_paths:
+            return self._load(super().__next__())
+
+        if not self._prefetched:
+            objs = self._load_batch(self._next_batch())
+            if not objs:
+                raise StopIteration
+            self._prefetched.extend(objs)
+        return self._prefetched.popleft()
+
+    def batches(self, size: int = None) -> Iterator[List[T]]:
+        """Yield the models of each batch received from the server; `size` sets the `batch_size` of the cursor."""
+        if size is not None:
+            self.batch_size(size)
+        if self._prefetched:
+            yield self._take_prefetched()
+        while True:
+            objs = self._load_batch(self._next_batch())
+            if not objs:
+                return
+            yield objs
+
+    def to_list(self, length: int = None) -> List[T]:
+        """Return a list of at most `length` models, or all the remaining models if `length` is None.
+        The models are constructed batch by batch.
+        """
+        objs = self._take_prefetched(length)
+        while length is None or len(objs) < length:
+            batch = self._load_batch(self._next_batch(None if length is None else length - len(objs)))
+            if not batch:
+                break
+            objs.extend(batch)
+        return objs
+
+    def raw(self) -> Iterator[MutableMapping]:
+        """Yield the documents instead of models, keyed by the attribute names of the fields instead of their aliases,
+        which skips the construction of models.
+        """
+        # noinspection PyProtectedMember
+        to_attributes = self.model_cls._get_plan().to_attributes
+        while True:
+            docs = self._next_batch()
+            if not docs:
+                return
+            for doc in docs:
+                yield to_attributes(doc)
+
+    def to_columns(self, fields: List[str] = None) -> Dict[str, Any]:
+        """Return the values of the fields (by default all fields) as NumPy masked arrays typed by the fields,
+        filled batch by batch without constructing models; see :func:`~monom.columns.to_columns`.
+        """
+        return to_columns(self, fields)
+
+    def iter_ndjson(self) -> Iterator[bytes]:
+        """Yield the documents of each batch as newline-delimited JSON in UTF-8, encoded by the encoder compiled
+        for the model without constructing models; see :func:`~monom.serialization.iter_ndjson`.
+        """
+        return iter_ndjson(self)
+
+    def _take_prefetched(self, length: int = None) -> List[T]:
+        prefetched = self._prefetched
+        if length is None or length >= len(prefetched):
+            objs = list(prefetched)
+            prefetched.clear()
+            return objs
+        return [prefetched.popleft() for _ in range(length)]
+
+    def _load_batch(self, docs: List[MutableMapping]) -> List[T]:
+        """Construct the models of a batch of documents, like `_load` does for each of them."""
+        if not docs:
+            return []
+        if isinstance(docs[0], RawBSONDocument):
+            docs = [LazyDocument(doc) for doc in docs]
+        from_document = self.model_cls.from_document
+        objs = [from_document(doc) for doc in docs]
+
+        loaded = self.loaded
+        if loaded is not None:
+            for obj in objs:
+                obj._loaded = loaded
+        profile = self.profile
+        if profile is not None:
+            for obj in objs:
+                profile.observe(obj)
+        session = current_session()
+        if session is not None:
+            objs = [session.merge(obj) for obj in objs]
+        if self._prefetch_paths:
+            prefetch(objs, *self._prefetch_paths)
+        return objs
+
+    def prefetch(self, *paths: str) -> Cursor:
+        """Dereference the references along the paths (e.g. `'author'`, `'comments.user'`) of each batch of models
+        received from the server, by one `$in` query per referenced model; see :func:`~monom.references.prefetch`.
+        """
+        self._prefetch_paths += paths
+        return self
+
+    def _next_batch(self, length: int = None) -> List[MutableMapping]:
+        return _take_batch(self, super().__next__, length)
+
+    def _load(self, rv: MutableMapping) -> T:
+        if isinstance(rv, RawBSONDocument):
+            rv = LazyDocument(rv)
+        obj = self.model_cls.from_document(rv)
+        if self.loaded is not None:
+            obj._loaded = self.loaded
+        if self.profile is not None:
+            self.profile.observe(obj)
+        session = current_session()
+        if session is not None:
+            obj = session.merge(obj)
+        return obj
+
+    def _documents(self) -> Iterator[MutableMapping]:
+        while True:
+            try:
+                yield super().__next__()
+            except StopIteration:
+                return
+
+    def cached(self, ttl: float = None, cache: QueryCache = None) -> List[T]:
+        """Return the models of the documents cached by a :class:`~monom.cache.QueryCache`, by default
+        `monom.cache.query_cache`, or run the query and cache its documents for `ttl` seconds.
+        The cursor must not be iterated.
+        """
+        if self.retrieved:
+            raise RuntimeError('A cursor iterated cannot be cached.')
+        if cache is None:
+            cache = query_cache
+        return [self._load(doc) for doc in cache.fetch(self, self._documents, ttl)]
+
+
+class AggregateCursor:
+    """Wrap the documents of an aggregation into models, without converting them; if `validate` is true,
+    every document is validated, a batch at a time.
+    The other attributes are those of the :class:`~pymongo.command_cursor.CommandCursor`.
+    """
+
+    def __init__(self, model_cls: Type[BaseModel], cursor: CommandCursor, validate: bool = False):
+        self.model_cls = model_cls
+        self.cursor = cursor
+        self.validate = validate
+        # embedded models have no state to be set
+        self._wrap = getattr(model_cls, 'from_document', model_cls._from_clean_data)
+        # the number of documents loaded, for the indexes of validation errors
+        self._count = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.cursor, name)
+
+    def __iter__(self) -> AggregateCursor:
+        return self
+
+    def __next__(self) -> Any:
+        return self._load_batch([next(self.cursor)])[0]
+
+    def __enter__(self) -> AggregateCursor:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.cursor.close()
+
+    def batches(self) -> Iterator[List[Any]]:
+        """Yield the models of each batch received from the server."""
+        while True:
+            objs = self._load_batch(_take_batch(self.cursor, self.cursor.next))
+            if not objs:
+                return
+            yield objs
+
+    def to_list(self, length: int = None) -> List[Any]:
+        """Return a list of at most `length` models, or all the remaining models if `length` is None."""
+        objs = []
+        while length is None or len(objs) < length:
+            batch = self._load_batch(_take_batch(self.cursor, self.cursor.next,
+                                                 None if length is None else length - len(objs)))
+            if not batch:
+                break
+            objs.extend(batch)
+        return objs
+
+    def _load_batch(self, docs: List[MutableMapping]) -> List[Any]:
+        if self.validate:
+            # the documents of a pipeline don't always have the same shape, e.g. optional fields or `$group`s
+            validate_many(self.model_cls, docs, self._count)
+        self._count += len(docs)
+        wrap = self._wrap
+        return [wrap(doc) for doc in docs]
+
+
+def _aggregate_options(allow_disk_use: Optional[bool], batch_size: Optional[int], kw: dict) -> dict:
+    """Add the options of `aggregate_models` to the keyword arguments of `aggregate`."""
+    if allow_disk_use is not None:
+        kw['allowDiskUse'] = allow_disk_use
+    if batch_size is not None:
+        kw['batchSize'] = batch_size
+    return kw
+
+
+def _plan_save(objs: Iterable[MongoModel], full_update: bool,
+               upsert: bool) -> Tuple[SaveResult, Dict[Any, List[tuple]]]:
+    """Make the requests of `save_multiple`, grouped by collections as `(position, obj, operation, request)`."""
+    objs = list(objs)
+    result = SaveResult(len(objs))
+    groups = {}
+    for position, obj in enumerate(objs):
+        try:
+            operation, request = obj._get_write(full_update, upsert)
+        except RuntimeError:
+            # deleted models and models without `pk` cannot be saved
+            result.outcomes[position] = SaveOutcome(obj, 'none', 'skipped')
+            continue
+        collection = type(obj).get_collection()
+        groups.setdefault(collection, []).append((position, obj, operation, request))
+    return result, groups
+
+
+class _SaveGroup:
+    """Record the outcomes of the chunks written to one collection by `save_multiple`."""
+
+    def __init__(self, result: SaveResult, ordered: bool):
+        self.result = result
+        self.ordered = ordered
+        self.failed = False
+        # how many documents the last chunk didn't match, and its versioned writes which may have missed
+        self.missed = 0
+        self.suspects: List[tuple] = []
+
+    def chunks(self, writes: List[tuple], chunk_size: int) -> Iterator[List[tuple]]:
+        """Yield the writes of each chunk that have requests to be sent."""
+        outcomes = self.result.outcomes
+        for chunk in chunked(writes, chunk_size):
+            requests = []
+            for position, obj, operation, request in chunk:
+                if self.failed:
+                    outcomes[position] = SaveOutcome(obj, operation, 'skipped')
+                elif request is None:
+                    outcomes[position] = SaveOutcome(obj, operation, 'ok')
+                else:
+                    requests.append((position, obj, operation, request))
+            if requests:
+                yield requests
+
+    def record(self, requests: List[tuple], details: dict) -> Optional[Tuple[dict, dict]]:
+        """Record the result of a bulk write, from `BulkWriteResult.bulk_api_result` or `BulkWriteError.details`.
+        If versioned writes may have missed, return the filter and projection to query the current versions
+        of their documents, which are passed to :meth:`record_conflicts`.
+        """
+        outcomes = self.result.outcomes
+        errors = {error['index']: error for error in details.get('writeErrors', [])}
+        first_error = min(errors) if errors else None
+
+        for index, (position, obj, operation, _) in enumerate(requests):
+            if index in errors:
+                outcomes[position] = SaveOutcome(obj, operation, 'failed', errors[index])
+            elif self.ordered and first_error is not None and index > first_error:
+                outcomes[position] = SaveOutcome(obj, operation, 'skipped')
+            else:
+                outcomes[position] = SaveOutcome(obj, operation, 'ok')
+
+        for upserted in details.get('upserted', []):
+            self.result.upserted_ids[requests[upserted['index']][0]] = upserted['_id']
+        self.result.add_counts(details)
+        self.failed = self.ordered and bool(errors)
+
+        self.missed, self.suspects = self._suspects(requests, details)
+        if not self.suspects:
+            return None
+        return self._version_query(self.suspects)
+
+    def _suspects(self, requests: List[tuple], details: dict) -> Tuple[int, List[tuple]]:
+        """Return how many documents written were not matched, and the versioned writes which may have missed."""
+        outcomes = self.result.outcomes
+        written = [write for write in requests
+                   if write[2] in {'update', 'replace', 'delete'} and outcomes[write[0]].status == 'ok']
+        missed = len(written) - sum(details.get(key, 0) for key in ('nMatched', 'nRemoved', 'nUpserted'))
+        if missed <= 0:
+            return 0, []
+        # noinspection PyProtectedMember
+        return missed, [write for write in written
+                        if write[1]._state != 'before_save' and type(write[1])._get_plan().version is not None]
+
+    @staticmethod
+    def _version_query(suspects: List[tuple]) -> Tuple[dict, dict]:
+        pks = [obj.pk for _, obj, _, _ in suspects]
+        return {'_id': {'$in': pks}}, {type(obj)._get_plan().version: True for _, obj, _, _ in suspects}
+
+    def record_conflicts(self, docs: Iterable[MutableMapping]) -> None:
+        """Record the suspects of the last chunk as conflicts, if their documents don't have the versions written."""
+        docs = {doc['_id']: doc for doc in docs}
+        conflicts, unknown = [], []
+        for write in self.suspects:
+            _, obj, operation, _ = write
+            doc = docs.get(obj.pk)
+            if operation == 'delete':
+                (conflicts if doc is not None else unknown).append(write)
+            elif doc is None or doc.get(type(obj)._get_plan().version) != obj._next_version():
+                conflicts.append(write)
+            else:
+                unknown.append(write)
+
+        # a write can't be told apart from a concurrent write of the same version,
+        # so they are reported as conflicts unless the documents missed are explained by the other conflicts
+        if len(conflicts) < self.missed:
+            conflicts.extend(unknown)
+        outcomes = self.result.outcomes
+        for position, obj, operation, _ in conflicts:
+            outcomes[position] = SaveOutcome(obj, operation, 'conflict')
+
+
+class _InsertStream:
+    """Convert and validate the documents of `insert_stream` chunk by chunk,
+    and record the results of inserting the chunks.
+    """
+
+    def __init__(self, model_cls: Type[BaseModel], ordered: bool, validate: bool):
+        self.model_cls = model_cls
+        self.ordered = ordered
+        self.validate = validate
+        self.result = InsertStreamResult()
+        # the number of the current chunk, and whether it has errors
+        self.number = -1
+        self.failed = False
+        # the errors of the documents failed to be converted, not recorded yet
+        self.pending: List[BatchValidationError] = []
+
+    def chunks(self, documents: Iterable[MutableMapping], chunk_size: int, max_bytes: Optional[int],
+               codec_options) -> Iterator[List[MutableMapping]]:
+        """Yield the valid documents of each chunk to be inserted; with `ordered`, it stops at the first error."""
+        result = self.result
+
+        def weigh(item: Tuple[int, MutableMapping]) -> int:
+            doc = item[1]
+            # pymongo will add an `_id` of 17 bytes
+            return len(bson.encode(doc, codec_options=codec_options)) + (0 if '_id' in doc else 17)
+
+        for number, chunk in enumerate(chunked(self._convert(documents), chunk_size, max_bytes, weigh)):
+            result.chunk_count += 1
+            self.number = number
+
+            self.failed = False
+            docs = []
+            # the documents failed to be converted split a chunk into runs of consecutive documents
+            for start, run in self._runs(chunk):
+                if self.validate:
+                    run, errors = self.model_cls._validate_chunk(run, start, self.ordered)
+                    result.errors.extend(ChunkError(number, error) for error in errors)
+                    self.failed = self.failed or bool(errors)
+                docs.extend(run)
+
+            if docs:
+                yield docs
+
+            # a conversion error after the first error is never reached when ordered
+            if self.failed and self.ordered:
+                return
+            self._record_pending(number)
+
+        self._record_pending(self.number + 1)
+
+    def _convert(self, documents: Iterable[MutableMapping]) -> Iterator[Tuple[int, MutableMapping]]:
+        """Yield the indexes and the converted documents; with `ordered`, it stops at the first error."""
+        model_cls = self.model_cls
+        for index, document in enumerate(documents):
+            try:
+                yield index, model_cls._get_clean_data(document, bypass_validation=True)
+            except (TypeError, ValueError) as err:
+                self.pending.append(BatchValidationError.from_conversion(model_cls, document, index, err))
+                if self.ordered:
+                    return
+
+    @staticmethod
+    def _runs(chunk: List[Tuple[int, MutableMapping]]) -> Iterator[Tuple[int, List[MutableMapping]]]:
+        """Yield the index of the first document and the documents of each run of consecutive indexes."""
+        start, run = None, []
+        for index, doc in chunk:
+            if run and index != start + len(run):
+                yield start, run
+                run = []
+            if not run:
+                start = index
+            run.append(doc)
+        if run:
+            yield start, run
+
+    def _record_pending(self, number: int) -> None:
+        if self.pending:
+            self.result.errors.extend(ChunkError(number, error) for error in self.pending)
+            self.pending = []
+
+    def record(self, chunk: List[MutableMapping], rv: InsertManyResult) -> None:
+        self.result.inserted_count += len(rv.inserted_ids)
+        self.model_cls._invalidate_docs(chunk)
+
+    def record_error(self, chunk: List[MutableMapping], err: BulkWriteError) -> None:
+        self.result.inserted_count += err.details.get('nInserted', 0)
+        self.result.errors.append(ChunkError(self.number, err))
+        self.failed = True
+        self.model_cls._invalidate_docs(chunk)
 
 
 # noinspection PyShadowingBuiltins,PyMethodParameters
@@ -48,41 +517,163 @@ class CollectionMixin(type):
                    bypass_document_validation: bool = False,
                    session=None) -> InsertOneResult:
         doc = cls._get_clean_data(document, bypass_validation=bypass_document_validation)
-        return cls.get_collection().insert_one(
+        rv = cls.get_collection().insert_one(
             doc, bypass_document_validation=bypass_document_validation, session=session
         )
+        cls._invalidate_docs([doc])
+        return rv
 
     def insert_many(cls: Type[T],
                     documents: Iterable[MutableMapping],
                     ordered: bool = True,
                     bypass_document_validation: bool = False,
                     session=None) -> InsertManyResult:
-        docs = [cls._get_clean_data(document, bypass_validation=bypass_document_validation) for document in documents]
-        return cls.get_collection().insert_many(
-            docs, ordered=ordered, bypass_document_validation=bypass_document_validation, session=session
-        )
+        docs = [cls._get_clean_data(document, bypass_validation=True) for document in documents]
+        if not bypass_document_validation:
+            validate_many(cls, docs)
+        try:
+            return cls.get_collection().insert_many(
+                docs, ordered=ordered, bypass_document_validation=bypass_document_validation, session=session
+            )
+        finally:
+            cls._invalidate_docs(docs)
+
+    def insert_stream(cls: Type[T],
+                      documents: Iterable[MutableMapping],
+                      chunk_size: int = 1000,
+                      max_bytes: int = None,
+                      ordered: bool = True,
+                      bypass_document_validation: bool = False,
+                      session=None) -> InsertStreamResult:
+        """Insert documents from an iterable lazily, in chunks of at most `chunk_size` documents
+        and `max_bytes` bytes of BSON if given; so the memory used doesn't grow with the input.
+
+        If `ordered` is true, the documents are inserted in order and it stops at the first error;
+        otherwise documents failed to be converted or validated are skipped, and the chunks are inserted
+        with `ordered=False`. Errors are collected in the result with the number of their chunks
+        and the indexes of their documents, instead of being raised.
+        """
+
+        collection = cls.get_collection()
+        stream = _InsertStream(cls, ordered, not bypass_document_validation)
+        for chunk in stream.chunks(documents, chunk_size, max_bytes, collection.codec_options):
+            try:
+                rv = collection.insert_many(
+                    chunk, ordered=ordered, bypass_document_validation=bypass_document_validation, session=session
+                )
+            except BulkWriteError as err:
+                stream.record_error(chunk, err)
+            else:
+                stream.record(chunk, rv)
+        return stream.result
+
+    def _validate_chunk(cls: Type[T], docs: List[MutableMapping], offset: int,
+                        ordered: bool) -> Tuple[List[MutableMapping], List[BatchValidationError]]:
+        """Return the valid documents and the errors. When `ordered`, only those before the first error are valid."""
+        valid, errors = [], []
+        start = 0
+        while start < len(docs):
+            try:
+                validate_many(cls, docs[start:], offset + start)
+            except BatchValidationError as err:
+                index = err.index - offset
+                valid.extend(docs[start:index])
+                errors.append(err)
+                if ordered:
+                    return valid, errors
+                start = index + 1
+            else:
+                valid.extend(docs[start:])
+                break
+        return valid, errors
 
     #################################
     # Query
     #################################
 
-    def find_one(cls: Type[T], filter: dict = None, *args, **kw) -> Optional[T]:
-        result = cls.get_collection().find_one(filter, *args, **kw)
+    def find_one(cls: Type[T], filter: dict = None, projection=None, *args, **kw) -> Optional[T]:
+        cache = cls.pk_cache
+        if cache is not None and projection is None and not args and not kw:
+            pk = cache.pk_of(filter)
+            if pk is not _missing:
+                collection = cls.get_collection()
+                result = cache.fetch(collection, pk, lambda: collection.find_one({'_id': pk}))
+                if result is not None:
+                    return cls._get_loaded_model(result, None, None)
+                return None
+
+        projection, profile = cls._profile_projection(projection)
+
+        result = cls.get_collection().find_one(filter, projection, *args, **kw)
         if result is not None:
-            return cls.from_document(result)
+            return cls._get_loaded_model(result, projection, profile)
+
+    def _invalidate(cls: Type[T], filter: Any = None) -> None:
+        """Invalidate the cached documents matched by a filter; see :class:`~monom.cache.PkCache`."""
+        cache = cls.pk_cache
+        if cache is not None:
+            cache.invalidate(cls.get_collection(), filter)
+
+    def _invalidate_docs(cls: Type[T], docs: Iterable[MutableMapping]) -> None:
+        # misses of the primary keys of inserted documents may be cached
+        if cls.pk_cache is not None:
+            for doc in docs:
+                if '_id' in doc:
+                    cls._invalidate({'_id': doc['_id']})
+
+    def _profile_projection(cls: Type[T], projection) -> Tuple[Any, Optional[CallSite]]:
+        """Return the projection to be used, and the call site profiled if no projection is given."""
+        profile = None
+        if projection is None and cls.projection_profiler is not None:
+            profile = cls.projection_profiler.site(cls)
+            if profile.applied:
+                projection = profile.projection
+        return cls._versioned_projection(projection), profile
+
+    def _versioned_projection(cls: Type[T], projection):
+        """Return the projection which loads the version of a versioned model as well,
+        since the writes of the models loaded by it match the version.
+        """
+        version = cls._get_plan().version
+        if version is None:
+            return projection
+        return include_field(projection, version)
+
+    def _get_loaded_model(cls: Type[T], doc: MutableMapping, projection, profile: Optional[CallSite]) -> T:
+        obj = cls.from_document(doc)
+        if projection is not None:
+            obj._loaded = loaded_names(projection, cls._get_plan().names)
+        if profile is not None:
+            profile.observe(obj)
+        session = current_session()
+        if session is not None:
+            obj = session.merge(obj)
+        return obj
+
+    def find(cls: Type[T], filter: dict = None, projection=None, *args,
+             lazy: bool = False, **kw) -> Union[Cursor, Iterable[T]]:
+        """If `lazy` is true, the documents are fetched as raw BSON and their fields are decoded on first access."""
+        projection, profile = cls._profile_projection(projection)
 
-    def find(cls: Type[T], *args, **kw) -> Union[Cursor, Iterable[T]]:
-        return Cursor(cls, cls.get_collection(), *args, **kw)
+        collection = cls.get_collection()
+        if lazy:
+            codec_options = collection.codec_options.with_options(document_class=RawBSONDocument)
+            collection = collection.with_options(codec_options=codec_options)
+        return Cursor(cls, collection, filter, projection, *args, profile=profile, **kw)
 
     #################################
     # Deletion
     #################################
 
     def delete_one(cls: Type[T], filter: dict, collation: Collation = None, session=None) -> DeleteResult:
-        return cls.get_collection().delete_one(filter, collation=collation, session=session)
+        rv = cls.get_collection().delete_one(filter, collation=collation, session=session)
+        cls._invalidate(filter)
+        return rv
 
     def delete_many(cls: Type[T], filter: dict, collation: Collation = None, session=None) -> DeleteResult:
-        return cls.get_collection().delete_many(filter, collation=collation, session=session)
+        rv = cls.get_collection().delete_many(filter, collation=collation, session=session)
+        cls._invalidate(filter)
+        return rv
 
     #################################
     # Update
@@ -96,10 +687,12 @@ class CollectionMixin(type):
                     collation: Collation = None,
                     session=None) -> UpdateResult:
         doc = cls._get_clean_data(replacement, bypass_validation=bypass_document_validation)
-        return cls.get_collection().replace_one(
+        rv = cls.get_collection().replace_one(
             filter, doc, upsert=upsert, bypass_document_validation=bypass_document_validation,
             collation=collation, session=session
         )
+        cls._invalidate(filter)
+        return rv
 
     def update_one(cls: Type[T],
                    filter: dict,
@@ -110,10 +703,12 @@ class CollectionMixin(type):
                    array_filters: List[dict] = None,
                    session=None) -> UpdateResult:
         update = cls._get_clean_update(update, bypass_document_validation)
-        return cls.get_collection().update_one(
+        rv = cls.get_collection().update_one(
             filter, update, upsert=upsert, bypass_document_validation=bypass_document_validation,
             collation=collation, array_filters=array_filters, session=session
         )
+        cls._invalidate(filter)
+        return rv
 
     def update_many(cls: Type[T],
                     filter: dict,
@@ -124,10 +719,12 @@ class CollectionMixin(type):
                     collation: Collation = None,
                     session=None) -> UpdateResult:
         update = cls._get_clean_update(update, bypass_document_validation)
-        return cls.get_collection().update_many(
+        rv = cls.get_collection().update_many(
             filter, update, upsert=upsert, array_filters=array_filters,
             bypass_document_validation=bypass_document_validation, collation=collation, session=session
         )
+        cls._invalidate(filter)
+        return rv
 
     #################################
     # FindAndXXX
@@ -142,6 +739,7 @@ class CollectionMixin(type):
         result = cls.get_collection().find_one_and_delete(
             filter, projection=projection, sort=sort, session=session, **kw
         )
+        cls._invalidate(filter)
         if result is not None:
             return cls.from_document(result)
 
@@ -155,10 +753,12 @@ class CollectionMixin(type):
                              return_document: bool = ReturnDocument.BEFORE,
                              session=None, **kw) -> Optional[T]:
         doc = cls._get_clean_data(replacement, bypass_validation=bypass_document_validation)
+        projection = cls._versioned_projection(projection)
         result = cls.get_collection().find_one_and_replace(
             filter, doc, projection=projection, sort=sort, upsert=upsert, return_document=return_document,
             session=session, **kw
         )
+        cls._invalidate(filter)
         if result is not None:
             return cls.from_document(result)
 
@@ -173,10 +773,12 @@ class CollectionMixin(type):
                             array_filters: List[dict] = None,
                             session=None, **kw) -> Optional[T]:
         update = cls._get_clean_update(update, bypass_document_validation)
+        projection = cls._versioned_projection(projection)
         result = cls.get_collection().find_one_and_update(
             filter, update, projection=projection, sort=sort, upsert=upsert, return_document=return_document,
             array_filters=array_filters, session=session, **kw
         )
+        cls._invalidate(filter)
         if result is not None:
             return cls.from_document(result)
 
@@ -187,6 +789,16 @@ class CollectionMixin(type):
     def aggregate(cls: Type[T], pipeline: List[dict], session=None, **kw) -> CommandCursor:
         return cls.get_collection().aggregate(pipeline, session, **kw)
 
+    def aggregate_models(cls: Type[T], pipeline: List[dict], as_: Type[BaseModel] = None, validate: bool = False,
+                         allow_disk_use: bool = None, batch_size: int = None, session=None, **kw) -> AggregateCursor:
+        """Run an aggregation, and return a cursor of its documents wrapped in models of `as_` (by default this model)
+        without converting them; if `validate` is true, the documents of each batch are validated,
+        and :class:`~monom.batch.BatchValidationError` is raised for the first invalid one.
+        """
+        kw = _aggregate_options(allow_disk_use, batch_size, kw)
+        cursor = cls.get_collection().aggregate(pipeline, session=session, **kw)
+        return AggregateCursor(cls if as_ is None else as_, cursor, validate=validate)
+
     def estimated_document_count(cls: Type[T], **kw) -> int:
         return cls.get_collection().estimated_document_count(**kw)
 
@@ -200,122 +812,407 @@ class CollectionMixin(type):
 class MongoModelType(ModelType, CollectionMixin):
     """Base class of `MongoModel`."""
 
+    def __init__(cls, name, bases, attrs):
+        super().__init__(name, bases, attrs)
+        if '_no_parse_hints' not in cls.__dict__:
+            cls._register()
+
+    def _register(cls) -> None:
+        register(cls)
+
 
 class MongoModel(BaseModel, metaclass=MongoModelType):
     # Automatic index creation or deletion can be disabled by setting this flag to false.
     # Index creation may be performed as part of a deployment system when in production
     auto_build_index: bool = True
 
+    # Caches the documents looked up by primary keys, and invalidates them on the writes issued through the model;
+    # see :class:`~monom.cache.PkCache`.
+    pk_cache: Optional[PkCache] = None
+
+    # Records which fields are read from the documents queried at each call site of `find` and `find_one`,
+    # and suggests or applies minimal projections; see :class:`~monom.projection.ProjectionProfiler`.
+    projection_profiler: Optional[ProjectionProfiler] = None
+
+    # Whether keeps a snapshot of each document loaded or saved, and saves the differences from it instead of
+    # the tracked assignments and mutations; it catches changes in place of any nested value,
+    # at the cost of copying the documents. See :mod:`monom.snapshot`.
+    snapshot_changes: bool = False
+
     _db: Database = None
     _collection: Collection = None
 
+    _instance_attrs = BaseModel._instance_attrs + ('_state',)
+    _extra_attrs = BaseModel._extra_attrs + ('_loaded', '_profile', '_snapshot')
+
+    # the document as loaded or saved, if `snapshot_changes` is set
+    _snapshot: Any = None
+
     _no_parse_hints: bool = True
+    __slots__ = ()
 
     def __init__(self, **kw):
         super().__init__(**kw)
         self._state = 'before_save'
 
+    @hybridmethod
+    def get(cls: Type[T], pk: Any) -> Optional[T]:
+        """Called on the class, return the model of the primary key,
+        from the identity map of the current session if any.
+        """
+        session = current_session()
+        if session is not None:
+            obj = session.lookup(cls, pk)
+            if obj is not None:
+                return obj
+        return cls.find_one({'_id': pk})
+
+    @get.instancemethod
+    def get(self, name: str, default=None) -> Any:
+        return BaseModel.get(self, name, default)
+
     @property
     def pk(self) -> Optional[Any]:
         """An alias for the primary key (`_id` in MongoDB)."""
         return self._data.get('_id', None)
 
-    def save(self, full_update: bool = False, **kw):
+    def save(self, full_update: bool = False, on_conflict: Callable[[Any], Any] = None, max_retries: int = 3, **kw):
         """Save the document into MongoDB.
         1. The new document will be inserted into MongoDB.
         2. The existing document will be updated atomically using operator '$set' and '$unset'.
-        3. `list` mutation cannot be tracked; but you can pass an keyword argument `full_update=True`
-            to perform a full update.
+        3. Mutations of lists and dicts are saved by '$push', '$pull', '$set' and '$unset' (see :mod:`monom.tracking`);
+            pass an keyword argument `full_update=True` to replace the whole document.
+        4. The document marked for deletion will be deleted.
+        5. The writes of a model with `Meta.version_field` only match the version loaded, and increment it;
+            :class:`ConflictError` is raised if the document was changed or deleted by another writer.
+            With `on_conflict`, the model is reloaded and passed to it to apply the changes again,
+            and saved again up to `max_retries` times.
 
         :return This object with the `pk` property filled if it wasn't already.
         """
 
-        state = self._state
-        collection = type(self).get_collection()
+        while True:
+            try:
+                return self._save(full_update, **kw)
+            except ConflictError:
+                if on_conflict is None or max_retries <= 0:
+                    raise
+            max_retries -= 1
+            self.reload()
+            on_conflict(self)
+
+    def _save(self, full_update: bool, **kw):
+        if self._state == 'marked_for_deletion':
+            self.delete(**kw)
+            return self
+
+        write = self._prepare_save(full_update)
+        if write is not None:
+            method, args = write
+            self._finish_save(method, getattr(type(self).get_collection(), method)(*args, **kw))
+        return self
 
+    def _prepare_save(self, full_update: bool) -> Optional[Tuple[str, tuple]]:
+        """Return the method of the collection and its arguments to save this document (except for deletion),
+        or None if nothing changed.
+        """
+        state = self._state
+        if state == 'deleted':
+            raise RuntimeError('The document has been deleted.')
         if state == 'before_save':
-            collection.insert_one(self.to_dict(), **kw)
-            self._clear_tracked_fields()
+            self._init_version()
+            return 'insert_one', (self._get_document(),)
+
+        doc = self._get_document()
+        if self.pk is None:
+            raise RuntimeError("The document without an '_id' cannot be saved.")
+
+        update = {'$set': doc} if full_update else self._get_tracked_update(doc)
+        if not update:
+            # nothing changed
+            return None
+        return 'update_one', (self._write_filter(), self._version_update(update))
+
+    def _finish_save(self, method: str, rv: Any) -> None:
+        """Update the state of this model after the write made by :meth:`_prepare_save`."""
+        if method == 'update_one':
+            self._check_version(rv.acknowledged and rv.matched_count)
+        self._clear_tracked_fields()
+        if self._state == 'before_save':
             self._state = 'after_save'
-        elif state in {'after_save', 'from_document'}:
-            doc = self.to_dict()
-            if self.pk is None:
-                raise RuntimeError("The document without an '_id' cannot be saved.")
+        type(self)._invalidate({'_id': self.pk})
 
-            if full_update:
-                collection.update_one({'_id': self.pk}, {'$set': doc}, **kw)
-            else:
-                modified, deleted = self._combine_tracked_fields()
-                update = {}
-                if modified:
-                    update['$set'] = {field: get_dict_item_with_dot(doc, field) for field in modified}
-                if deleted:
-                    update['$unset'] = {field: '' for field in deleted}
-                collection.update_one({'_id': self.pk}, update, **kw)
-            self._clear_tracked_fields()
-        elif state == 'deleted':
-            raise RuntimeError('The document has been deleted.')
+    def reload(self):
+        """Replace the data of this model with the document in MongoDB, discarding the changes not saved.
 
+        :return This object.
+        """
+        if self.pk is None:
+            raise RuntimeError("The document without an '_id' cannot be reloaded.")
+        self._reset(type(self).get_collection().find_one({'_id': self.pk}))
         return self
 
+    def _reset(self, doc: Optional[MutableMapping]) -> None:
+        if doc is None:
+            raise RuntimeError('The document {!r} does not exist.'.format(self.pk))
+        self._data = doc
+        wrappers = self._wrappers
+        if wrappers:
+            for name in type(self)._get_plan().names:
+                wrappers.pop(name, None)
+        self._loaded = None
+        self._state = 'from_document'
+        self._clear_tracked_fields()
+
+    def _init_version(self) -> None:
+        version = type(self)._get_plan().version
+        if version is not None and version not in self._data:
+            self._data[version] = 0
+
+    def _next_version(self) -> int:
+        # `$inc` of a missing field sets it to the increment
+        return (self._data.get(type(self)._get_plan().version) or 0) + 1
+
+    def _write_filter(self) -> dict:
+        """The filter of the writes of this document, which matches its version if the model is versioned."""
+        version = type(self)._get_plan().version
+        if version is None:
+            return {'_id': self.pk}
+        return {'_id': self.pk, version: self._data.get(version)}
+
+    def _version_update(self, update: dict) -> dict:
+        """Add the increment of the version to an update, in place of any other change of the version."""
+        version = type(self)._get_plan().version
+        if version is None:
+            return update
+        rv = {}
+        for operator, fields in update.items():
+            fields = {path: value for path, value in fields.items() if path != version}
+            if fields:
+                rv[operator] = fields
+        rv['$inc'] = {version: 1}
+        return rv
+
+    def _check_version(self, count: Union[int, bool]) -> None:
+        """Bump the version after a write of the document, or raise :class:`ConflictError` if nothing was matched.
+        `count` is `False` for unacknowledged writes, which are assumed to be applied.
+        """
+        version = type(self)._get_plan().version
+        if version is None:
+            return
+        if count == 0 and count is not False:
+            type(self)._invalidate({'_id': self.pk})
+            raise ConflictError(self)
+        self._data[version] = self._next_version()
+
+    def mark_for_deletion(self) -> None:
+        """Mark the document to be deleted by the next `save` or `save_multiple`."""
+        if self._state == 'before_save':
+            raise RuntimeError('You cannot delete a document that was not saved.')
+        if self._state == 'deleted':
+            raise RuntimeError('The document has been deleted.')
+        self._state = 'marked_for_deletion'
+
+    def _is_dirty(self, full_update: bool = False) -> bool:
+        """Whether the model has changes to be saved."""
+        state = self._state
+        if state in {'before_save', 'marked_for_deletion'}:
+            return True
+        if state == 'deleted':
+            return False
+        if full_update:
+            return True
+        if self._snapshot is not None:
+            return bool(self._get_tracked_update(self._get_document()))
+        modified, deleted = self._combine_tracked_fields()
+        return bool(modified or deleted or self._combine_tracked_containers())
+
+    def _get_tracked_update(self, doc: MutableMapping) -> dict:
+        snapshot = self._snapshot
+        if snapshot is not None:
+            # raw snapshots of lazy documents are decoded like the documents queried
+            options = type(self).get_collection().codec_options if isinstance(snapshot, bytes) else None
+            return diff(snapshot, doc, options)
+
+        modified, deleted = self._combine_tracked_fields()
+        update = {}
+        if modified:
+            update['$set'] = {field: get_dict_item_with_dot(doc, field) for field in modified}
+        if deleted:
+            update['$unset'] = {field: '' for field in deleted}
+        # changes of lists and dicts in place, see :mod:`monom.tracking`
+        for operator, fields in self._combine_tracked_containers().items():
+            update.setdefault(operator, {}).update(fields)
+        return update
+
+    def _get_write(self, full_update: bool = False, upsert: bool = False) -> Tuple[str, Any]:
+        """Return the name of the operation and the request of bulk write to save this document."""
+
+        state = self._state
+        pk = self.pk
+        version = type(self)._get_plan().version
+        if version is not None:
+            # an upsert would turn a version mismatch into a duplicate key error, or resurrect a document deleted
+            # by another writer; and a new document would replace the one of another writer
+            upsert = False
+
+        if state == 'deleted':
+            raise RuntimeError('The document has been deleted.')
+        if state == 'marked_for_deletion':
+            if pk is None:
+                raise RuntimeError("The document without an '_id' cannot be deleted.")
+            return 'delete', DeleteOne(self._write_filter())
+
+        if state == 'before_save':
+            self._init_version()
+            doc = self._get_document()
+            if upsert and pk is not None:
+                return 'replace', ReplaceOne({'_id': pk}, doc, upsert=True)
+            return 'insert', InsertOne(doc)
+
+        doc = self._get_document()
+
+        if pk is None:
+            raise RuntimeError("The document without an '_id' cannot be saved.")
+        if full_update:
+            if self._loaded is not None:
+                # a replacement would delete the fields left out by the projection
+                return 'update', UpdateOne(self._write_filter(), self._version_update({'$set': doc}), upsert=upsert)
+            if version is not None:
+                doc = dict(doc)
+                doc[version] = self._next_version()
+            return 'replace', ReplaceOne(self._write_filter(), doc, upsert=upsert)
+
+        update = self._get_tracked_update(doc)
+        if not update:
+            return 'none', None
+        return 'update', UpdateOne(self._write_filter(), self._version_update(update), upsert=upsert)
+
+    def _clear_tracked_fields(self) -> None:
+        super()._clear_tracked_fields()
+        if type(self).snapshot_changes and self._state != 'deleted':
+            self._snapshot = take_snapshot(self._get_document())
+
+    def _after_write(self, operation: str) -> None:
+        if operation != 'none':
+            type(self)._invalidate({'_id': self.pk})
+        if operation == 'delete':
+            self._state = 'deleted'
+        elif self._state == 'before_save':
+            self._state = 'after_save'
+        elif operation in {'update', 'replace'}:
+            self._check_version(True)
+        self._clear_tracked_fields()
+
     @classmethod
-    def save_multiple(cls: Type[MongoModel], objs: Iterable[MongoModel], **kw) -> Optional[BulkWriteResult]:
-        """ Works like save() but applies to multiple models in a bulk_write
+    def save_multiple(cls: Type[MongoModel],
+                      objs: Iterable[MongoModel],
+                      full_update: bool = False,
+                      upsert: bool = False,
+                      ordered: bool = True,
+                      chunk_size: int = 1000,
+                      max_workers: int = None,
+                      raise_on_error: bool = True,
+                      **kw) -> SaveResult:
+        """Works like `save` but applies to multiple models in bulk writes.
+
+        1. New documents are inserted, or replaced with `upsert=True` if they have a `pk` already
+            (`upsert` is ignored for versioned models).
+        2. Existing documents are updated with their tracked fields, or replaced if `full_update` is true;
+            the documents loaded with a projection are updated with `$set` of their fields instead.
+        3. Documents marked by `mark_for_deletion` are deleted.
+
+        The models are grouped by their own collections, and written in chunks of `chunk_size` requests;
+        the collections are written in parallel by a thread pool of `max_workers` threads.
+        With `ordered`, the chunks of a collection stop at the first error.
+        If any write failed, :class:`~monom.batch.SaveError` (a :class:`~pymongo.errors.BulkWriteError`)
+        is raised after the states of the models written are updated; with `raise_on_error=False`,
+        write errors are collected in the result instead. Deleted models and models without `pk` are skipped.
+        The writes of versioned models which were not matched are recorded as conflicts, rather than raising
+        :class:`ConflictError`; since bulk writes don't tell which requests matched, a write which can't be told apart
+        from a concurrent write of the same version may be reported as a conflict too.
+
+        :return A :class:`~monom.batch.SaveResult` with the outcome of each model, in the same order as the models.
+        """
 
-         :return A BulkWriteResult containing some basic details about what was saved.
-         """
-        collection = cls.get_collection()
-        writes = []
-        for obj in objs:
-            state = obj._state
-            if state == 'before_save':
-                operation = InsertOne(obj.to_dict())
-                obj._state = "after_save"
-            elif state in {'after_save', 'from_document'}:
-                doc = obj.to_dict()
-                if obj.pk is None:
-                    continue
-                modified, deleted = obj._combine_tracked_fields()
-                update = {}
-                if modified:
-                    update['$set'] = {field: get_dict_item_with_dot(doc, field) for field in modified}
-                if deleted:
-                    update['$unset'] = {field: '' for field in deleted}
-                operation = UpdateOne({'_id': obj.pk}, update)
+        result, groups = _plan_save(objs, full_update, upsert)
+
+        def flush(collection: Collection, writes: List[tuple]) -> None:
+            group = _SaveGroup(result, ordered)
+            for requests in group.chunks(writes, chunk_size):
+                try:
+                    details = collection.bulk_write([request for *_, request in requests], ordered=ordered,
+                                                    **kw).bulk_api_result
+                except BulkWriteError as err:
+                    details = err.details
+                query = group.record(requests, details)
+                if query is not None:
+                    group.record_conflicts(collection.find(*query, session=kw.get('session')))
+
+        # the models written are updated even if the writes of another collection raised
+        try:
+            # sessions cannot be used by multiple threads at the same time
+            if len(groups) > 1 and kw.get('session') is None:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [executor.submit(flush, collection, writes) for collection, writes in groups.items()]
+                for future in futures:
+                    future.result()
             else:
-                continue
-            writes.append(operation)
-            obj._clear_tracked_fields()
+                for collection, writes in groups.items():
+                    flush(collection, writes)
+        finally:
+            result.finish()
 
-        if not writes:
-            return None
-        return collection.bulk_write(writes, **kw)
+        return result.raise_errors() if raise_on_error else result
 
     def delete(self, **kw) -> None:
         """Delete the document from MongoDB"""
+        rv = type(self).get_collection().delete_one(self._prepare_delete(), **kw)
+        self._finish_delete(rv)
 
-        state = self._state
-        collection = type(self).get_collection()
-
-        if state == 'before_save':
+    def _prepare_delete(self) -> dict:
+        """Return the filter to delete this document."""
+        if self._state == 'before_save':
             raise RuntimeError('You cannot delete a document that was not saved.')
         if self.pk is None:
             raise RuntimeError("The document without an '_id' cannot be deleted.")
+        return self._write_filter()
 
-        collection.delete_one({'_id': self.pk}, **kw)
+    def _finish_delete(self, rv: DeleteResult) -> None:
+        type(self)._invalidate({'_id': self.pk})
+        self._check_version(rv.acknowledged and rv.deleted_count)
         self._state = 'deleted'
         self._clear_tracked_fields()
 
+    def _load_field(self, name: str) -> Any:
+        profile = self._profile
+        loaded = self._loaded
+        # a field outside of a projection derived by the profiler is fetched on demand
+        if profile is not None and profile.applied and loaded is not None and name not in loaded \
+                and self.pk is not None:
+            profile.widen(name)
+            self._loaded = loaded | {name}
+            doc = type(self).get_collection().find_one({'_id': self.pk}, {name: True})
+            if doc is not None and name in doc:
+                self._data[name] = doc[name]
+                return doc[name]
+        return super()._load_field(name)
+
     @classmethod
     def from_document(cls, doc: MutableMapping):
         """Construct an instance of this class from the given document."""
         obj = cls._from_clean_data(doc)
         obj._state = 'from_document'
+        if cls.snapshot_changes:
+            obj._snapshot = take_snapshot(doc)
         return obj
 
     @classmethod
     def get_db(cls) -> Database:
         """Return :class:`pymongo.database.Database`."""
+        route = _routes.get().get(cls)
+        if route is not None and route.db is not None:
+            return route.db
         return cls._db
 
     @classmethod
@@ -325,11 +1222,19 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
     @classmethod
     def get_collection(cls) -> Collection:
         """Return :class:`pymongo.collection.Collection`."""
-        if not cls.__dict__.get('_collection'):
-            collection = cls.get_db().get_collection(pluralize(cls.__name__.lower()))
+        route = _routes.get().get(cls)
+        if route is not None:
+            return cls._get_routed_collection(route)
+
+        if cls.__dict__.get('_collection') is None:
+            collection = cls.get_db().get_collection(cls._default_collection_name())
             cls.set_collection(collection)
         return cls._collection
 
+    @classmethod
+    def _default_collection_name(cls) -> str:
+        return pluralize(cls.__name__.lower())
+
     @classmethod
     def set_collection(cls, collection: Union[str, Collection], **options) -> None:
         if isinstance(collection, Collection):
@@ -338,17 +1243,120 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
             cls._collection = cls.get_db().get_collection(collection, **options)
         else:
             raise ValueError('expect a string or a {!r}, not type {!r}'.format(Collection, type(collection)))
+        cls._routed_collections = {}
 
         if cls.auto_build_index:
             info('You may disable automatic index modification when in production.')
             cls._build_indexes()
 
+    @classmethod
+    def _push_route(cls, db: Database = None, collection: Union[None, str, Collection] = None,
+                    **options) -> Token:
+        """Route the model to another database or collection in the current context;
+        return a token to restore the routes by :meth:`_pop_route`.
+        """
+        routes = _routes.get()
+        route = routes.get(cls)
+        if route is None:
+            route = _Route(db, collection, options)
+        elif collection is None:
+            route = route._replace(db=db)
+        else:
+            route = _Route(db if db is not None else route.db, collection, options)
+        return _routes.set({**routes, cls: route})
+
+    @classmethod
+    def _pop_route(cls, token: Token) -> None:
+        _routes.reset(token)
+
+    @classmethod
+    def _get_routed_collection(cls, route: _Route) -> Collection:
+        """Return the collection of a route; the handles are cached per database, name and options."""
+        if route.collection is not None and not isinstance(route.collection, str):
+            return route.collection
+
+        db = route.db if route.db is not None else cls._db
+        # the handles of other databases inherit the options of the default collection
+        default = cls.__dict__.get('_collection')
+        name = route.collection or (default.name if default is not None else cls._default_collection_name())
+        options = route.options
+        if not options and default is not None:
+            options = {'codec_options': default.codec_options, 'read_preference': default.read_preference,
+                       'write_concern': default.write_concern, 'read_concern': default.read_concern}
+
+        try:
+            key = (db, name, tuple(sorted(route.options.items())))
+            hash(key)
+        except TypeError:
+            return db.get_collection(name, **options)
+
+        collections = cls.__dict__.get('_routed_collections')
+        if collections is None:
+            collections = cls._routed_collections = {}
+
+        collection = collections.get(key)
+        if collection is None:
+            with _route_lock:
+                collection = collections.get(key)
+                if collection is None:
+                    collection = db.get_collection(name, **options)
+                    if cls.auto_build_index:
+                        cls._build_indexes(collection)
+                    collections[key] = collection
+        return collection
+
     @classmethod
     def _get_clean_update(cls, update: MutableMapping, bypass_validation: bool = False) -> MutableMapping:
         # From MongoDB 4.2, argument `update` can be an aggregation pipeline.
         if not isinstance(update, MutableMapping):
             return update
 
+        # the fields are resolved once per update shape, i.e. the operators and their dot notations
+        try:
+            shape = tuple((op, tuple(doc)) for op, doc in update.items())
+        except TypeError:
+            shape = None
+
+        cache = cls._get_plan().updates
+        compiled = cache.get(shape) if shape is not None else None
+        if compiled is None:
+            compiled = cls._compile_update(update)
+            if shape is not None:
+                cache[shape] = compiled
+
+        # undefined fields are warned about on every update, not only when it's compiled
+        steps, warnings = compiled
+        for message in warnings:
+            warn(message)
+
+        for op, notation, field in steps:
+            doc = update[op]
+            value = doc[notation]
+            clean = field.convert if bypass_validation else field.clean
+
+            if op == '$set':
+                doc[notation] = clean(value)
+            elif isinstance(value, MutableMapping) and '$each' in value:
+                value['$each'] = [clean(item) for item in value['$each']]
+            else:
+                doc[notation] = clean(value)
+        return update
+
+    @classmethod
+    def _compile_update(cls, update: MutableMapping) -> Tuple[List[Tuple[str, str, Field]], List[str]]:
+        """Check the dot notations of an update, and return the values need to be cleaned
+        as a list of `(operator, dot notation, field)`, with the warnings of undefined fields.
+        """
+
+        steps = []
+        warnings = []
+
+        def parse_dot_notation(notation: str) -> Field:
+            field, message = cls._lookup_dot_notation(notation)
+            if message is not None:
+                warnings.append(message)
+            return field
+
         # noinspection PyShadowingNames
         def raise_invalid_type_error(field: Field, op: str) -> None:
             raise ValidationError('not expect field type {!r} with {!r}'.format(type(field), op))
@@ -356,39 +1364,23 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
         # noinspection PyShadowingNames
         def check_dot_notation(op: str, doc: MutableMapping, field_type: Optional[Type[Field]] = None) -> None:
             for notation in doc.keys():
-                field = cls._parse_dot_notation(notation)
+                field = parse_dot_notation(notation)
                 if field_type is not None:
                     if not isinstance(field, field_type):
                         raise_invalid_type_error(field, op)
 
         for op, doc in update.items():
             if op == '$set':
-                for notation, value in doc.items():
-                    field = cls._parse_dot_notation(notation)
-                    new_value = field.convert(value)
-                    if not bypass_validation:
-                        field.validate(new_value)
-                    doc[notation] = new_value
+                for notation in doc.keys():
+                    steps.append((op, notation, parse_dot_notation(notation)))
 
             elif op in ('$push', '$addToSet'):
-                for notation, value in doc.items():
-                    field = cls._parse_dot_notation(notation)
+                for notation in doc.keys():
+                    field = parse_dot_notation(notation)
                     if not isinstance(field, ListField):
                         raise_invalid_type_error(field, op)
                     if isinstance(field, ArrayField):
-                        item_field = field.field
-                        if isinstance(value, MutableMapping) and '$each' in value:
-                            values = value['$each']
-                            new_values = [item_field.convert(item) for item in values]
-                            if not bypass_validation:
-                                for new_value in new_values:
-                                    item_field.validate(new_value)
-                            value['$each'] = new_values
-                        else:
-                            new_value = item_field.convert(value)
-                            if not bypass_validation:
-                                item_field.validate(new_value)
-                            doc[notation] = new_value
+                        steps.append((op, notation, field.field))
 
             # check dot notation and give warnings when necessary
             elif op in ('$pop', '$pull', '$pullAll'):
@@ -399,7 +1391,7 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
                 check_dot_notation(op, doc, DateTimeField)
             elif op in ('$min', '$max', '$rename', '$unset'):
                 check_dot_notation(op, doc)
-        return update
+        return steps, warnings
 
     @staticmethod
     def _is_array_placeholder(name: str):
@@ -407,23 +1399,39 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
 
     @classmethod
     def _parse_dot_notation(cls, name: str) -> Field:
+        field, message = cls._lookup_dot_notation(name)
+        if message is not None:
+            warn(message)
+        return field
+
+    @classmethod
+    def _lookup_dot_notation(cls, name: str) -> Tuple[Field, Optional[str]]:
+        """Return the field of a dot notation, and the warning of an undefined field in it, if any."""
+        plan = cls._get_plan()
+        rv = plan.dot_notations.get(name)
+        if rv is None:
+            rv = plan.dot_notations[name] = cls._resolve_dot_notation(name)
+        return rv
+
+    @classmethod
+    def _resolve_dot_notation(cls, name: str) -> Tuple[Field, Optional[str]]:
         def raise_parse_error(k: str, fld: Field):
             raise ValueError('cannot parse {!r}; not expect {!r} after {!r}'.format(name, k, fld))
 
-        field = EmbeddedField().init_root(cls)
+        field = cls._get_plan().root
         for key in name.split('.'):
             if isinstance(field, AnyField):
-                return AnyField()
+                return AnyField(), None
 
             if type(field) == DictField:
                 if key.isidentifier():
-                    return AnyField()
+                    return AnyField(), None
                 else:
                     raise_parse_error(key, field)
 
             if type(field) == ListField:
                 if key.isdigit() or cls._is_array_placeholder(key):
-                    return AnyField()
+                    return AnyField(), None
                 else:
                     raise_parse_error(key, field)
 
@@ -433,8 +1441,8 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
                     if key in fields:
                         field = fields[key]
                     else:
-                        warn('{!r} not defined in model {!r}. Did you misspell it?'.format(key, field.model))
-                        return AnyField()
+                        message = '{!r} not defined in model {!r}. Did you misspell it?'.format(key, field.model)
+                        return AnyField(), message
                 else:
                     raise_parse_error(key, field)
             elif key.isdigit() or cls._is_array_placeholder(key):
@@ -444,30 +1452,44 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
                     raise_parse_error(key, field)
             else:
                 raise ValueError('cannot parse {!r}; not a valid identifier {!r}'.format(name, key))
-        return field
+        return field, None
 
     @classmethod
-    def _build_indexes(cls) -> None:
-        collection = cls.get_collection()
-        indexes = normalize_indexes(getattr(cls.__dict__.get('Meta'), 'indexes', []))
+    def _build_indexes(cls, collection: Collection = None) -> None:
+        index_manager.sync_model(cls, collection if collection is not None else cls.get_collection())
+
+    @classmethod
+    def _declared_indexes(cls) -> List[Dict]:
+        # `normalize_indexes` modifies the index options in place
+        return normalize_indexes(deepcopy(getattr(cls.__dict__.get('Meta'), 'indexes', [])))
+
+    @classmethod
+    def _index_changes(cls, old_indexes: Iterable[dict], collection_name: str) -> List[Tuple[str, tuple, dict]]:
+        """Compare the indexes defined in `Meta` with the existing ones,
+        and return the changes as `(method, args, kwargs)`; `method` is 'create_index', 'drop_index'
+        of the collection, or 'command' of the database.
+        """
+
+        indexes = cls._declared_indexes()
 
-        old = {default_index_name(index['key']): index for index in collection.list_indexes()}
+        old = {default_index_name(index['key']): index for index in old_indexes}
         new = {default_index_name(index['key']): index for index in indexes}
 
         existing = [(new[name], old[name]) for name in set(new) & set(old)]
         missing = [new[name] for name in set(new) - set(old)]
         extra = [old[name] for name in set(old) - set(new)]
+        changes = []
 
         # create new indexes
         for index in missing:
             key = index.pop('key')
-            collection.create_index(key, **index)
+            changes.append(('create_index', (key,), index))
 
         # drop old indexes
         for index in extra:
             name = index['name']
             if name != '_id_':
-                collection.drop_index(name)
+                changes.append(('drop_index', (name,), {}))
 
         # modify existing indexes
         # 1. drop and recreate the index, or
@@ -489,13 +1511,14 @@ class MongoModel(BaseModel, metaclass=MongoModelType):
                 continue
             elif same_index_option and not_none([new_ttl, old_ttl]):
                 # use collMod to modify the index
-                cls.get_db().command({
-                    'collMod': collection.name,
+                changes.append(('command', ({
+                    'collMod': collection_name,
                     'index': {'name': new_index['name'], 'expireAfterSeconds': new_ttl}
-                })
+                },), {}))
             else:
                 # drop and recreate the index
                 if new_ttl is not None:
                     new_index['expireAfterSeconds'] = new_ttl
-                collection.drop_index(old_index['name'])
-                collection.create_index(key, **new_index)
+                changes.append(('drop_index', (old_index['name'],), {}))
+                changes.append(('create_index', (key,), new_index))
+        return changes
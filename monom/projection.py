@@ -0,0 +1,186 @@
+"""
+Track the fields loaded by projections, and profile the fields read at each call site
+to derive minimal projections.
+"""
+
+import os
+import sys
+from collections import abc
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Iterable, Optional, Tuple, Union
+
+from .utils import warn
+
+__all__ = [
+    'ProjectionProfiler',
+    'include_field',
+    'loaded_names',
+]
+
+_package_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def loaded_names(projection: Union[None, abc.Mapping, Iterable[str]],
+                 names: Iterable[str]) -> Optional[FrozenSet[str]]:
+    """Return the top-level names of fields loaded by a projection, or `None` if all are loaded.
+
+    >>> sorted(loaded_names(['a', 'b.c'], ['a', 'b', 'd']))
+    ['_id', 'a', 'b']
+    >>> sorted(loaded_names({'a': False}, ['a', 'b']))
+    ['_id', 'b']
+    >>> loaded_names({'a': {'$slice': 1}}, ['a', 'b']) is None
+    True
+    """
+
+    if projection is None:
+        return None
+    if not isinstance(projection, abc.Mapping):
+        projection = {key: True for key in projection}
+
+    included, excluded = set(), set()
+    for key, value in projection.items():
+        # operators like `$slice` and `$elemMatch` don't decide whether other fields are loaded
+        if isinstance(value, abc.Mapping):
+            continue
+        (included if value else excluded).add(key.split('.', 1)[0])
+
+    # `_id` is loaded unless excluded explicitly
+    if included - {'_id'}:
+        return frozenset((included | {'_id'}) - excluded)
+    if excluded:
+        return frozenset((set(names) | {'_id'}) - excluded)
+    return None
+
+
+def include_field(projection: Union[None, abc.Mapping, Iterable[str]], name: str) -> Any:
+    """Return a projection which loads the top-level field `name` as well as the fields loaded by `projection`.
+
+    >>> include_field(['a'], 'v')
+    {'a': True, 'v': True}
+    >>> include_field({'a': False, 'v': False}, 'v')
+    {'a': False}
+    >>> include_field(None, 'v') is None
+    True
+    """
+
+    if projection is None:
+        return None
+    if not isinstance(projection, abc.Mapping):
+        projection = {key: True for key in projection}
+
+    # the paths of the field, which would collide with the field itself
+    rv = {key: value for key, value in projection.items() if key.split('.', 1)[0] != name}
+    # an inclusion projection loads only the fields included; an exclusion one loads all but those excluded
+    if any(value and not isinstance(value, abc.Mapping) for key, value in rv.items() if key != '_id'):
+        rv[name] = True
+    return rv
+
+
+def _call_site() -> Tuple[str, int]:
+    """Return the file name and line number of the first frame outside of this package."""
+    frame = sys._getframe(1)
+    while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == _package_dir:
+        frame = frame.f_back
+    if frame is None:  # pragma: no cover
+        return '<unknown>', 0
+    return frame.f_code.co_filename, frame.f_lineno
+
+
+class CallSite:
+    """Fields read from the documents queried at one call site."""
+
+    def __init__(self, profiler: 'ProjectionProfiler', model, filename: str, lineno: int):
+        self.profiler = profiler
+        self.model = model
+        self.filename = filename
+        self.lineno = lineno
+        self.documents = 0
+        self.fields = set()
+        # whether whole documents are read (by `to_dict`, etc.)
+        self.read_all = False
+        self.finished = False
+        self.projection: Optional[Dict[str, bool]] = None
+        self.applied = False
+
+    def observe(self, obj) -> None:
+        if not self.finished:
+            self.documents += 1
+        obj._profile = self
+
+    def read(self, name: str) -> None:
+        if not self.finished:
+            self.fields.add(name)
+
+    def read_document(self) -> None:
+        if not self.finished:
+            self.read_all = True
+
+    def widen(self, name: str) -> None:
+        """Add a field read outside of the applied projection."""
+        if self.projection is not None:
+            projection = dict(self.projection)
+            projection[name] = True
+            self.projection = projection
+
+    def finish(self) -> None:
+        self.finished = True
+        if self.read_all:
+            warn('{} reads whole documents of {!r}; no projection can be derived.'.format(self, self.model))
+            return
+
+        projection = {name: True for name in sorted(self.fields)}
+        projection.setdefault('_id', True)
+        # noinspection PyProtectedMember
+        version = self.model._get_plan().version
+        if version is not None:
+            # the writes of versioned models match the version loaded
+            projection.setdefault(version, True)
+        self.projection = projection
+        self.applied = self.profiler.apply
+        warn('{} reads only {!r} of {!r} in {} documents; {} the projection {!r}.'.format(
+            self, sorted(self.fields), self.model, self.documents,
+            'applying' if self.applied else 'consider using', projection
+        ))
+
+    def __str__(self):
+        return '{}:{}'.format(self.filename, self.lineno)
+
+    __repr__ = __str__
+
+
+class ProjectionProfiler:
+    """Record the fields read from the documents of each call site of `find` and `find_one`.
+
+    After `window` documents of a call site are queried without a projection, a minimal projection
+    of the fields read from them is logged; it's applied to the later queries of the call site if `apply` is true.
+    A field outside of the applied projection is fetched when it's read, and added to the projection.
+    """
+
+    def __init__(self, window: int = 100, apply: bool = False):
+        self.window = window
+        self.apply = apply
+        self._sites: Dict[Tuple[Any, str, int], CallSite] = {}
+        self._lock = Lock()
+
+    def site(self, model) -> CallSite:
+        """Return the call site of a query on the model."""
+        filename, lineno = _call_site()
+        key = (model, filename, lineno)
+        site = self._sites.get(key)
+        if site is None:
+            with self._lock:
+                site = self._sites.setdefault(key, CallSite(self, model, filename, lineno))
+
+        if not site.finished and site.documents >= self.window:
+            with self._lock:
+                if not site.finished:
+                    site.finish()
+        return site
+
+    def suggestions(self) -> Dict[str, Dict[str, bool]]:
+        """Return the derived projections keyed by their call sites."""
+        return {str(site): dict(site.projection) for site in self._sites.values() if site.projection is not None}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._sites.clear()
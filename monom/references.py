@@ -0,0 +1,100 @@
+"""
+Dereference the references of many models at once, by one query per referenced model and level of path.
+"""
+
+from collections import abc
+from typing import Any, Iterable, List, Tuple
+
+from .fields import ArrayField, EmbeddedField, Field, ReferenceField
+
+__all__ = [
+    'prefetch',
+]
+
+
+def _flatten(value: Any) -> List[Any]:
+    if isinstance(value, abc.MutableSequence):
+        return [item for element in value for item in _flatten(element)]
+    return [] if value is None else [value]
+
+
+def _map(value: Any, fn) -> Any:
+    if isinstance(value, (abc.MutableSequence, tuple)):
+        return [_map(element, fn) for element in value]
+    return fn(value)
+
+
+def _reference_of(field: Field):
+    if isinstance(field, ArrayField):
+        field = field.innermost()
+    return field if isinstance(field, ReferenceField) else None
+
+
+def _resolve(pending: List[Tuple[Any, Field, ReferenceField, Any]]) -> List[Any]:
+    """Dereference the values of the pending fields, and return the models found."""
+    pks_by_model = {}
+    for _, _, reference, value in pending:
+        pks = pks_by_model.setdefault(reference.model, {})
+        for pk in _flatten(value):
+            try:
+                pks[pk] = None
+            except TypeError:
+                # unhashable primary keys are dereferenced on access
+                pass
+
+    found = {}
+    for model, pks in pks_by_model.items():
+        if pks:
+            found[model] = {obj.pk: obj for obj in model.find({'_id': {'$in': list(pks)}})}
+
+    resolved = []
+    for instance, field, reference, value in pending:
+        models = found.get(reference.model, {})
+
+        def lookup(pk):
+            try:
+                return models.get(pk)
+            except TypeError:
+                return reference.dereference(pk)
+
+        rv = _map(value, lookup)
+        instance._wrappers[field.name] = rv
+        resolved.extend(_flatten(rv))
+    return resolved
+
+
+def prefetch(objs: Iterable[Any], *paths: str) -> None:
+    """Dereference the references of the models along dot paths of attributes, e.g. `'author'` or
+    `'comments.user'`, where the parents are embedded documents, arrays of them, or references.
+    The documents referenced by a level of the paths are fetched by one `$in` query per referenced model.
+    """
+
+    objs = list(objs)
+    for path in paths:
+        instances = objs
+        names = path.split('.')
+        for index, name in enumerate(names):
+            pending = []
+            children = []
+            for instance in instances:
+                field = getattr(type(instance), name, None)
+                if not isinstance(field, Field):
+                    raise ValueError('{!r} of path {!r} is not a field of {!r}.'.format(name, path, type(instance)))
+
+                reference = _reference_of(field)
+                if reference is not None:
+                    wrappers = instance._wrappers
+                    if wrappers and field.name in wrappers:
+                        children.extend(_flatten(wrappers[field.name]))
+                    elif field.name in instance._data:
+                        pending.append((instance, field, reference, instance._data[field.name]))
+                elif index < len(names) - 1 and isinstance(field, (EmbeddedField, ArrayField)):
+                    children.extend(_flatten(getattr(instance, name, None)))
+                else:
+                    raise ValueError('{!r} of path {!r} is neither a reference nor an embedded document.'
+                                     .format(name, path))
+
+            children.extend(_resolve(pending))
+            instances = children
+            if not instances:
+                break
@@ -0,0 +1,202 @@
+"""
+Serialize documents to JSON like :func:`bson.json_util.dumps` with its default options,
+by encoders compiled from the declared fields of models.
+
+The values of declared fields are converted by the encoders of their types, instead of being tested against
+every BSON type; only the values of undeclared fields, or of unexpected types, are converted by `bson.json_util`.
+`dumps` formats the JSON text like `bson.json_util.dumps`, by `json`; the compact text of `dumps(..., compact=True)`,
+`dumps_bytes` and `iter_ndjson` is encoded by `orjson` if it's installed, or by `json` with compact separators.
+"""
+
+import json
+from collections import abc
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Mapping
+
+from bson import json_util
+from bson.json_util import DatetimeRepresentation
+from bson.objectid import ObjectId
+
+from .fields import *
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+__all__ = [
+    'compile_encoder',
+    'dumps',
+    'dumps_bytes',
+    'iter_ndjson',
+]
+
+# values of these types are JSON values as they are
+_native = frozenset((str, int, bool, type(None)))
+
+_json_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+# the options of `json.dumps`, with which `bson.json_util.dumps` formats the text
+_json_util_encoder = json.JSONEncoder()
+
+
+def _convert(value: Any) -> Any:
+    """Convert a value of any type, like `bson.json_util` does."""
+    if type(value) in _native:
+        return value
+    if hasattr(value, 'items'):
+        return {key: _convert(item) for key, item in value.items()}
+    if hasattr(value, '__iter__') and not isinstance(value, (str, bytes)):
+        return [_convert(item) for item in value]
+    try:
+        return json_util.default(value, json_util.DEFAULT_JSON_OPTIONS)
+    except TypeError:
+        return value
+
+
+def _exact(types: tuple) -> Callable[[Any], Any]:
+    types = frozenset(types) | {type(None)}
+
+    def encode(value):
+        return value if type(value) in types else _convert(value)
+
+    return encode
+
+
+def _number(value: Any) -> Any:
+    # `NaN` and infinities are not JSON numbers
+    if type(value) is int or (type(value) is float and value - value == 0):
+        return value
+    return _convert(value)
+
+
+def _object_id(value: Any) -> Any:
+    if type(value) is ObjectId:
+        return {'$oid': str(value)}
+    return _convert(value)
+
+
+def _bson(expected: type) -> Callable[[Any], Any]:
+    default = json_util.default
+    options = json_util.DEFAULT_JSON_OPTIONS
+
+    def encode(value):
+        if type(value) is expected:
+            return default(value, options)
+        return _convert(value)
+
+    return encode
+
+
+def _datetime() -> Callable[[Any], Any]:
+    if json_util.DEFAULT_JSON_OPTIONS.datetime_representation != DatetimeRepresentation.ISO8601:
+        return _bson(datetime)
+
+    def encode(value):
+        # naive datetimes are in UTC, and those before the epoch are encoded as numbers
+        if type(value) is datetime and value.tzinfo is None and value.year >= 1970:
+            if value.microsecond >= 1000:
+                return {'$date': value.isoformat(timespec='milliseconds') + 'Z'}
+            return {'$date': value.isoformat(timespec='seconds') + 'Z'}
+        return _convert(value)
+
+    return encode
+
+
+def _embedded(model) -> Callable[[Any], Any]:
+    def encode(value):
+        if isinstance(value, abc.Mapping):
+            # looked up on each call, since models may embed themselves
+            # noinspection PyProtectedMember
+            return model._get_plan().json_encoder(value)
+        return _convert(value)
+
+    return encode
+
+
+def _array(field: Field) -> Callable[[Any], Any]:
+    encode_item = _field_encoder(field)
+
+    def encode(value):
+        if isinstance(value, list):
+            return [encode_item(item) for item in value]
+        return _convert(value)
+
+    return encode
+
+
+def _field_encoder(field: Field) -> Callable[[Any], Any]:
+    if isinstance(field, EmbeddedField):
+        return _embedded(field.model)
+    if isinstance(field, ArrayField):
+        return _array(field.field)
+    if isinstance(field, (StringField, IntField, BooleanField)):
+        return _exact(field.expected_types)
+    if isinstance(field, NumberField):
+        return _number
+    if isinstance(field, ObjectIdField):
+        return _object_id
+    if isinstance(field, DateTimeField):
+        return _datetime()
+    if isinstance(field, BytesField):
+        return _bson(bytes)
+    return _convert
+
+
+def compile_encoder(fields: Mapping[str, Field]) -> Callable[[Mapping], Dict[str, Any]]:
+    """Return a function converting documents with the fields (keyed by their names in documents)
+    to JSON values, e.g. `{'$oid': ...}` for an `ObjectId`.
+
+    >>> encode = compile_encoder({'_id': ObjectIdField(), 'n': FloatField()})
+    >>> encode({'_id': ObjectId('5f0000000000000000000000'), 'n': float('nan')})
+    {'_id': {'$oid': '5f0000000000000000000000'}, 'n': {'$numberDouble': 'NaN'}}
+    """
+    encoders = {name: _field_encoder(field) for name, field in fields.items()}
+    get = encoders.get
+
+    def encode(doc):
+        return {key: get(key, _convert)(value) for key, value in doc.items()}
+
+    return encode
+
+
+def dumps(value: Any, compact: bool = False) -> str:
+    """Return the JSON text of a JSON value, formatted like `bson.json_util.dumps`, or the compact text if `compact`.
+
+    >>> dumps({'a': [1, 2], 's': 'é'})
+    '{"a": [1, 2], "s": "\\\\u00e9"}'
+    >>> dumps({'a': [1, 2], 's': 'é'}, compact=True)
+    '{"a":[1,2],"s":"é"}'
+    """
+    if not compact:
+        return _json_util_encoder.encode(value)
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return _json_encoder.encode(value)
+
+
+def dumps_bytes(value: Any) -> bytes:
+    """Return the compact JSON text of a JSON value, encoded in UTF-8."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return _json_encoder.encode(value).encode()
+
+
+def _lines(values) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_APPEND_NEWLINE
+        return b''.join([orjson.dumps(value, option=option) for value in values])
+    return ''.join([_json_encoder.encode(value) + '\n' for value in values]).encode()
+
+
+def iter_ndjson(cursor) -> Iterator[bytes]:
+    """Yield the documents of each batch of a :class:`~monom.mongo.Cursor` as newline-delimited JSON,
+    encoded in UTF-8, without constructing models.
+    """
+    # noinspection PyProtectedMember
+    encode = cursor.model_cls._get_plan().json_encoder
+    while True:
+        # noinspection PyProtectedMember
+        docs = cursor._next_batch()
+        if not docs:
+            return
+        yield _lines(map(encode, docs))
@@ -0,0 +1,168 @@
+"""
+A unit of work: the models loaded in a session are kept in an identity map, and saved together on commit.
+"""
+
+from contextvars import ContextVar, Token
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from .batch import SaveError
+
+__all__ = [
+    'Session',
+    'current_session',
+]
+
+_current: ContextVar[Optional['Session']] = ContextVar('monom_session', default=None)
+
+
+def current_session() -> Optional['Session']:
+    """Return the session active in the current thread or asyncio task."""
+    return _current.get()
+
+
+class Session:
+    """Keep the models loaded by `find`, `find_one` and `get` in an identity map by their collections and `_id`s,
+    so a document loaded twice is the same model; and save the changed models by bulk writes on commit.
+
+    A session is activated by `with` (or `async with` for async models) in the current thread or asyncio task;
+    it's committed when the block exits without an exception.
+
+        with Session():
+            user = User.find_one({'name': 'foo'})
+            assert User.get(user.pk) is user
+            user.age += 1
+            Post.find_one({'user_id': user.pk}).mark_for_deletion()
+        # one bulk write per collection
+
+    The models loaded again keep their own data, including unsaved changes.
+    Options (`full_update`, `ordered`, `session` of pymongo, etc.) are passed to `save_multiple`.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self._identity: Dict[Tuple[str, Hashable], Any] = {}
+        # models without hashable `_id`s, or not saved yet
+        self._pending: List[Any] = []
+        self._tokens: List[Token] = []
+
+    @staticmethod
+    def _key(obj) -> Optional[Tuple[str, Hashable]]:
+        pk = obj.pk
+        if pk is None:
+            return None
+        try:
+            hash(pk)
+        except TypeError:
+            return None
+        return type(obj).get_collection().full_name, pk
+
+    def merge(self, obj):
+        """Return the model of the same document in the identity map, or add the model to it."""
+        key = self._key(obj)
+        if key is None:
+            if not any(pending is obj for pending in self._pending):
+                self._pending.append(obj)
+            return obj
+        return self._identity.setdefault(key, obj)
+
+    def add(self, obj) -> None:
+        """Add a model to be saved on commit."""
+        existing = self.merge(obj)
+        if existing is not obj:
+            raise ValueError('Another model of the document {!r} is in the session already.'.format(obj.pk))
+
+    def add_all(self, objs: Iterable[Any]) -> None:
+        for obj in objs:
+            self.add(obj)
+
+    def delete(self, obj) -> None:
+        """Mark a model to be deleted on commit."""
+        self.add(obj)
+        obj.mark_for_deletion()
+
+    def lookup(self, model, pk: Any) -> Optional[Any]:
+        """Return the model of the `pk` in the identity map."""
+        try:
+            return self._identity.get((model.get_collection().full_name, pk))
+        except TypeError:
+            return None
+
+    def __contains__(self, obj) -> bool:
+        key = self._key(obj)
+        if key is None:
+            return any(pending is obj for pending in self._pending)
+        return self._identity.get(key) is obj
+
+    def __len__(self) -> int:
+        return len(self._identity) + len(self._pending)
+
+    @property
+    def dirty(self) -> List[Any]:
+        """The models to be written on commit."""
+        full_update = self.options.get('full_update', False)
+        return [obj for obj in (*self._identity.values(), *self._pending) if obj._is_dirty(full_update)]
+
+    def commit(self):
+        """Save the dirty models by `save_multiple`, and return its :class:`~monom.batch.SaveResult`.
+
+        :class:`~monom.batch.SaveError` is raised if any write failed, or :class:`~monom.mongo.ConflictError`
+        if a versioned document was changed by another writer; the models not saved are kept in the session,
+        so the commit can be retried.
+        """
+        from .mongo import MongoModel
+        return self._finish(MongoModel.save_multiple(self.dirty, **self._save_options()))
+
+    async def commit_async(self):
+        """Save the dirty async models by `save_multiple`, and return its :class:`~monom.batch.SaveResult`;
+        see :meth:`commit`.
+        """
+        from .aio import AsyncMongoModel
+        return self._finish(await AsyncMongoModel.save_multiple(self.dirty, **self._save_options()))
+
+    def _save_options(self) -> Dict[str, Any]:
+        # the errors and the conflicts are raised by `_finish`
+        return dict(self.options, raise_on_error=False)
+
+    def _finish(self, result):
+        from .mongo import ConflictError
+
+        if result.errors:
+            raise SaveError(result)
+        if result.conflicts:
+            raise ConflictError(result.conflicts[0].obj)
+
+        # models inserted have got their `_id`s, and deleted models are forgotten
+        pending, self._pending = self._pending, []
+        for obj in pending:
+            if obj._state != 'deleted':
+                self.merge(obj)
+        for key, obj in list(self._identity.items()):
+            if obj._state == 'deleted':
+                del self._identity[key]
+        return result
+
+    def clear(self) -> None:
+        """Forget all the models."""
+        self._identity.clear()
+        self._pending.clear()
+
+    def __enter__(self) -> 'Session':
+        self._tokens.append(_current.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        _current.reset(self._tokens.pop())
+        if exc_type is None:
+            self.commit()
+        else:
+            self.clear()
+
+    async def __aenter__(self) -> 'Session':
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        _current.reset(self._tokens.pop())
+        if exc_type is None:
+            await self.commit_async()
+        else:
+            self.clear()
@@ -0,0 +1,100 @@
+"""
+Snapshots of documents as loaded or saved, which are compared with the documents when they are saved again,
+for models with `snapshot_changes` set.
+
+Unlike tracking assignments of attributes and mutations of containers, the comparison catches any change in place,
+e.g. of a dict nested in a list, at the cost of copying the documents loaded. The snapshot of a lazily decoded
+document is its raw BSON, which is decoded only when the model is saved.
+"""
+
+from collections import abc
+from typing import Any, Dict, Mapping, Optional
+
+import bson
+from bson.codec_options import CodecOptions
+
+from .lazy import LazyDocument
+from .tracking import _valid_key
+
+__all__ = [
+    'diff',
+    'take_snapshot',
+]
+
+
+def _copy(value: Any) -> Any:
+    # values other than containers are immutable, or replaced rather than mutated
+    if isinstance(value, abc.Mapping):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def take_snapshot(doc: Mapping) -> Any:
+    """Return a snapshot of a document, which isn't affected by later changes of the document.
+
+    >>> doc = {'a': [{'b': 1}]}
+    >>> snapshot = take_snapshot(doc)
+    >>> doc['a'][0]['b'] = 2
+    >>> snapshot
+    {'a': [{'b': 1}]}
+    """
+    if isinstance(doc, LazyDocument):
+        return doc.raw
+    return _copy(doc)
+
+
+def _set(update: Dict[str, Dict[str, Any]], path: str, value: Any) -> None:
+    update.setdefault('$set', {})[path] = value
+
+
+def _diff_mapping(old: Mapping, new: Mapping, prefix: str, update: Dict[str, Dict[str, Any]]) -> None:
+    for key, value in new.items():
+        path = prefix + key
+        if key in old:
+            _diff_value(old[key], value, path, update)
+        else:
+            _set(update, path, value)
+    for key in old:
+        if key not in new:
+            update.setdefault('$unset', {})[prefix + key] = ''
+
+
+def _diff_value(old: Any, new: Any, path: str, update: Dict[str, Dict[str, Any]]) -> None:
+    if isinstance(old, abc.Mapping) and isinstance(new, abc.Mapping):
+        if old == new:
+            return
+        # keys which cannot be used in dot notations make the whole dict to be set
+        if all(_valid_key(key) for key in old) and all(_valid_key(key) for key in new):
+            _diff_mapping(old, new, path + '.', update)
+        else:
+            _set(update, path, new)
+    elif isinstance(old, list) and isinstance(new, list):
+        length = len(old)
+        if len(new) == length:
+            for index in range(length):
+                _diff_value(old[index], new[index], '{}.{}'.format(path, index), update)
+        elif len(new) > length and new[:length] == old:
+            update.setdefault('$push', {})[path] = {'$each': new[length:]}
+        else:
+            _set(update, path, new)
+    # `1 == 1.0 == True`, but they are stored as different types
+    elif type(old) is not type(new) or old != new:
+        _set(update, path, new)
+
+
+def diff(snapshot: Any, doc: Mapping, codec_options: Optional[CodecOptions] = None) -> Dict[str, Dict[str, Any]]:
+    """Return the update operators changing the document of a snapshot into the document;
+    the raw BSON of a snapshot is decoded with the codec options.
+
+    >>> diff({'a': 1, 'b': {'c': 1}, 'd': [1], 'e': 0}, {'a': 1, 'b': {'c': 2}, 'd': [1, 2], 'f': 0})
+    {'$set': {'b.c': 2, 'f': 0}, '$push': {'d': {'$each': [2]}}, '$unset': {'e': ''}}
+    >>> diff({'a': [1, 2]}, {'a': [2]}), diff({'a': 1}, {'a': True})
+    ({'$set': {'a': [2]}}, {'$set': {'a': True}})
+    """
+    if isinstance(snapshot, bytes):
+        snapshot = bson.decode(snapshot, codec_options or bson.DEFAULT_CODEC_OPTIONS)
+    update = {}
+    _diff_mapping(snapshot, doc, '', update)
+    return update
@@ -0,0 +1,459 @@
+"""
+Lists and dicts recording their mutations, so they are saved by minimal update operators
+instead of rewriting the whole field.
+
+A container returned by a `list`, `dict` or array field is replaced with a tracked one in the data of the model.
+Changes are saved as:
+
+* appends: `{'$push': {'tags': {'$each': [...]}}}`
+* assignments of items, and changes of nested containers: `{'$set': {'tags.3': ..., 'meta.a.b': ...}}`
+* removals of items occurring once, by `remove`: `{'$pull': {'tags': {'$in': [...]}}}`
+* deletions of keys: `{'$unset': {'meta.a': ''}}`
+
+Other mutations (`insert`, `pop`, `sort`, etc.), or a mix of the above on the same list, set the whole container.
+"""
+
+from collections import abc
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+__all__ = [
+    'Tracker',
+    'TrackedDict',
+    'TrackedList',
+    'TrackedModelList',
+    'track',
+]
+
+
+def _join(prefix: str, key: Any) -> str:
+    return '{}.{}'.format(prefix, key)
+
+
+def _valid_key(key: Any) -> bool:
+    # keys which cannot be used in dot notations make the whole dict to be set
+    return isinstance(key, str) and key != '' and '.' not in key and not key.startswith('$')
+
+
+class Tracker:
+    """The base of tracked containers; a change marks the container and its ancestors dirty."""
+
+    __slots__ = ()
+
+    _parent: Optional['Tracker']
+    _key: Hashable
+    _dirty: bool
+    # keys of the children with changes
+    _changed: set
+
+    def _init_tracker(self, parent: Optional['Tracker'], key: Hashable) -> None:
+        self._parent = parent
+        self._key = key
+        self._dirty = False
+        self._changed = set()
+
+    def _adopt(self, value: Any, key: Hashable) -> Any:
+        """Return a tracked container of a plain `list` or `dict` as a child, or the value as it is."""
+        if isinstance(value, Tracker):
+            if value._parent is None or value._parent is self:
+                value._parent, value._key = self, key
+                return value
+            # a container can't have two parents
+            value = list(value) if isinstance(value, list) else dict(value)
+        if isinstance(value, list):
+            return TrackedList(value, self, key)
+        if isinstance(value, dict):
+            return TrackedDict(value, self, key)
+        return value
+
+    def _touch(self) -> None:
+        node = self
+        node._dirty = True
+        while node._parent is not None:
+            parent = node._parent
+            if node._key in parent._changed and parent._dirty:
+                return
+            parent._changed.add(node._key)
+            parent._dirty = True
+            node = parent
+
+    def _tracks(self, value: Any) -> bool:
+        """Whether this container tracks the value stored in the data of a model."""
+        return value is self
+
+    def _collect(self, path: str, update: Dict[str, Dict[str, Any]]) -> None:
+        """Add the update operators of the changes at the path."""
+        raise NotImplementedError
+
+    def _reset(self) -> None:
+        """Forget the changes, which have been saved."""
+        raise NotImplementedError
+
+
+class TrackedList(Tracker, list):
+    """A list recording appends, assignments of items and removals."""
+
+    __slots__ = ('_parent', '_key', '_dirty', '_changed', '_base', '_kinds', '_indexes', '_pulled')
+
+    def __init__(self, values: Iterable = (), parent: Tracker = None, key: Hashable = None):
+        self._init_tracker(parent, key)
+        list.__init__(self, (self._adopt(value, index) for index, value in enumerate(values)))
+        # the length when loaded or saved; items after it are appended
+        self._base = len(self)
+        # kinds of the changes: 'push', 'set', 'pull' or 'replace'
+        self._kinds = set()
+        self._indexes = set()
+        self._pulled = []
+
+    def _record(self, kind: str) -> None:
+        self._kinds.add(kind)
+        self._touch()
+
+    def append(self, value: Any) -> None:
+        list.append(self, self._adopt(value, len(self)))
+        self._record('push')
+
+    def extend(self, values: Iterable) -> None:
+        start = len(self)
+        list.extend(self, [self._adopt(value, start + index) for index, value in enumerate(values)])
+        self._record('push')
+
+    def __iadd__(self, values: Iterable) -> 'TrackedList':
+        self.extend(values)
+        return self
+
+    def __setitem__(self, index, value) -> None:
+        if isinstance(index, slice):
+            list.__setitem__(self, index, [self._adopt(item, None) for item in value])
+            self._record('replace')
+            return
+        if index < 0:
+            index += len(self)
+        list.__setitem__(self, index, self._adopt(value, index))
+        if index < self._base:
+            self._indexes.add(index)
+            self._record('set')
+        # an appended item is pushed with its current value
+
+    def remove(self, value: Any) -> None:
+        index = self.index(value)
+        unique = self.count(value) == 1
+        list.remove(self, value)
+        if unique and index < self._base:
+            self._base -= 1
+            self._pulled.append(value)
+            self._record('pull')
+        else:
+            self._record('replace')
+
+    def _replace(name):
+        method = getattr(list, name)
+
+        def replace(self, *args, **kw):
+            rv = method(self, *args, **kw)
+            self._record('replace')
+            return rv
+
+        replace.__name__ = name
+        return replace
+
+    insert = _replace('insert')
+    pop = _replace('pop')
+    clear = _replace('clear')
+    sort = _replace('sort')
+    reverse = _replace('reverse')
+    __delitem__ = _replace('__delitem__')
+    __imul__ = _replace('__imul__')
+    del _replace
+
+    def _collect(self, path: str, update: Dict[str, Dict[str, Any]]) -> None:
+        base = self._base
+        kinds = set(self._kinds)
+        children = [index for index in self._changed if index < base and index not in self._indexes]
+        if children:
+            kinds.add('set')
+
+        if 'replace' in kinds or len(kinds) > 1:
+            update.setdefault('$set', {})[path] = self
+        elif kinds == {'push'}:
+            update.setdefault('$push', {})[path] = {'$each': self[base:]}
+        elif kinds == {'pull'}:
+            update.setdefault('$pull', {})[path] = {'$in': list(self._pulled)}
+        elif kinds == {'set'}:
+            sets = update.setdefault('$set', {})
+            for index in self._indexes:
+                sets[_join(path, index)] = list.__getitem__(self, index)
+            for index in children:
+                child = list.__getitem__(self, index)
+                if isinstance(child, Tracker):
+                    child._collect(_join(path, index), update)
+
+    def _reset(self) -> None:
+        if self._kinds - {'set', 'push'}:
+            # items have moved, so the children are told their new indexes
+            for index, item in enumerate(self):
+                if isinstance(item, Tracker):
+                    if item._dirty:
+                        item._reset()
+                    item._parent, item._key = self, index
+        else:
+            for index in self._changed:
+                child = list.__getitem__(self, index) if index < len(self) else None
+                if isinstance(child, Tracker) and child._dirty:
+                    child._reset()
+        self._base = len(self)
+        self._kinds.clear()
+        self._indexes.clear()
+        self._pulled.clear()
+        self._changed.clear()
+        self._dirty = False
+
+    def __reduce_ex__(self, protocol):
+        # copies and pickles are plain lists
+        return list, (list(self),)
+
+
+class TrackedDict(Tracker, dict):
+    """A dict recording the keys set and deleted."""
+
+    __slots__ = ('_parent', '_key', '_dirty', '_changed', '_set', '_unset', '_replaced')
+
+    def __init__(self, values: abc.Mapping = (), parent: Tracker = None, key: Hashable = None):
+        self._init_tracker(parent, key)
+        dict.__init__(self, ((name, self._adopt(value, name)) for name, value in dict(values).items()))
+        self._set = set()
+        self._unset = set()
+        self._replaced = False
+
+    def _detach(self, key: Any) -> None:
+        value = dict.get(self, key)
+        if isinstance(value, Tracker) and value._parent is self:
+            value._parent = None
+
+    def __setitem__(self, key, value) -> None:
+        self._detach(key)
+        dict.__setitem__(self, key, self._adopt(value, key))
+        if _valid_key(key):
+            self._set.add(key)
+            self._unset.discard(key)
+        else:
+            self._replaced = True
+        self._touch()
+
+    def __delitem__(self, key) -> None:
+        self._detach(key)
+        dict.__delitem__(self, key)
+        if _valid_key(key):
+            self._unset.add(key)
+            self._set.discard(key)
+        else:
+            self._replaced = True
+        self._touch()
+
+    def pop(self, key, *default) -> Any:
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = dict.__getitem__(self, key)
+        del self[key]
+        return value
+
+    def popitem(self) -> tuple:
+        key, value = dict.popitem(self)
+        dict.__setitem__(self, key, value)
+        del self[key]
+        return key, value
+
+    def setdefault(self, key, default=None) -> Any:
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kw) -> None:
+        for key, value in dict(*args, **kw).items():
+            self[key] = value
+
+    def __ior__(self, other) -> 'TrackedDict':
+        self.update(other)
+        return self
+
+    def clear(self) -> None:
+        for key in self:
+            self._detach(key)
+        dict.clear(self)
+        self._replaced = True
+        self._touch()
+
+    def _collect(self, path: str, update: Dict[str, Dict[str, Any]]) -> None:
+        if self._replaced:
+            update.setdefault('$set', {})[path] = self
+            return
+        if self._set:
+            sets = update.setdefault('$set', {})
+            for key in self._set:
+                sets[_join(path, key)] = dict.__getitem__(self, key)
+        if self._unset:
+            unsets = update.setdefault('$unset', {})
+            for key in self._unset:
+                unsets[_join(path, key)] = ''
+        for key in self._changed:
+            if key not in self._set:
+                child = dict.get(self, key)
+                if isinstance(child, Tracker):
+                    child._collect(_join(path, key), update)
+
+    def _reset(self) -> None:
+        for key in self._changed:
+            child = dict.get(self, key)
+            if isinstance(child, Tracker):
+                child._reset()
+        self._set.clear()
+        self._unset.clear()
+        self._changed.clear()
+        self._replaced = False
+        self._dirty = False
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+
+class TrackedModelList(Tracker, list):
+    """The models of an array of embedded documents, which mirrors its mutations to the stored documents.
+
+    Changes of the models themselves are saved by `$set` and `$unset` of their fields.
+    """
+
+    __slots__ = ('_parent', '_key', '_dirty', '_changed', '_base', '_kinds', '_indexes', '_field', '_values')
+
+    def __init__(self, field, values: List[abc.MutableMapping]):
+        self._init_tracker(None, None)
+        model = field.model
+        # noinspection PyProtectedMember
+        list.__init__(self, (model._from_clean_data(value) for value in values))
+        self._field = field
+        self._values = values
+        self._base = len(self)
+        self._kinds = set()
+        self._indexes = set()
+
+    def _tracks(self, value: Any) -> bool:
+        return value is self._values
+
+    def _clean(self, obj: Any) -> Any:
+        value = self._field.clean(obj)
+        if isinstance(obj, self._field.model) and obj._data is value:
+            return obj
+        # noinspection PyProtectedMember
+        return self._field.model._from_clean_data(value)
+
+    def _record(self, kind: str) -> None:
+        self._kinds.add(kind)
+        self._dirty = True
+
+    def _sync(self) -> None:
+        self._values[:] = [obj._data for obj in self]
+        self._record('replace')
+
+    def append(self, obj: Any) -> None:
+        obj = self._clean(obj)
+        list.append(self, obj)
+        self._values.append(obj._data)
+        self._record('push')
+
+    def extend(self, objs: Iterable) -> None:
+        objs = [self._clean(obj) for obj in objs]
+        list.extend(self, objs)
+        self._values.extend(obj._data for obj in objs)
+        self._record('push')
+
+    def __iadd__(self, objs: Iterable) -> 'TrackedModelList':
+        self.extend(objs)
+        return self
+
+    def __setitem__(self, index, obj) -> None:
+        if isinstance(index, slice):
+            list.__setitem__(self, index, [self._clean(item) for item in obj])
+            self._sync()
+            return
+        if index < 0:
+            index += len(self)
+        obj = self._clean(obj)
+        list.__setitem__(self, index, obj)
+        self._values[index] = obj._data
+        if index < self._base:
+            self._indexes.add(index)
+            self._record('set')
+
+    def insert(self, index: int, obj: Any) -> None:
+        list.insert(self, index, self._clean(obj))
+        self._sync()
+
+    def _replace(name):
+        method = getattr(list, name)
+
+        def replace(self, *args, **kw):
+            rv = method(self, *args, **kw)
+            self._sync()
+            return rv
+
+        replace.__name__ = name
+        return replace
+
+    remove = _replace('remove')
+    pop = _replace('pop')
+    clear = _replace('clear')
+    sort = _replace('sort')
+    reverse = _replace('reverse')
+    __delitem__ = _replace('__delitem__')
+    __imul__ = _replace('__imul__')
+    del _replace
+
+    def _model_changes(self, path: str) -> Dict[str, Dict[str, Any]]:
+        update = {}
+        for index in range(self._base):
+            if index not in self._indexes:
+                # noinspection PyProtectedMember
+                list.__getitem__(self, index)._collect_changes(_join(path, index) + '.', update)
+        return update
+
+    def _collect(self, path: str, update: Dict[str, Dict[str, Any]]) -> None:
+        kinds = self._kinds
+        if 'replace' in kinds or len(kinds) > 1:
+            update.setdefault('$set', {})[path] = self._values
+            return
+
+        changes = self._model_changes(path)
+        if kinds == {'push'}:
+            if changes:
+                update.setdefault('$set', {})[path] = self._values
+            else:
+                update.setdefault('$push', {})[path] = {'$each': self._values[self._base:]}
+            return
+
+        if kinds:
+            sets = update.setdefault('$set', {})
+            for index in self._indexes:
+                sets[_join(path, index)] = self._values[index]
+        for operator, fields in changes.items():
+            update.setdefault(operator, {}).update(fields)
+
+    def _reset(self) -> None:
+        for obj in self:
+            # noinspection PyProtectedMember
+            obj._clear_tracked_fields()
+        self._base = len(self)
+        self._kinds.clear()
+        self._indexes.clear()
+        self._dirty = False
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+
+def track(value: Any) -> Any:
+    """Return a tracked container of a `list` or `dict`, or the value as it is."""
+    if isinstance(value, Tracker):
+        return value
+    if isinstance(value, list):
+        return TrackedList(value)
+    if isinstance(value, dict):
+        return TrackedDict(value)
+    return value
@@ -2,7 +2,7 @@ import logging
 import random
 import string
 import time
-from collections import abc
+from collections import abc, OrderedDict
 from functools import reduce, partial
 from keyword import iskeyword
 from operator import add
@@ -38,9 +38,12 @@ __all__ = [
     'to_camelcase',
     'hump_keys',
     'get_dict_item_with_dot',
+    'chunked',
     'Missing',
     'classproperty',
+    'hybridmethod',
     'cachedproperty',
+    'LRUCache',
     'isclass',
     'not_none',
     'normalize_indexes',
@@ -339,6 +342,39 @@ def get_dict_item_with_dot(data: MutableMapping, name: str) -> Any:
     return item
 
 
+def chunked(iterable: Iterable, size: int, max_bytes: int = None, weigh: Callable[[Any], int] = None) -> Iterator[List]:
+    """Split an iterable into lists of at most `size` items lazily.
+    If `max_bytes` is given, the items of a list weigh at most `max_bytes` in total,
+    unless a single item is heavier than that.
+
+    >>> list(chunked(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    >>> list(chunked(['aa', 'b', 'cccc', 'd'], 10, max_bytes=3, weigh=len))
+    [['aa', 'b'], ['cccc'], ['d']]
+    """
+
+    if size < 1:
+        raise ValueError('size must be greater than 0, not {!r}.'.format(size))
+
+    chunk = []
+    total = 0
+    for item in iterable:
+        if max_bytes is not None:
+            weight = weigh(item)
+            if chunk and total + weight > max_bytes:
+                yield chunk
+                chunk = []
+                total = 0
+            total += weight
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+            total = 0
+    if chunk:
+        yield chunk
+
+
 def isclass(obj: Any) -> bool:
     """Determine if an object is a `class` object
 
@@ -404,6 +440,36 @@ class classproperty:
         return self
 
 
+# noinspection PyPep8Naming
+class hybridmethod:
+    """A method bound to the class when called on the class, or to the instance by `instancemethod`.
+
+    >>> class Foo:
+    ...     @hybridmethod
+    ...     def name(cls):
+    ...         return 'class'
+    ...     @name.instancemethod
+    ...     def name(self):
+    ...         return 'instance'
+    >>> Foo.name(), Foo().name()
+    ('class', 'instance')
+    """
+
+    def __init__(self, fclass: Callable, finstance: Callable = None):
+        self.fclass = fclass
+        self.finstance = finstance
+        self.__doc__ = fclass.__doc__
+
+    def instancemethod(self, finstance: Callable) -> 'hybridmethod':
+        self.finstance = finstance
+        return self
+
+    def __get__(self, instance, cls=None) -> Callable:
+        if instance is None or self.finstance is None:
+            return self.fclass.__get__(cls, type(cls))
+        return self.finstance.__get__(instance, cls)
+
+
 # noinspection PyPep8Naming
 class cachedproperty:
     """Decorator that converts a method with a single self argument into a property cached on the instance.
@@ -423,6 +489,54 @@ class cachedproperty:
         return res
 
 
+class LRUCache:
+    """A thread-safe mapping holding at most `maxsize` items, discarding the least recently used ones.
+
+    >>> cache = LRUCache(2)
+    >>> cache['a'] = 1
+    >>> cache['b'] = 2
+    >>> cache.get('a')
+    1
+    >>> cache['c'] = 3
+    >>> 'b' in cache
+    False
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
 def normalize_indexes(indexes: List[Union[str, tuple, list, MutableMapping]]) -> List[Dict]:
     """Convert the abbr to the arguments that can be used by :meth:`pymongo.collection.Collection.create_index`:
     [{'key': [('a', 1), ('b', -1), ...], 'option1': value1, ...}, ...]
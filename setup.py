@@ -31,6 +31,6 @@ setup(
     ],
     packages=['monom'],
     python_requires='>=3.6',
-    install_requires=['pymongo>=3.7'],
-    extras_require={'dev': ['pytest']},
+    install_requires=['pymongo>=3.7', 'contextvars; python_version < "3.7"'],
+    extras_require={'dev': ['pytest'], 'numpy': ['numpy'], 'orjson': ['orjson']},
 )
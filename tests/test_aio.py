@@ -0,0 +1,177 @@
+import asyncio
+import inspect
+from unittest import mock
+
+import pytest
+from pymongo import AsyncMongoClient
+from pymongo.results import UpdateResult
+
+from monom import *
+from monom.aio import AsyncCursor
+from monom.batch import BatchValidationError
+from monom.mongo import ConflictError
+from monom.fields import ValidationError
+
+
+class User(EmbeddedModel):
+    name: str
+    age: int = 20
+
+
+class Post(AsyncModel):
+    user: User
+    title: str
+    tags: List[str]
+    visible: bool = True
+
+
+def run(main):
+    """Run a coroutine function with the models bound to a test database, in a new event loop."""
+
+    async def wrapper():
+        client = AsyncMongoClient()
+        Post.set_db(client.get_database('monom-test-aio'))
+        Post.set_collection('posts')
+        try:
+            await main()
+        finally:
+            await client.drop_database('monom-test-aio')
+            await client.close()
+
+    asyncio.run(wrapper())
+
+
+class TestAsyncModel:
+    def test_awaitable_methods(self):
+        for name in ('find_one', 'insert_one', 'insert_many', 'update_one', 'aggregate', 'count_documents'):
+            assert inspect.iscoroutinefunction(getattr(Post, name))
+        for name in ('save', 'delete', 'save_multiple', 'build_indexes', 'aggregate_models'):
+            assert inspect.iscoroutinefunction(getattr(Post, name))
+
+    def test_shared_schema(self):
+        post = Post(title='hello', user={'name': 'foo'})
+        assert post.user.age == 20
+        with pytest.raises(ValidationError):
+            Post(title=42)
+
+    def test_save_and_find(self):
+        async def main():
+            post = await Post(title='hello', user={'name': 'foo'}).save()
+            assert post._state == 'after_save'
+            post.title = 'hello world'
+            await post.save()
+
+            found = await Post.find_one({'_id': post.pk})
+            assert found.title == 'hello world'
+            assert found.user.name == 'foo'
+
+            cursor = Post.find({}).sort('title')
+            assert isinstance(cursor, AsyncCursor)
+            assert [post.title async for post in cursor] == ['hello world']
+
+            await found.delete()
+            assert await Post.find_one() is None
+
+        run(main)
+
+    def test_collection_methods(self):
+        async def main():
+            await Post.insert_many([{'title': str(i)} for i in range(10)])
+            with pytest.raises(ValidationError):
+                await Post.insert_one({'title': 42})
+
+            await Post.update_one({'title': '0'}, {'$set': {'tags': ['a']}})
+            assert (await Post.find_one({'title': '0'})).tags == ['a']
+            assert await Post.count_documents({}) == 10
+            assert len(await Post.find().limit(3).to_list()) == 3
+
+            result = await Post.insert_stream(({'title': str(i)} for i in range(5)), chunk_size=2)
+            assert (result.inserted_count, result.chunk_count) == (5, 3)
+
+        run(main)
+
+    def test_save_multiple(self):
+        async def main():
+            old = await Post(title='old').save()
+            old.mark_for_deletion()
+            result = await Post.save_multiple([old, Post(title='new')])
+            assert [outcome.operation for outcome in result.outcomes] == ['delete', 'insert']
+            assert (result.inserted_count, result.deleted_count) == (1, 1)
+            assert [post.title async for post in Post.find()] == ['new']
+
+        run(main)
+
+    def test_versioned_save(self):
+        class Counter(AsyncModel):
+            auto_build_index = False
+
+            value: int
+            version: int
+
+            class Meta:
+                version_field = 'version'
+
+        collection = mock.MagicMock()
+        collection.update_one = mock.AsyncMock(side_effect=[UpdateResult({'n': 0}, True), UpdateResult({'n': 1}, True)])
+        collection.find_one = mock.AsyncMock(return_value={'_id': 1, 'value': 5, 'version': 2})
+
+        async def increment(obj):
+            obj.value += 1
+
+        async def main():
+            counter = Counter.from_document({'_id': 1, 'value': 0, 'version': 1})
+            await increment(counter)
+            await counter.save(on_conflict=increment)
+            assert (counter.value, counter.version) == (6, 3)
+
+            collection.update_one.side_effect = None
+            collection.update_one.return_value = UpdateResult({'n': 0}, True)
+            counter.value = 0
+            with pytest.raises(ConflictError):
+                await counter.save()
+
+        with mock.patch.object(Counter, 'get_collection', return_value=collection):
+            asyncio.run(main())
+
+    def test_aggregate_models(self):
+        class FakeCursor:
+            def __init__(self, docs):
+                self.docs = docs
+                self.closed = False
+
+            async def __anext__(self):
+                if not self.docs:
+                    raise StopAsyncIteration
+                return self.docs.pop(0)
+
+            def __aiter__(self):
+                return self
+
+            async def to_list(self, length=None):
+                docs, self.docs = self.docs[:length], self.docs[length:] if length is not None else []
+                return docs
+
+            async def close(self):
+                self.closed = True
+
+        collection = mock.MagicMock()
+        collection.aggregate = mock.AsyncMock(side_effect=lambda *args, **kw: FakeCursor(
+            [{'_id': i, 'title': str(i)} for i in range(4)] + [{'_id': 4, 'title': 4}]
+        ))
+
+        async def main():
+            async with await Post.aggregate_models([], batch_size=2) as cursor:
+                assert [post.title async for post in cursor] == ['0', '1', '2', '3', 4]
+                with pytest.raises(TypeError):
+                    iter(cursor)
+            assert cursor.closed
+            assert collection.aggregate.call_args[1]['batchSize'] == 2
+
+            cursor = await Post.aggregate_models([], validate=True)
+            assert [post.title for post in await cursor.to_list(2)] == ['0', '1']
+            with pytest.raises(BatchValidationError) as err:
+                await cursor.to_list()
+            assert err.value.index == 4
+
+        with mock.patch.object(Post, 'get_collection', return_value=collection):
+            asyncio.run(main())
@@ -0,0 +1,156 @@
+from typing import List
+
+import pytest
+
+from monom import BaseModel, EmbeddedModel
+from monom import batch
+from monom.batch import BatchValidationError, validate_many
+from monom.fields import *
+
+
+class SubModel(EmbeddedModel):
+    f1: int
+    f2 = StringField(max_length=3)
+
+
+class MainModel(BaseModel):
+    f1 = IntField(min_value=0, max_value=100, required=True)
+    f2 = StringField(min_length=1, validator=lambda x: x != 'foo')
+    f3: SubModel
+    f4: List[SubModel]
+    f5: List[List[int]]
+
+
+def clean(docs):
+    return [MainModel._get_clean_data(doc, bypass_validation=True) for doc in docs]
+
+
+def first_error(docs):
+    root = MainModel._get_plan().root
+    for idx, doc in enumerate(docs):
+        try:
+            root.validate(doc)
+        except ValidationError as err:
+            return idx, err.msg
+
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def use_numpy(request, monkeypatch):
+    if request.param:
+        pytest.importorskip('numpy')
+        monkeypatch.setattr(batch, 'NUMPY_MIN_SIZE', 1)
+    else:
+        monkeypatch.setattr(batch, 'numpy', None)
+
+
+def test_valid_documents(use_numpy):
+    docs = clean([{'f1': i, 'f2': 'a', 'f3': {'f1': i}, 'f4': [{'f2': 'abc'}], 'f5': [[i]]} for i in range(100)])
+    validate_many(MainModel, docs)
+
+
+@pytest.mark.parametrize('invalid, field', [
+    ({'f2': 'a'}, 'f1'),
+    ({'f1': 'a'}, 'f1'),
+    ({'f1': 101}, 'f1'),
+    ({'f1': -1}, 'f1'),
+    ({'f1': 1, 'f2': ''}, 'f2'),
+    ({'f1': 1, 'f2': 'foo'}, 'f2'),
+    ({'f1': 1, 'f3': {'f1': 'a'}}, 'f3'),
+    ({'f1': 1, 'f4': [{'f2': 'a'}, {'f2': 'abcd'}]}, 'f4'),
+    ({'f1': 1, 'f5': [[1], [2, 'a']]}, 'f5'),
+])
+def test_invalid_document(use_numpy, invalid, field):
+    docs = [{'f1': i, 'f2': 'a', 'f4': [{'f1': i}], 'f5': [[i]]} for i in range(100)]
+    docs[42] = invalid
+    docs[57] = invalid
+    docs = clean(docs)
+
+    with pytest.raises(BatchValidationError) as err:
+        validate_many(MainModel, docs)
+    assert err.value.index == 42
+    assert err.value.field == field
+    assert err.value.msg.endswith(first_error(docs)[1])
+
+
+def test_first_invalid_field_wins(use_numpy):
+    docs = clean([{'f1': 1}, {'f1': 1, 'f2': 'foo'}, {'f1': -1, 'f2': 'foo'}])
+    with pytest.raises(BatchValidationError) as err:
+        validate_many(MainModel, docs)
+    assert (err.value.index, err.value.field) == (1, 'f2')
+
+    docs = clean([{'f1': 1}, {'f1': -1, 'f2': 'foo'}])
+    with pytest.raises(BatchValidationError) as err:
+        validate_many(MainModel, docs)
+    assert (err.value.index, err.value.field) == (1, 'f1')
+
+
+@pytest.mark.parametrize('values, bound', [
+    # cast to float64, 2 ** 53 + 1 would equal the bound
+    ([0.5, 2 ** 53 + 1], 2 ** 53),
+    ([1, 2 ** 53 + 1], float(2 ** 53)),
+    ([1.0, float(2 ** 53 + 2)], 2 ** 53 + 1),
+    ([1, 2 ** 63], 2 ** 62),
+])
+def test_exact_bounds(use_numpy, values, bound):
+    assert batch._exceeds_max(values, bound)
+    assert batch._exceeds_min([-value for value in values], -bound)
+
+
+def test_nan_bounds(use_numpy):
+    class Point(BaseModel):
+        x = FloatField(max_value=10.0, min_value=-10.0)
+
+    for bad in (100.0, -100.0):
+        docs = [Point._get_clean_data(doc, bypass_validation=True) for doc in [{'x': float('nan')}, {'x': bad}] * 40]
+        with pytest.raises(BatchValidationError) as err:
+            validate_many(Point, docs)
+        assert err.value.index == 1
+
+
+def test_skip_embedded_models():
+    docs = clean([{'f1': 1, 'f3': SubModel(f1=1), 'f4': [SubModel(f2='a')]}])
+    validate_many(MainModel, docs)
+
+
+def test_extra_data_warning(caplog):
+    validate_many(MainModel, clean([{'f1': 1, 'f6': 1}, {'f1': 1, 'f3': {'f3': 1}}]))
+    assert len(caplog.records) == 2
+    for record in caplog.records:
+        assert 'not defined' in record.message
+
+
+if __name__ == '__main__':
+    pytest.main()
+
+
+def test_validate_many_offset():
+    with pytest.raises(BatchValidationError) as info:
+        validate_many(MainModel, clean([{'f1': 1}, {'f1': -1}]), offset=10)
+    assert info.value.index == 11
+
+
+class TestValidateChunk:
+    @staticmethod
+    def validate_chunk(docs, ordered):
+        from monom import Model
+
+        class StreamModel(Model):
+            f1 = IntField(min_value=0)
+
+        docs = [StreamModel._get_clean_data(doc, bypass_validation=True) for doc in docs]
+        return StreamModel._validate_chunk(docs, 100, ordered)
+
+    def test_ordered(self):
+        valid, errors = self.validate_chunk([{'f1': 1}, {'f1': -1}, {'f1': 2}, {'f1': -2}], ordered=True)
+        assert valid == [{'f1': 1}]
+        assert [err.index for err in errors] == [101]
+
+    def test_unordered(self):
+        valid, errors = self.validate_chunk([{'f1': 1}, {'f1': -1}, {'f1': 2}, {'f1': -2}], ordered=False)
+        assert valid == [{'f1': 1}, {'f1': 2}]
+        assert [err.index for err in errors] == [101, 103]
+
+    def test_all_valid(self):
+        valid, errors = self.validate_chunk([{'f1': 1}, {'f1': 2}], ordered=False)
+        assert valid == [{'f1': 1}, {'f1': 2}]
+        assert errors == []
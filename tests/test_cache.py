@@ -0,0 +1,218 @@
+import doctest
+import time
+
+import pytest
+
+import monom.cache
+from monom import *
+from monom.cache import LRUBackend, PkCache, QueryCache
+
+
+@pytest.fixture
+def collection():
+    return MongoClient(connect=False).get_database('monom-test').get_collection('users')
+
+
+def test_doctest():
+    assert doctest.testmod(monom.cache).failed == 0
+
+
+class TestPkCache:
+    def test_fetch(self, collection):
+        cache = PkCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return {'_id': 1, 'name': 'foo'}
+
+        doc = cache.fetch(collection, 1, load)
+        cached = cache.fetch(collection, 1, load)
+        assert doc == cached == {'_id': 1, 'name': 'foo'}
+        cached['name'] = 'bar'
+        assert cache.fetch(collection, 1, load)['name'] == 'foo'
+        assert len(loads) == 1
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_negative_caching(self, collection):
+        loads = []
+
+        def load():
+            loads.append(1)
+
+        cache = PkCache()
+        cache.fetch(collection, 1, load)
+        cache.fetch(collection, 1, load)
+        assert len(loads) == 2
+
+        cache = PkCache(negative_ttl=60)
+        cache.fetch(collection, 1, load)
+        assert cache.fetch(collection, 1, load) is None
+        assert len(loads) == 3
+
+    def test_ttl(self, collection):
+        cache = PkCache(ttl=0.01)
+        cache.fetch(collection, 1, lambda: {'_id': 1})
+        time.sleep(0.02)
+        cache.fetch(collection, 1, lambda: {'_id': 1})
+        assert cache.misses == 2
+
+    def test_invalidate(self, collection):
+        cache = PkCache()
+        for pk in (1, 2):
+            cache.fetch(collection, pk, lambda: {'_id': pk})
+
+        cache.invalidate(collection, {'_id': 1})
+        cache.fetch(collection, 1, lambda: {'_id': 1})
+        cache.fetch(collection, 2, lambda: {'_id': 2})
+        assert cache.misses == 3
+
+        # not a primary key
+        cache.invalidate(collection, {'name': 'foo'})
+        cache.fetch(collection, 2, lambda: {'_id': 2})
+        assert cache.misses == 4
+
+    def test_invalidated_while_loading(self, collection):
+        cache = PkCache()
+
+        def load():
+            cache.invalidate(collection, {'_id': 1})
+            return {'_id': 1}
+
+        cache.fetch(collection, 1, load)
+        cache.fetch(collection, 1, lambda: {'_id': 1})
+        assert cache.misses == 2
+
+    def test_lru_backend(self):
+        backend = LRUBackend(2)
+        for key in 'abc':
+            backend.set((key,), b'', None)
+        assert len(backend) == 2
+        with pytest.raises(KeyError):
+            backend.get(('a',))
+
+
+@pytest.fixture
+def query_cache(monkeypatch):
+    cache = QueryCache()
+    # no change streams without a replica set
+    monkeypatch.setattr(cache, '_watch', lambda collection: True)
+    return cache
+
+
+class TestQueryCache:
+    def test_key(self, collection):
+        key = QueryCache.key_of(collection.find({'a': 1, 'b': {'$lt': 3, '$gt': 1}}, ['x', 'y']).sort('a'))
+        assert key == QueryCache.key_of(collection.find({'b': {'$gt': 1, '$lt': 3}, 'a': 1}, ['y', 'x']).sort('a'))
+        assert key != QueryCache.key_of(collection.find({'a': 1, 'b': {'$lt': 3, '$gt': 1}}, ['x', 'y']).sort('a', -1))
+        assert key != QueryCache.key_of(collection.find({'a': 1, 'b': {'$lt': 3, '$gt': 1}}, ['x', 'y']).limit(1))
+        # embedded documents are matched in order
+        assert QueryCache.key_of(collection.find({'e': {'x': 1, 'y': 2}})) != \
+            QueryCache.key_of(collection.find({'e': {'y': 2, 'x': 1}}))
+
+    def test_fetch(self, collection, query_cache):
+        docs = query_cache.fetch(collection.find({'a': 1}), lambda: [{'_id': 1, 'a': 1}])
+        cached = query_cache.fetch(collection.find({'a': 1}), lambda: [])
+        assert docs == cached == [{'_id': 1, 'a': 1}]
+        cached[0]['a'] = 2
+        assert query_cache.fetch(collection.find({'a': 1}), lambda: [])[0]['a'] == 1
+        assert (query_cache.hits, query_cache.misses) == (2, 1)
+
+    def test_ttl(self, collection, query_cache):
+        query_cache.fetch(collection.find(), lambda: [], ttl=0.01)
+        time.sleep(0.02)
+        query_cache.fetch(collection.find(), lambda: [])
+        assert query_cache.misses == 2
+
+    def test_changes(self, collection, query_cache):
+        query_cache.fetch(collection.find({'a': 1}).sort('b'), lambda: [{'_id': 1, 'a': 1, 'b': 1}])
+        query_cache.fetch(collection.find().skip(1), lambda: [{'_id': 2}])
+        name = collection.full_name
+
+        def update(pk, *fields):
+            return {'operationType': 'update', 'documentKey': {'_id': pk},
+                    'updateDescription': {'updatedFields': dict.fromkeys(fields, 0), 'removedFields': []}}
+
+        # neither in the results, nor matched or sorted by the fields
+        query_cache._on_change(name, update(3, 'c', 'd.e'))
+        assert len(query_cache) == 2
+        query_cache._on_change(name, update(3, 'b.c'))
+        assert len(query_cache) == 1
+        query_cache._on_change(name, {'operationType': 'delete', 'documentKey': {'_id': 3}})
+        assert len(query_cache) == 0
+
+        query_cache.fetch(collection.find({'a': 1}), lambda: [{'_id': 1, 'a': 1}])
+        query_cache._on_change(name, {'operationType': 'insert', 'documentKey': {'_id': 3}})
+        assert len(query_cache) == 0
+
+    def test_changed_while_loading(self, collection, query_cache):
+        def load():
+            query_cache._on_change(collection.full_name, {'operationType': 'insert', 'documentKey': {'_id': 1}})
+            return [{'_id': 1}]
+
+        query_cache.fetch(collection.find(), load)
+        assert len(query_cache) == 0
+
+    def test_cached(self, query_cache):
+        class User(Model):
+            name: str
+            auto_build_index = False
+
+        User.set_db(MongoClient(connect=False).get_database('monom-test'))
+        query_cache.fetch(User.find({'name': 'foo'}), lambda: [{'_id': 1, 'name': 'foo'}])
+        users = User.find({'name': 'foo'}).cached(cache=query_cache)
+        assert [user.name for user in users] == ['foo']
+        assert users[0] is not User.find({'name': 'foo'}).cached(cache=query_cache)[0]
+
+    def test_change_stream(self, db):
+        # requires a replica set
+        class User(Model):
+            name: str
+
+        User.set_db(db)
+        User.insert_one({'name': 'foo'})
+        cache = QueryCache()
+        assert len(User.find().cached(cache=cache)) == 1
+        assert len(User.find().cached(cache=cache)) == 1
+        assert cache.hits == 1
+
+        db.get_collection('users').insert_one({'name': 'bar'})
+        for _ in range(50):
+            if not len(cache):
+                break
+            time.sleep(0.1)
+        assert len(User.find().cached(cache=cache)) == 2
+        cache.close()
+
+
+class TestModelCache:
+    def test_get(self, db):
+        class User(Model):
+            name: str
+            pk_cache = PkCache(negative_ttl=60)
+
+        User.set_db(db)
+        pk = User(name='foo').save().pk
+        assert User.get(pk).name == 'foo'
+        assert User.find_one({'_id': pk}).name == 'foo'
+        assert User.pk_cache.hits == 1
+
+        db.get_collection('users').update_one({'_id': pk}, {'$set': {'name': 'bar'}})
+        assert User.get(pk).name == 'foo'
+
+        User.update_one({'_id': pk}, {'$set': {'name': 'baz'}})
+        user = User.get(pk)
+        assert user.name == 'baz'
+
+        user.name = 'qux'
+        user.save()
+        assert User.get(pk).name == 'qux'
+
+        User.update_many({}, {'$set': {'name': 'all'}})
+        assert User.get(pk).name == 'all'
+
+        user.delete()
+        assert User.get(pk) is None
+
+        User.insert_one({'_id': pk, 'name': 'again'})
+        assert User.get(pk).name == 'again'
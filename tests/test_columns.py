@@ -0,0 +1,79 @@
+import doctest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+
+import monom.columns
+from monom import *
+from monom.mongo import Cursor
+
+numpy = pytest.importorskip('numpy')
+
+
+class Address(EmbeddedModel):
+    city: str
+
+
+class Reading(Model):
+    auto_build_index = False
+
+    count: int
+    value: float
+    valid: bool
+    taken_on: datetime
+    address: Address
+
+
+def test_doctest():
+    assert doctest.testmod(monom.columns).failed == 0
+
+
+def test_invalid_fields():
+    Reading.set_db(MongoClient(connect=False).get_database('monom-test'))
+    for path in ('missing', 'count.value', 'address.missing'):
+        with pytest.raises(ValueError):
+            Reading.find().to_columns([path])
+
+
+def test_type_drift():
+    Reading.set_db(MongoClient(connect=False).get_database('monom-test'))
+    batches = [
+        [{'count': 1, 'value': 1, 'taken_on': datetime(2020, 1, 1, tzinfo=timezone(timedelta(hours=8)))},
+         {'count': None, 'value': 2.5}],
+        [{'count': '3', 'value': 2 ** 70, 'taken_on': 'yesterday'}],
+        [{'count': 4, 'value': 4.5, 'taken_on': datetime(2020, 1, 2)}],
+        [],
+    ]
+    with mock.patch.object(Cursor, '_next_batch', side_effect=batches):
+        columns = Reading.find().to_columns(['count', 'value', 'taken_on'])
+
+    # the columns of values of other types are kept as Python objects
+    assert columns['count'].dtype == object and columns['taken_on'].dtype == object
+    assert list(columns['count'].data) == [1, 0, '3', 4] and list(columns['count'].mask) == [False, True, False, False]
+    assert columns['taken_on'][0] == datetime(2019, 12, 31, 16)
+    assert list(columns['taken_on'][2:]) == ['yesterday', datetime(2020, 1, 2)]
+    assert columns['value'].dtype == numpy.float64 and columns['value'][2] == 2.0 ** 70
+
+
+def test_to_columns(db):
+    Reading.set_db(db)
+    Reading.insert_many([
+        {'count': i, 'value': i / 2, 'valid': i % 2 == 0, 'taken_on': datetime(2020, 1, 1, i),
+         'address': {'city': str(i)}}
+        for i in range(10)
+    ])
+    Reading.get_collection().insert_one({'count': None})
+
+    columns = Reading.find().sort('_id').batch_size(3).to_columns(['count', 'value', 'taken_on', 'address.city'])
+    assert columns['count'].dtype == numpy.int64
+    assert columns['value'].dtype == numpy.float64
+    assert columns['taken_on'].dtype == numpy.dtype('datetime64[ms]')
+    assert columns['count'].sum() == 45
+    assert list(columns['count'].mask) == [False] * 10 + [True]
+    assert columns['taken_on'][1] == numpy.datetime64('2020-01-01T01:00')
+    assert list(columns['address.city'][:3]) == ['0', '1', '2']
+
+    columns = Reading.find({'count': -1}).to_columns()
+    assert set(columns) == {'count', 'value', 'valid', 'taken_on', 'address'}
+    assert len(columns['count']) == 0
@@ -1,6 +1,11 @@
+import asyncio
+from threading import Thread
+
 import pytest
 from pymongo import MongoClient
 
+from pymongo.write_concern import WriteConcern
+
 from monom import Model, switch_collection, switch_db
 
 
@@ -37,5 +42,62 @@ def test_switch_collection(db):
     assert User.get_collection().name == 'users'
 
 
+def test_switch_db_keeps_collection_options():
+    class User(Model):
+        auto_build_index = False
+
+    client = MongoClient(connect=False)
+    User.set_db(client.get_database('monom-test'))
+    User.set_collection('members', write_concern=WriteConcern(w=0))
+
+    with switch_db(User, client.get_database('monom-test1')):
+        collection = User.get_collection()
+        assert collection.database.name == 'monom-test1'
+        assert collection.name == 'members'
+        assert collection.write_concern == WriteConcern(w=0)
+        # the handles are cached
+        assert User.get_collection() is collection
+
+        with switch_collection(User, 'people'):
+            assert User.get_collection().full_name == 'monom-test1.people'
+        assert User.get_collection() is collection
+
+    assert User.get_collection().full_name == 'monom-test.members'
+
+
+def test_switch_in_threads_and_tasks():
+    class User(Model):
+        auto_build_index = False
+
+    client = MongoClient(connect=False)
+    User.set_db(client.get_database('monom-test'))
+    names = {}
+
+    def work(name):
+        with switch_db(User, client.get_database(name)):
+            for _ in range(1000):
+                assert User.get_db().name == name
+            names[name] = User.get_collection().database.name
+
+    threads = [Thread(target=work, args=('db{}'.format(i),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert names == {'db{}'.format(i): 'db{}'.format(i) for i in range(4)}
+
+    async def task(name):
+        with switch_collection(User, name):
+            await asyncio.sleep(0)
+            return User.get_collection().name
+
+    async def main():
+        return await asyncio.gather(*(task('coll{}'.format(i)) for i in range(4)))
+
+    assert asyncio.run(main()) == ['coll{}'.format(i) for i in range(4)]
+    assert User.get_db().name == 'monom-test'
+    assert User.get_collection().name == 'users'
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,163 @@
+import doctest
+from unittest import mock
+
+import pytest
+
+import monom.indexes
+from monom import AsyncModel, Model
+from monom.__main__ import main
+from monom.indexes import IndexManager, index_fingerprint, registered_models
+
+
+def test_doctest():
+    assert doctest.testmod(monom.indexes).failed == 0
+
+
+def test_registered_models():
+    class Foo(Model):
+        pass
+
+    class Bar(Foo):
+        pass
+
+    class Baz(AsyncModel):
+        pass
+
+    models = registered_models()
+    assert models.index(Foo) < models.index(Bar)
+    assert Baz not in models
+    assert Model not in models and AsyncModel not in models
+
+
+def test_fingerprint():
+    class Foo(Model):
+        class Meta:
+            indexes = [{'key': 'a', 'expire_after_seconds': 60}]
+
+    class Bar(Model):
+        class Meta:
+            indexes = [{'key': 'a', 'expire_after_seconds': 60}]
+
+    fingerprint = index_fingerprint(Foo)
+    # the declared indexes are not modified
+    assert index_fingerprint(Foo) == fingerprint == index_fingerprint(Bar)
+    assert Foo._declared_indexes() == [{'key': [('a', 1)], 'expireAfterSeconds': 60}]
+
+    Bar.Meta.indexes = ['a']
+    assert index_fingerprint(Bar) != fingerprint
+
+
+def test_index_changes():
+    class Foo(Model):
+        class Meta:
+            indexes = ['a', {'key': 'b', 'expire_after_seconds': 60}, 'c']
+
+    old = [
+        {'key': {'_id': 1}, 'name': '_id_', 'v': 2},
+        {'key': {'b': 1}, 'name': 'b_1', 'v': 2, 'expireAfterSeconds': 30},
+        {'key': {'c': 1}, 'name': 'c_1', 'v': 2, 'unique': True},
+        {'key': {'d': 1}, 'name': 'd_1', 'v': 2},
+    ]
+    changes = sorted(Foo._index_changes(old, 'foos'), key=lambda change: (change[0], str(change[1])))
+    assert changes == [
+        ('command', ({'collMod': 'foos', 'index': {'name': 'b_1', 'expireAfterSeconds': 60}},), {}),
+        ('create_index', ([('a', 1)],), {}),
+        ('create_index', ([('c', 1)],), {'name': 'c_1'}),
+        ('drop_index', ('c_1',), {}),
+        ('drop_index', ('d_1',), {}),
+    ]
+
+
+def test_stored_fingerprints():
+    class Foo(Model):
+        auto_build_index = False
+
+        class Meta:
+            indexes = ['a', 'b']
+
+    db = mock.MagicMock()
+    metadata = db.get_collection.return_value
+    metadata.find_one.return_value = {'_id': 'foos', 'fingerprint': index_fingerprint(Foo)}
+    collection = mock.MagicMock(database=db, full_name='test.foos')
+    collection.name = 'foos'
+    indexes = [{'key': {'_id': 1}, 'name': '_id_'}, {'key': {'a': 1}, 'name': 'a_1'}, {'key': {'b': 1}, 'name': 'b_1'}]
+    collection.list_indexes.side_effect = lambda: [dict(index) for index in indexes]
+
+    # the metadata collection is neither read nor written by default
+    assert IndexManager().sync_model(Foo, collection).changes == []
+    assert not db.get_collection.called
+
+    assert IndexManager(store_fingerprints=True).sync_model(Foo, collection).skipped
+    metadata.find_one.assert_called_once_with({'_id': 'foos'})
+
+    # an index was dropped since the fingerprint was stored
+    del indexes[2]
+    result = IndexManager(store_fingerprints=True).sync_model(Foo, collection)
+    assert not result.skipped
+    collection.create_indexes.assert_called_once()
+    assert metadata.replace_one.called
+
+
+def test_cli_requires_a_command():
+    with pytest.raises(SystemExit):
+        main([])
+
+
+class TestIndexManager:
+    def test_sync(self, db):
+        class Article(Model):
+            auto_build_index = False
+
+            class Meta:
+                indexes = ['a', ('b', -1)]
+
+        Article.set_db(db)
+        db.get_collection('articles').create_index('c')
+        manager = IndexManager(store_fingerprints=True)
+
+        [result] = manager.sync([Article], dry_run=True)
+        assert sorted(map(monom.indexes.describe_change, result.changes)) == ['create a_1', 'create b_-1', 'drop c_1']
+        assert 'a_1' not in Article.get_collection().index_information()
+
+        [result] = manager.sync([Article])
+        assert not result.skipped
+        indexes = Article.get_collection().index_information()
+        assert 'a_1' in indexes and 'b_-1' in indexes and 'c_1' not in indexes
+
+        # skipped by the fingerprint stored in the database
+        [result] = IndexManager(store_fingerprints=True).sync([Article])
+        assert result.skipped
+        assert not IndexManager().sync([Article])[0].skipped
+
+        [result] = IndexManager(store_fingerprints=True).sync([Article], force=True)
+        assert not result.skipped and result.changes == []
+
+        # the dropped indexes are created again, though the fingerprint is unchanged
+        Article.get_collection().drop_index('a_1')
+        [result] = IndexManager(store_fingerprints=True).sync([Article])
+        assert not result.skipped
+        assert list(map(monom.indexes.describe_change, result.changes)) == ['create a_1']
+
+    def test_sync_once_per_process(self, db):
+        class Article(Model):
+            class Meta:
+                indexes = ['a']
+
+        Article.set_db(db)
+        Article.get_collection()
+        assert 'a_1' in Article.get_collection().index_information()
+
+        db.get_collection('articles').drop_index('a_1')
+        Article.set_collection('articles')
+        assert 'a_1' not in Article.get_collection().index_information()
+
+    def test_cli(self, db, capsys):
+        class Article(Model):
+            auto_build_index = False
+
+            class Meta:
+                indexes = ['a']
+
+        assert main(['sync-indexes', __name__, '--db', db.name, '--dry-run']) == 0
+        assert '{}.articles (TestIndexManager.test_cli.<locals>.Article): create a_1'.format(db.name) \
+            in capsys.readouterr().out
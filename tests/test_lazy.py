@@ -0,0 +1,132 @@
+from datetime import datetime
+
+import bson
+import pytest
+from bson import Code, Decimal128, Int64, MaxKey, MinKey, Regex, Timestamp
+from bson.binary import Binary
+from bson.raw_bson import RawBSONDocument
+
+from monom import *
+from monom.lazy import LazyDocument
+
+
+class User(EmbeddedModel):
+    name: str
+    email: str
+
+
+class Post(Model):
+    user: User
+    title: str
+    data: bytes
+    tags: List[str]
+    comments: List[User]
+
+
+def make_lazy(doc: dict) -> LazyDocument:
+    return LazyDocument(RawBSONDocument(bson.encode(doc)))
+
+
+@pytest.fixture
+def doc():
+    return {
+        '_id': ObjectId(),
+        'user': {'name': 'foo', 'email': 'foo@example.com'},
+        'title': 'hello',
+        'data': b'\x00abc',
+        'tags': ['a', 'b'],
+        'comments': [{'name': 'bar'}],
+    }
+
+
+class TestLazyDocument:
+    def test_decoded_on_access(self, doc):
+        lazy = make_lazy(doc)
+        assert lazy._doc is None
+        assert lazy['title'] == 'hello'
+        assert lazy._doc is not None
+        assert len(lazy) == len(doc)
+        assert list(lazy) == list(doc)
+
+    def test_embedded_document(self, doc):
+        lazy = make_lazy(doc)
+        user = lazy['user']
+        assert isinstance(user, LazyDocument)
+        assert user._doc is None
+        assert user['name'] == 'foo'
+        assert isinstance(lazy['comments'][0], LazyDocument)
+
+    def test_binary(self, doc):
+        lazy = make_lazy(doc)
+        data = lazy['data']
+        assert isinstance(data, memoryview)
+        assert data == b'\x00abc'
+        assert data.obj is lazy.raw
+
+    def test_binary_of_other_subtype(self, doc):
+        doc['data'] = Binary(b'abc', 128)
+        assert make_lazy(doc)['data'] == Binary(b'abc', 128)
+
+    def test_binary_header_in_another_value(self, doc):
+        # a string that looks like the binary element
+        doc['title'] = '\x05data\x00\x04\x00\x00\x00\x00xxxx'
+        lazy = make_lazy(doc)
+        data = lazy['data']
+        assert data == b'\x00abc'
+        assert data.obj is lazy.raw
+
+    def test_scanned_on_demand(self, doc):
+        lazy = make_lazy(doc)
+        assert lazy['user']['name'] == 'foo'
+        # the elements after the accessed one are not scanned
+        assert list(lazy._offsets) == ['_id', 'user']
+        assert lazy['tags'] == ['a', 'b']
+        assert list(lazy) == list(doc)
+
+    def test_all_types(self):
+        doc = {
+            'double': 1.5, 'string': 'é', 'document': {'a': [1, {'b': None}]}, 'array': [1, 'a', {'c': 2}],
+            'binary': Binary(b'x', 5), 'oid': ObjectId(), 'bool': False, 'date': datetime(2020, 1, 1), 'null': None,
+            'regex': Regex('^a', 'i'), 'code': Code('f()'), 'scope': Code('g()', {'x': 1}), 'int32': 1,
+            'timestamp': Timestamp(1, 2), 'int64': Int64(2 ** 40), 'decimal': Decimal128('1.1'),
+            'min': MinKey(), 'max': MaxKey(), 'bytes': b'abc',
+        }
+        lazy = make_lazy(doc)
+        assert lazy.to_dict() == doc
+        assert list(lazy) == list(doc)
+
+    def test_mutation(self, doc):
+        lazy = make_lazy(doc)
+        lazy['title'] = 'world'
+        del lazy['tags']
+        assert lazy['title'] == 'world'
+        assert 'tags' not in lazy
+
+    def test_to_dict(self, doc):
+        lazy = make_lazy(doc)
+        _ = lazy['data'], lazy['user']
+        rv = lazy.to_dict()
+        assert rv == doc
+        assert type(rv['data']) is bytes
+        assert type(rv['user']) is dict
+        assert bson.decode(bson.encode(rv)) == doc
+
+
+class TestLazyModel:
+    def test_field_access(self, doc):
+        post = Post.from_document(make_lazy(doc))
+        assert post.pk == doc['_id']
+        assert post.title == 'hello'
+        assert post.user.name == 'foo'
+        assert post.comments[0].name == 'bar'
+        assert bytes(post.data) == b'\x00abc'
+
+    def test_to_dict(self, doc):
+        post = Post.from_document(make_lazy(doc))
+        post.user.name = 'bar'
+        post.title = 'world'
+        rv = post.to_dict()
+        assert type(rv['data']) is bytes
+        assert rv['user']['name'] == 'bar'
+        assert rv['title'] == 'world'
+        assert post._combine_tracked_fields()[0] == {'title', 'user.name'}
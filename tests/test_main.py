@@ -0,0 +1,147 @@
+from datetime import datetime
+from unittest import mock
+
+import bson
+import pytest
+from bson import ObjectId, json_util
+from pymongo import MongoClient
+
+from monom import EmbeddedModel, Model
+from monom.fields import *
+from monom.__main__ import load_model, main
+from monom.mongo import Cursor
+
+
+class Dimensions(EmbeddedModel):
+    width: int
+    height: int
+
+
+class Shipment(Model):
+    auto_build_index = False
+    warn_extra_data = False
+
+    code = StringField(required=True, max_length=8)
+    weight = FloatField()
+    sent = DateTimeField()
+    size = EmbeddedField(Dimensions)
+
+
+def make_docs(n):
+    return [
+        {'_id': ObjectId(), 'code': 'S{}'.format(i), 'weight': i / 2, 'sent': datetime(2020, 1, 1, i % 24),
+         'size': {'width': i, 'height': 2 * i}}
+        for i in range(n)
+    ]
+
+
+def bind(db):
+    Shipment.set_db(db)
+    Shipment._collection = None
+
+
+@pytest.fixture
+def offline():
+    bind(MongoClient(connect=False).get_database('monom-test'))
+    yield
+    bind(None)
+
+
+def test_load_model():
+    with pytest.raises(ValueError, match='module:name'):
+        load_model(__name__, 'mongodb://localhost:27017')
+    with pytest.raises(ValueError, match='not a model'):
+        load_model(__name__ + ':Dimensions', 'mongodb://localhost:27017')
+    with pytest.raises(ValueError, match='--db'):
+        load_model(__name__ + ':Shipment', 'mongodb://localhost:27017')
+
+    assert load_model(__name__ + ':Shipment', 'mongodb://localhost:27017', 'monom-test') is Shipment
+    assert Shipment.get_db().name == 'monom-test'
+    bind(None)
+
+
+def test_cli_errors(capsys):
+    assert main(['export', 'no_such_module:Shipment']) == 1
+    assert main(['import', __name__ + ':Missing', '--db', 'monom-test']) == 1
+    assert "no attribute 'Missing'" in capsys.readouterr().err
+
+
+def test_export_ndjson(offline, tmp_path, capsys):
+    docs = make_docs(5)
+    output = tmp_path / 'shipments.ndjson'
+    with mock.patch.object(Cursor, '_next_batch', side_effect=[docs[:3], docs[3:], []]):
+        assert main(['export', __name__ + ':Shipment', '-o', str(output), '--batch-size', '3']) == 0
+
+    lines = output.read_bytes().splitlines()
+    assert [json_util.loads(line) for line in lines] == docs
+    assert 'Exported 5 documents of Shipment' in capsys.readouterr().err
+    # the collection is not set, which would build the indexes
+    assert Shipment.__dict__.get('_collection') is None
+
+
+def test_import_ndjson(offline, tmp_path, capsys):
+    docs = make_docs(5)
+    docs[2]['code'] = 'too long a code'
+    source = tmp_path / 'shipments.ndjson'
+    source.write_text('\n'.join(json_util.dumps(doc) for doc in docs) + '\n\n')
+
+    inserted = []
+    collection = type(Shipment.get_collection())
+    with mock.patch.object(collection, 'insert_many',
+                           side_effect=lambda chunk, **kw: inserted.append((chunk, kw)) or mock.Mock(
+                               inserted_ids=[doc['_id'] for doc in chunk])):
+        assert main(['import', __name__ + ':Shipment', '-i', str(source), '--chunk-size', '2']) == 1
+
+    assert [len(chunk) for chunk, _ in inserted] == [2, 1, 1]
+    assert all(kw['ordered'] is False for _, kw in inserted)
+    assert [doc for chunk, _ in inserted for doc in chunk] == docs[:2] + docs[3:]
+    err = capsys.readouterr().err
+    assert 'Imported 4 documents of Shipment' in err
+    assert "Line 3: Document #2, field 'code'" in err
+
+
+def test_import_bad_lines(offline, tmp_path, capsys):
+    docs = make_docs(4)
+    docs[1]['size'] = 5
+    lines = [json_util.dumps(doc) for doc in docs]
+    lines.insert(2, '{"code": "S9",')
+    lines.insert(1, '')
+    source = tmp_path / 'shipments.ndjson'
+    source.write_text('\n'.join(lines) + '\n')
+
+    inserted = []
+    collection = type(Shipment.get_collection())
+    with mock.patch.object(collection, 'insert_many',
+                           side_effect=lambda chunk, **kw: inserted.extend(chunk) or mock.Mock(
+                               inserted_ids=[doc['_id'] for doc in chunk])):
+        assert main(['import', __name__ + ':Shipment', '-i', str(source), '--chunk-size', '2']) == 1
+
+    assert inserted == [docs[0], docs[2], docs[3]]
+    err = capsys.readouterr().err.splitlines()
+    assert 'Imported 3 documents of Shipment' in err[0]
+    assert err[1].startswith("Line 3: Document #1, field 'size': 5 must be a dict-like object")
+    assert err[2].startswith('Line 4: Expecting')
+
+
+class TestTransfer:
+    @pytest.mark.parametrize('fmt', ['ndjson', 'bsonl'])
+    def test_round_trip(self, db, tmp_path, fmt):
+        bind(db)
+        docs = make_docs(25)
+        Shipment.insert_many(docs)
+        path = str(tmp_path / 'shipments')
+
+        assert main(['export', __name__ + ':Shipment', '--format', fmt, '-o', path, '--batch-size', '10',
+                     '--filter', '{"weight": {"$gte": 5}}']) == 0
+        if fmt == 'bsonl':
+            with open(path, 'rb') as file:
+                assert len(list(bson.decode_file_iter(file))) == 15
+
+        Shipment.delete_many({})
+        assert main(['import', __name__ + ':Shipment', '--format', fmt, '-i', path, '--chunk-size', '4']) == 0
+        assert list(Shipment.get_collection().find(sort=[('_id', 1)])) == docs[10:]
+
+        # the documents exist already
+        assert main(['import', __name__ + ':Shipment', '--format', fmt, '-i', path]) == 1
+        assert Shipment.count_documents({}) == 15
+        bind(None)
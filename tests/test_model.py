@@ -429,6 +429,29 @@ class TestFieldAliases:
         assert obj.f2[1].f1 == 42
         assert obj.to_dict()['2f'][1]['1f'] == 42
 
+    def test_to_attributes(self):
+        class SubModel(EmbeddedModel):
+            f1: int
+
+            class Meta:
+                aliases = [('f1', '1f')]
+
+        class MainModel(BaseModel):
+            f1: int
+            f2: List[SubModel]
+            f3: SubModel
+
+            class Meta:
+                aliases = [('f1', '1f')]
+
+        plan = MainModel._get_plan()
+        doc = {'1f': 1, 'f2': [{'1f': 2}], 'f3': {'1f': 3}, 'extra': 4}
+        assert plan.to_attributes(doc) == {'f1': 1, 'f2': [{'f1': 2}], 'f3': {'f1': 3}, 'extra': 4}
+
+        doc = {'f': 1}
+        assert SubModel._get_plan().to_attributes(doc) == {'f': 1}
+        assert MainModel.f3.model._get_plan().renames == {'1f': ('f1', None)}
+
 
 class TestFieldRequired:
     def test_field_in_model(self):
@@ -806,6 +829,193 @@ def test_model_disable_extra_data_warning(caplog):
     assert len(caplog.records) == 0
 
 
+class TestModelPlan:
+    def test_plan_cached(self):
+        class SubModel(EmbeddedModel):
+            f: int
+
+        class MainModel(BaseModel):
+            f1: int
+            f2: SubModel
+
+        plan = MainModel._get_plan()
+        MainModel(f1=1, f2={'f': 2})
+        assert MainModel._get_plan() is plan
+        assert list(plan.fields) == ['f1', 'f2']
+        assert plan.names == {'f1', 'f2'}
+        assert MainModel.f2.fields is SubModel._get_plan().fields
+
+    def test_plan_invalidated_by_options(self):
+        class MainModel(BaseModel):
+            f: int
+
+        plan = MainModel._get_plan()
+        MainModel.warn_extra_data = False
+        assert MainModel._get_plan() is not plan
+
+        plan = MainModel._get_plan()
+        MainModel._collection = None
+        assert MainModel._get_plan() is plan
+
+    def test_plan_invalidated_by_meta(self):
+        class MainModel(BaseModel):
+            f1: int
+            f2: int
+
+        MainModel(f2=1)
+
+        class Meta:
+            required = ['f1']
+            aliases = [('f2', '2f')]
+
+        MainModel.Meta = Meta
+        assert MainModel._get_plan().names == {'f1', '2f'}
+        with pytest.raises(ValidationError):
+            MainModel(f2=1)
+
+
+class TestFieldClean:
+    @staticmethod
+    def make_model():
+        class SubModel(EmbeddedModel):
+            f1: int = 13
+            f2 = StringField(max_length=3)
+
+        class MainModel(BaseModel):
+            f1: List[SubModel]
+            f2: List[List[int]]
+            f3: SubModel
+
+            class Meta:
+                required = ['f3']
+
+        return MainModel
+
+    def test_same_as_two_phase(self):
+        root = self.make_model()._get_plan().root
+        data = {'f1': [{'f2': 'a'}, {'f1': 1}], 'f2': [[1, 2], (3,)], 'f3': {}, 'f4': 'foo'}
+
+        converted = root.convert(data)
+        root.validate(converted)
+        assert root.clean(data) == converted
+
+    def test_same_errors(self):
+        root = self.make_model()._get_plan().root
+
+        for data in [{'f3': {'f2': 'abcd'}}, {'f1': [{'f1': 'a'}], 'f3': {}}, {'f1': [{}]}, {'f2': [['a']], 'f3': {}}]:
+            with pytest.raises(ValidationError) as err1:
+                root.validate(root.convert(data))
+            with pytest.raises(ValidationError) as err2:
+                root.clean(data)
+            assert err1.value.msg == err2.value.msg
+
+        with pytest.raises(ValueError):
+            root.clean({'f1': 'abc', 'f3': {}})
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    def test_alias_keys(self, compiled):
+        class MainModel(BaseModel):
+            f1: str
+            f2: int
+
+            class Meta:
+                aliases = [('f2', '2f')]
+                required = ['f2']
+
+        MainModel.compiled = compiled
+        # items keyed by aliases are validated as their fields
+        with pytest.raises(ValidationError):
+            MainModel._get_clean_data({'2f': 'x'})
+        assert MainModel._get_clean_data({'f1': 'a', '2f': 1}) == {'f1': 'a', '2f': 1}
+        assert MainModel._get_clean_data({'f2': 1}) == {'2f': 1}
+
+    @pytest.mark.parametrize('compiled', [False, True])
+    def test_setter_fills_required_field(self, compiled):
+        class User(BaseModel):
+            name: str
+            pw_hash = StringField(required=True, max_length=3)
+
+            @property
+            def password(self):
+                raise AttributeError('write only')
+
+            @password.setter
+            def password(self, value):
+                self.pw_hash = value.upper()
+
+        User.compiled = compiled
+        assert User(name='a', password='x').pw_hash == 'X'
+        with pytest.raises(ValidationError):
+            User(name='a')
+        # the values set by setters are validated too
+        with pytest.raises(ValidationError):
+            User(name='a', password='long')
+
+
+class TestCompiledModel:
+    def test_convert(self):
+        class SubModel(EmbeddedModel):
+            f1: int = 13
+            f2: List[int]
+
+        class MainModel(BaseModel):
+            f1: str = 'foo'
+            f2: datetime = datetime.utcnow
+            f3: SubModel
+            f4: List[SubModel]
+            f5: List[str]
+
+            class Meta:
+                aliases = [('f1', '1f')]
+                converters = {'f5': lambda x: [str(i) for i in x]}
+
+        MainModel.compiled = True
+        SubModel.compiled = True
+
+        obj = MainModel(f3={'f2': (1, 2)}, f4=[{'f1': 42}], f5=[1, 2], f6=1)
+        assert obj.to_dict()['1f'] == 'foo'
+        assert isinstance(obj.f2, datetime)
+        assert obj.f3.f1 == 13 and obj.f3.f2 == [1, 2]
+        assert obj.f4[0].f1 == 42
+        assert obj.f5 == ['1', '2']
+        assert obj.to_dict()['f6'] == 1
+
+        with pytest.raises(ValueError):
+            MainModel(f3={'f2': 1})
+
+    def test_validate(self):
+        class MainModel(BaseModel):
+            f1 = StringField(max_length=3, required=True)
+            f2 = IntField(min_value=0, validator=lambda x: x % 2 == 0)
+            f3: List[int]
+
+        MainModel.compiled = True
+
+        MainModel(f1='foo', f2=2, f3=[1, 2])
+        with pytest.raises(ValidationError) as err:
+            MainModel(f2=2)
+        assert 'missing' in err.value.msg
+        with pytest.raises(ValidationError) as err:
+            MainModel(f1='foobar')
+        assert 'greater than' in err.value.msg
+        with pytest.raises(ValidationError) as err:
+            MainModel(f1='foo', f2=-2)
+        assert 'less than' in err.value.msg
+        with pytest.raises(ValidationError) as err:
+            MainModel(f1='foo', f2=1)
+        assert 'not accepted' in err.value.msg
+        with pytest.raises(ValidationError):
+            MainModel(f1='foo', f3=[1, 'a'])
+
+    def test_extra_data_warning(self, caplog):
+        class MainModel(BaseModel):
+            f: int
+
+        MainModel.compiled = True
+        MainModel(f=1, f1=2)
+        assert 'not defined' in caplog.records[0].message
+
+
 def test_model_mix_type_hint_with_django_style_warning(caplog):
     class MainModel(BaseModel):
         f1: str
@@ -818,3 +1028,115 @@ def test_model_mix_type_hint_with_django_style_warning(caplog):
 
 if __name__ == '__main__':
     pytest.main()
+
+
+class TestCompactModel:
+    def test_slots(self):
+        class SubModel(EmbeddedModel):
+            compact = True
+            f1: str
+
+        class MainModel(BaseModel):
+            compact = True
+            f1: str
+            f2: SubModel
+
+        obj = MainModel(f1='foo', f2={'f1': 'bar'})
+        assert not hasattr(obj, '__dict__')
+        assert not hasattr(obj.f2, '__dict__')
+        assert obj._modified_fields is None and obj._deleted_fields is None
+
+        with pytest.raises(AttributeError):
+            obj.foo = 'bar'
+
+    def test_slots_inherited(self):
+        class MainModel(BaseModel):
+            compact = True
+            f1: str
+
+        class SubClass(MainModel):
+            f2: str
+
+        assert SubClass.__slots__ == ()
+        assert not hasattr(SubClass(f2='foo'), '__dict__')
+
+    def test_lazy_lists(self):
+        class SubModel(EmbeddedModel):
+            compact = True
+            f1: str
+
+        class MainModel(BaseModel):
+            compact = True
+            f1: str
+            f2: SubModel
+
+        class SubClass(MainModel):
+            f3: List[str]
+
+        assert SubClass.__slots__ == ()
+        obj = SubClass(f1='foo', f2={'f1': 'bar'}, f3=['a'])
+        # the wrappers and tracked fields are kept in lists allocated on first use
+        assert obj._wrapped is None and obj._extra is None
+        assert obj.f2 is obj.f2 and obj.f3 is obj.f3
+        assert not isinstance(obj._wrappers, dict) and len(obj._wrapped) == 2
+        assert dict(obj._wrappers.items()) == {'f2': obj.f2, 'f3': obj.f3}
+
+        obj.f2.f1 = 'baz'
+        obj.f3.append('b')
+        assert obj._combine_tracked_fields()[0] == {'f2.f1'}
+        assert obj._combine_tracked_containers() == {'$push': {'f3': {'$each': ['b']}}}
+
+        assert obj._extra is None
+        obj.f3 = ['c']
+        assert obj._modified_fields == {'f3'} and obj._deleted_fields == set()
+
+        del obj.f2
+        assert 'f2' not in obj._wrappers
+
+    def test_dict_class(self):
+        class MainModel(BaseModel):
+            compact = True
+            f1: str
+
+        class SONModel(BaseModel):
+            compact = True
+            dict_class = SON
+            f1: str
+
+        assert type(MainModel(f1='foo').to_dict()) is dict
+        assert type(SONModel(f1='foo').to_dict()) is SON
+
+    def test_embedded_model_instance(self):
+        class SubModel(EmbeddedModel):
+            compact = True
+            f1: str
+
+        class MainModel(BaseModel):
+            compact = True
+            f2: SubModel
+            f3: List[SubModel]
+
+        obj = MainModel(f2=SubModel(f1='foo'), f3=[SubModel(f1='bar')])
+        assert obj.to_dict() == {'f2': {'f1': 'foo'}, 'f3': [{'f1': 'bar'}]}
+        assert obj.f3[0].f1 == 'bar'
+
+    def test_track_fields(self):
+        class SubModel(EmbeddedModel):
+            compact = True
+            f1: str
+
+        class MainModel(BaseModel):
+            compact = True
+            f1: str
+            f2: SubModel
+
+        obj = MainModel(f1='foo', f2={'f1': 'bar'})
+        obj.f1 = 'foo1'
+        obj.f2.f1 = 'bar1'
+        assert obj._combine_tracked_fields()[0] == {'f1', 'f2.f1'}
+
+        del obj.f2
+        assert obj._combine_tracked_fields() == ({'f1'}, {'f2'})
+
+        obj._clear_tracked_fields()
+        assert obj._combine_tracked_fields() == (set(), set())
@@ -1,11 +1,18 @@
+from collections import deque
+from unittest import mock
+
 import pytest
 from pymongo.collection import ReturnDocument
 from pymongo.command_cursor import CommandCursor
-from pymongo.results import DeleteResult, UpdateResult
+from pymongo.errors import BulkWriteError
+from pymongo.results import DeleteResult, InsertManyResult, UpdateResult
+from bson.codec_options import CodecOptions
 
 from monom import *
 from monom.fields import *
-from monom.mongo import Cursor
+from monom.mongo import AggregateCursor, ConflictError, Cursor, _SaveGroup
+from monom.batch import SaveError, SaveResult
+from monom.projection import ProjectionProfiler
 from monom.utils import random_lower_letters
 
 
@@ -163,6 +170,288 @@ class TestDelete:
             post.delete()
 
 
+class TestSaveMultiple:
+    def test_writes(self):
+        post = Post(title='hello')
+        assert post._get_write()[0] == 'insert'
+
+        post = Post(_id=ObjectId(), title='hello')
+        assert post._get_write()[0] == 'insert'
+        assert post._get_write(upsert=True)[0] == 'replace'
+
+        post = Post.from_document({'_id': ObjectId(), 'title': 'hello'})
+        assert post._get_write() == ('none', None)
+        assert post._get_write(full_update=True)[0] == 'replace'
+        post.title = 'hello earth'
+        operation, request = post._get_write()
+        assert operation == 'update'
+        assert request._doc == {'$set': {'title': 'hello earth'}}
+
+        post.mark_for_deletion()
+        assert post._get_write()[0] == 'delete'
+
+    def test_full_update_with_projection(self):
+        pk = ObjectId()
+        post = Post._get_loaded_model({'_id': pk, 'title': 'hello'}, {'title': True}, None)
+        post.title = 'hello earth'
+        operation, request = post._get_write(full_update=True)
+        assert operation == 'update'
+        assert request._filter == {'_id': pk}
+        assert request._doc == {'$set': {'_id': pk, 'title': 'hello earth'}}
+
+    def test_mark_for_deletion(self):
+        with pytest.raises(RuntimeError):
+            Post(title='hello').mark_for_deletion()
+
+        post = Post.from_document({'title': 'hello'})
+        post.mark_for_deletion()
+        with pytest.raises(RuntimeError):
+            post._get_write()
+
+    def test_save_multiple(self, db):
+        Post.set_db(db)
+        old = Post(title='old').save()
+        changed = Post(title='changed').save()
+        changed.title = 'changed again'
+        old.mark_for_deletion()
+        new = Post(title='new')
+
+        result = Post.save_multiple([old, changed, new])
+        assert [outcome.operation for outcome in result.outcomes] == ['delete', 'update', 'insert']
+        assert [outcome.status for outcome in result.outcomes] == ['ok'] * 3
+        assert (result.inserted_count, result.modified_count, result.deleted_count) == (1, 1, 1)
+        assert old._state == 'deleted'
+        assert new._state == 'after_save'
+        assert sorted(post.title for post in Post.find()) == ['changed again', 'new']
+
+    def test_save_multiple_full_update_with_projection(self, db):
+        Post.set_db(db)
+        pk = Post(title='hello', content='world', tags=['a']).save().pk
+        post = Post.find_one({'_id': pk}, {'title': True})
+        post.title = 'hello earth'
+        result = Post.save_multiple([post], full_update=True)
+        assert result.outcomes[0].operation == 'update'
+        doc = Post.get_collection().find_one({'_id': pk})
+        assert (doc['title'], doc['content'], doc['tags']) == ('hello earth', 'world', ['a'])
+
+    def test_save_multiple_upsert(self, db):
+        Post.set_db(db)
+        post = Post(_id=ObjectId(), title='hello')
+        result = Post.save_multiple([post], upsert=True)
+        assert result.outcomes[0].operation == 'replace'
+        assert result.upserted_count == 1
+        assert Post.find_one({'_id': post.pk}).title == 'hello'
+
+    def test_save_multiple_errors(self, db):
+        Post.set_db(db)
+        pk = ObjectId()
+        Post(_id=pk, title='hello').save()
+        posts = [Post(title='a'), Post(_id=pk, title='duplicate'), Post(title='b')]
+
+        result = Post.save_multiple(posts, chunk_size=2, raise_on_error=False)
+        assert [outcome.status for outcome in result.outcomes] == ['ok', 'failed', 'skipped']
+        assert result.errors[0].obj is posts[1]
+        assert posts[2]._state == 'before_save'
+
+        posts = [Post(title='a'), Post(_id=pk, title='duplicate'), Post(title='b')]
+        result = Post.save_multiple(posts, ordered=False, chunk_size=2, raise_on_error=False)
+        assert [outcome.status for outcome in result.outcomes] == ['ok', 'failed', 'ok']
+        assert result.inserted_count == 2
+
+        posts = [Post(title='a'), Post(_id=pk, title='duplicate')]
+        with pytest.raises(BulkWriteError) as err:
+            Post.save_multiple(posts)
+        assert [error['index'] for error in err.value.details['writeErrors']] == [1]
+        assert err.value.result.inserted_count == 1
+        assert posts[0]._state == 'after_save'
+
+    def test_save_multiple_raise_on_error(self):
+        collection = mock.MagicMock()
+        collection.bulk_write.side_effect = BulkWriteError({
+            'nInserted': 1, 'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]
+        })
+        posts = [Post(title='a'), Post(title='b'), Post(title='c')]
+
+        with mock.patch.object(Post, 'get_collection', return_value=collection):
+            with pytest.raises(SaveError) as err:
+                Post.save_multiple(posts)
+        assert err.value.details['writeErrors'] == [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]
+        assert [outcome.status for outcome in err.value.result.outcomes] == ['ok', 'failed', 'skipped']
+        assert [post._state for post in posts] == ['after_save', 'before_save', 'before_save']
+
+    def test_save_multiple_collection_raises(self):
+        class Note(Model):
+            auto_build_index = False
+            text: str
+
+        posts, notes = mock.MagicMock(), mock.MagicMock()
+        posts.bulk_write.return_value.bulk_api_result = {'nInserted': 2}
+        notes.bulk_write.side_effect = ConnectionError
+
+        objs = [Post(title='hello'), Note(text='hi'), Post(title='world')]
+        with mock.patch.object(Post, 'get_collection', return_value=posts), \
+                mock.patch.object(Note, 'get_collection', return_value=notes):
+            with pytest.raises(ConnectionError):
+                Post.save_multiple(objs)
+        # the posts written are not inserted again by a retry
+        assert [obj._state for obj in objs] == ['after_save', 'before_save', 'after_save']
+
+    def test_save_multiple_collections(self, db):
+        class Note(Model):
+            text: str
+
+        Post.set_db(db)
+        Note.set_db(db)
+        result = Post.save_multiple([Post(title='hello'), Note(text='hi'), Post(title='world')])
+        assert result.inserted_count == 3
+        assert Post.count_documents({}) == 2
+        assert Note.count_documents({}) == 1
+
+class Account(Model):
+    auto_build_index = False
+
+    owner: str
+    balance: int = 0
+    version: int
+
+    class Meta:
+        version_field = 'version'
+
+
+class TestVersion:
+    def test_meta(self):
+        with pytest.raises(ValueError):
+            class Invalid(Model):
+                name: str
+
+                class Meta:
+                    version_field = 'missing'
+
+        assert Account._get_plan().version == 'version'
+        assert Post._get_plan().version is None
+
+    def test_writes(self):
+        account = Account(owner='foo')
+        assert account._get_write()[0] == 'insert'
+        assert account.version == 0
+
+        account = Account.from_document({'_id': 1, 'owner': 'foo', 'balance': 0, 'version': 3})
+        account.balance = 5
+        operation, request = account._get_write()
+        assert request._filter == {'_id': 1, 'version': 3}
+        assert request._doc == {'$set': {'balance': 5}, '$inc': {'version': 1}}
+        assert account._version_update({'$set': {'version': 9}}) == {'$inc': {'version': 1}}
+
+        operation, request = account._get_write(full_update=True)
+        assert operation == 'replace' and request._doc['version'] == 4
+
+        account.mark_for_deletion()
+        assert account._get_write()[1]._filter == {'_id': 1, 'version': 3}
+
+        # loaded before the version field was declared
+        account = Account.from_document({'_id': 1, 'owner': 'foo'})
+        account.balance = 1
+        assert account._get_write()[1]._filter == {'_id': 1, 'version': None}
+        account._after_write('update')
+        assert account.version == 1
+
+    def test_save(self):
+        collection = mock.MagicMock()
+        collection.find_one.return_value = {'_id': 1, 'owner': 'foo', 'balance': 10, 'version': 4}
+        collection.update_one.side_effect = [UpdateResult({'n': 0}, True), UpdateResult({'n': 1}, True)]
+
+        def deposit(obj):
+            obj.balance += 5
+
+        with mock.patch.object(Account, 'get_collection', return_value=collection):
+            account = Account.from_document({'_id': 1, 'owner': 'foo', 'balance': 0, 'version': 3})
+            deposit(account)
+            account.save(on_conflict=deposit)
+
+            assert [c.args for c in collection.update_one.call_args_list] == [
+                ({'_id': 1, 'version': 3}, {'$set': {'balance': 5}, '$inc': {'version': 1}}),
+                ({'_id': 1, 'version': 4}, {'$set': {'balance': 15}, '$inc': {'version': 1}}),
+            ]
+            assert (account.balance, account.version) == (15, 5)
+            assert not account._is_dirty()
+
+            collection.update_one.side_effect = None
+            collection.update_one.return_value = UpdateResult({'n': 0}, True)
+            account.balance = 0
+            with pytest.raises(ConflictError) as err:
+                account.save(on_conflict=deposit, max_retries=1)
+            assert err.value.obj is account and collection.update_one.call_count == 4
+
+            collection.delete_one.return_value = DeleteResult({'n': 0}, True)
+            with pytest.raises(ConflictError):
+                account.delete()
+            assert account._state != 'deleted'
+
+    def test_conflicts(self):
+        accounts = [Account.from_document({'_id': i, 'owner': 'foo', 'version': 1}) for i in range(3)]
+        result = SaveResult(3)
+        group = _SaveGroup(result, ordered=True)
+        requests = [(i, account, 'update', None) for i, account in enumerate(accounts)]
+        query = group.record(requests, {'nMatched': 1})
+        assert (group.missed, len(group.suspects)) == (2, 3)
+        assert query == ({'_id': {'$in': [0, 1, 2]}}, {'version': True})
+
+        # the changed and the deleted documents explain the documents missed
+        group.record_conflicts([{'_id': 0, 'version': 5}, {'_id': 2, 'version': 2}])
+        assert [outcome.status for outcome in result.outcomes] == ['conflict', 'conflict', 'ok']
+        assert len(result.conflicts) == 2 and not result.errors
+
+        # one of the first two was written by another writer from the same version
+        result = SaveResult(3)
+        group = _SaveGroup(result, ordered=True)
+        group.record(requests, {'nMatched': 1})
+        group.record_conflicts([{'_id': 0, 'version': 2}, {'_id': 1, 'version': 2}, {'_id': 2, 'version': 5}])
+        assert [outcome.status for outcome in result.outcomes] == ['conflict', 'conflict', 'conflict']
+
+    def test_projections_load_version(self):
+        collection = mock.MagicMock()
+        collection.find_one.return_value = {'_id': 1, 'balance': 5, 'version': 3}
+        with mock.patch.object(Account, 'get_collection', return_value=collection):
+            account = Account.find_one({'_id': 1}, {'balance': True})
+            assert collection.find_one.call_args.args[1] == {'balance': True, 'version': True}
+            assert account.loaded_fields == {'_id', 'balance', 'version'}
+            account.balance = 10
+            assert account._get_write()[1]._filter == {'_id': 1, 'version': 3}
+
+            assert Account.find({}, ['balance']).loaded == {'_id', 'balance', 'version'}
+            assert Account.find({}, {'version': False}).loaded is None
+
+    def test_no_upsert(self):
+        account = Account(_id=1, owner='foo')
+        assert account._get_write(upsert=True)[0] == 'insert'
+
+        account = Account.from_document({'_id': 1, 'owner': 'foo', 'version': 3})
+        account.balance = 5
+        assert account._get_write(upsert=True)[1]._upsert is False
+        assert account._get_write(full_update=True, upsert=True)[1]._upsert is False
+
+    def test_concurrent_writers(self, db):
+        Account.set_db(db)
+        account = Account(owner='foo').save()
+        mine, theirs = Account.get(account.pk), Account.get(account.pk)
+
+        theirs.balance = 10
+        theirs.save()
+        mine.balance = 20
+        with pytest.raises(ConflictError):
+            mine.save()
+
+        mine.save(on_conflict=lambda obj: setattr(obj, 'balance', obj.balance + 20))
+        assert Account.get(account.pk).to_dict() == {'_id': account.pk, 'owner': 'foo', 'balance': 30, 'version': 2}
+
+        theirs.mark_for_deletion()
+        mine.balance = 0
+        result = Account.save_multiple([mine, theirs])
+        assert [outcome.status for outcome in result.outcomes] == ['ok', 'conflict']
+        with pytest.raises(ConflictError):
+            theirs.delete()
+
+
 class TestIndexes:
     def test_basic_indexes(self, db):
         class MainModel(Model):
@@ -362,6 +651,54 @@ class TestParseDotNotation:
             assert 'not defined' in record.message
 
 
+class TestCleanUpdate:
+    def test_dot_notation_cached(self):
+        plan = MainDotNotationModel._get_plan()
+        field = MainDotNotationModel._parse_dot_notation('f3.0.f2.1')
+        assert isinstance(field, IntField)
+        assert plan.dot_notations.get('f3.0.f2.1') == (field, None)
+        assert MainDotNotationModel._parse_dot_notation('f3.0.f2.1') is field
+
+    def test_undefined_field_warned_each_time(self, caplog):
+        for _ in range(2):
+            Post._get_clean_update({'$set': {'user.nickname': 'foo'}, '$unset': {'user.alias': ''}})
+        messages = [record.message for record in caplog.records if 'not defined' in record.message]
+        assert len(messages) == 4
+        assert "'nickname'" in messages[0] and "'alias'" in messages[1]
+
+    def test_update_plan_cached(self):
+        plan = Post._get_plan()
+        update = Post._get_clean_update({'$set': {'user': {'first_name': 'foo'}}})
+        assert update['$set']['user']['motto'] == 'come on'
+        assert (('$set', ('user',)),) in plan.updates
+
+        update = Post._get_clean_update({'$set': {'user': {'first_name': 'bar'}}})
+        assert update['$set']['user']['first_name'] == 'bar'
+        assert update['$set']['user']['motto'] == 'come on'
+
+    def test_push(self):
+        update = Post._get_clean_update({'$push': {'comments': {'$each': [{'content': 'foo'}]}, 'tags': 'bar'}})
+        assert isinstance(update['$push']['comments']['$each'][0]['created_on'], datetime)
+        assert update['$push']['tags'] == 'bar'
+
+        update = Post._get_clean_update({'$push': {'comments': {'content': 'foo'}}})
+        assert update['$push']['comments']['extra'] == 42
+
+        with pytest.raises(ValidationError):
+            Post._get_clean_update({'$push': {'tags': 42}})
+        with pytest.raises(ValidationError):
+            Post._get_clean_update({'$push': {'title': 'foo'}})
+
+    def test_validation(self):
+        with pytest.raises(ValidationError):
+            Post._get_clean_update({'$set': {'title': 42}})
+        with pytest.raises(ValidationError):
+            Post._get_clean_update({'$inc': {'title': 1}})
+
+        update = Post._get_clean_update({'$set': {'title': 42}}, bypass_validation=True)
+        assert update['$set']['title'] == 42
+
+
 class TestInsert:
     def test_insert_one(self, db):
         Post.set_db(db)
@@ -407,6 +744,62 @@ class TestInsert:
                 {'user': {'first_name': 42, 'last_name': 'Bax'}, 'title': 'hello earth'},
             ])
 
+    def test_insert_stream(self, db):
+        Post.set_db(db)
+
+        def documents(count):
+            for i in range(count):
+                yield {'user': {'first_name': 'Foo', 'last_name': 'Bar'}, 'title': 'hello ' + str(i)}
+
+        rv = Post.insert_stream(documents(25), chunk_size=10)
+        assert rv.inserted_count == 25
+        assert rv.chunk_count == 3
+        assert rv.errors == []
+
+        rv = Post.insert_stream(documents(25), chunk_size=100, max_bytes=1000)
+        assert rv.inserted_count == 25
+        assert rv.chunk_count > 1
+
+    def test_insert_stream_with_errors(self, db):
+        Post.set_db(db)
+
+        def documents():
+            for i in range(25):
+                title = 42 if i in (5, 15) else 'hello'
+                yield {'user': {'first_name': 'Foo', 'last_name': 'Bar'}, 'title': title}
+
+        rv = Post.insert_stream(documents(), chunk_size=10)
+        assert rv.inserted_count == 5
+        assert [(err.chunk, err.error.index) for err in rv.errors] == [(0, 5)]
+
+        rv = Post.insert_stream(documents(), chunk_size=10, ordered=False)
+        assert rv.inserted_count == 23
+        assert [(err.chunk, err.error.index) for err in rv.errors] == [(0, 5), (1, 15)]
+
+    def test_insert_stream_with_conversion_errors(self):
+        collection = mock.MagicMock()
+        collection.codec_options = CodecOptions()
+        collection.insert_many.side_effect = lambda docs, **kw: InsertManyResult([None] * len(docs), True)
+
+        def documents():
+            for i in range(10):
+                tags = 5 if i in (3, 7) else ['a']
+                title = 42 if i == 5 else 'hello'
+                yield {'title': title, 'tags': tags}
+
+        with mock.patch.object(Post, 'get_collection', return_value=collection):
+            rv = Post.insert_stream(documents(), chunk_size=4)
+            assert rv.inserted_count == 3
+            assert [(err.chunk, err.error.index, err.error.field) for err in rv.errors] == [(0, 3, 'tags')]
+
+            collection.insert_many.reset_mock()
+            rv = Post.insert_stream(documents(), chunk_size=4, ordered=False)
+            assert rv.inserted_count == 7
+            assert [(err.chunk, err.error.index, err.error.field) for err in rv.errors] == [
+                (0, 3, 'tags'), (1, 5, 'title'), (1, 7, 'tags')
+            ]
+            assert [len(c.args[0]) for c in collection.insert_many.call_args_list] == [4, 3]
+
     def test_insert_many_bypass_validation(self, db):
         Post.set_db(db)
 
@@ -448,6 +841,84 @@ class TestQuery:
         rv = Post.find({'user.last_name': 'bar'})
         assert isinstance(next(rv), Post)
 
+    def test_find_lazy(self, db_populated):
+        Post.set_db(db_populated)
+
+        rv = Post.find({'user.first_name': 'foo42'}, lazy=True)
+        post = next(rv)
+        assert isinstance(post.to_dict(), dict)
+        assert post.user.first_name == 'foo42'
+
+        post.title = 'lazy'
+        post.save()
+        assert Post.find_one({'_id': post.pk}).title == 'lazy'
+
+    def test_find_with_projection(self, db_populated):
+        Post.set_db(db_populated)
+
+        post = next(Post.find({}, ['title']))
+        assert post.loaded_fields == {'_id', 'title'}
+        with pytest.raises(AttributeError, match='was not loaded'):
+            _ = post.content
+
+        post = Post.find_one({}, {'content': False})
+        assert 'content' not in post.loaded_fields
+        assert Post.find_one().loaded_fields is None
+
+    def test_find_with_projection_profiler(self, db_populated):
+        Post.set_db(db_populated)
+        Post.projection_profiler = ProjectionProfiler(window=5, apply=True)
+
+        def query():
+            return list(Post.find().limit(5))
+
+        try:
+            for post in query():
+                _ = post.title
+
+            post = query()[0]
+            assert post.loaded_fields == {'_id', 'title'}
+            # fetched on demand
+            assert len(post.content) == 30
+            assert list(Post.projection_profiler.suggestions().values()) == [
+                {'_id': True, 'title': True, 'content': True}
+            ]
+        finally:
+            Post.projection_profiler = None
+
+    def test_batches(self, db_populated):
+        Post.set_db(db_populated)
+
+        batches = list(Post.find().batches(30))
+        assert [len(batch) for batch in batches] == [30, 30, 30, 10]
+        assert all(isinstance(post, Post) for post in batches[-1])
+
+    def test_to_list(self, db_populated):
+        Post.set_db(db_populated)
+
+        cursor = Post.find().batch_size(30)
+        assert len(cursor.to_list(45)) == 45
+        assert isinstance(next(cursor), Post)
+        assert len(cursor.to_list()) == 54
+        assert cursor.to_list() == []
+
+    def test_raw(self, db_populated):
+        class AliasedPost(Model):
+            title: str
+            user: User
+
+            class Meta:
+                aliases = [('title', 't')]
+
+        AliasedPost.set_db(db_populated)
+        AliasedPost.set_collection('posts')
+        db_populated.get_collection('posts').update_many({}, {'$rename': {'title': 't'}})
+
+        doc = next(AliasedPost.find().raw())
+        assert type(doc) is dict
+        assert 'title' in doc and 't' not in doc
+        assert doc['user']['last_name'] == 'bar'
+
     def test_find_without_result(self, db_populated):
         Post.set_db(db_populated)
 
@@ -681,6 +1152,65 @@ class TestAggregation:
         assert isinstance(rv, CommandCursor)
         assert next(rv)['user']['last_name'] == 'bar'
 
+    def test_aggregate_models(self, db_populated):
+        class Stat(EmbeddedModel):
+            last_name: str
+            count: int
+
+        Post.set_db(db_populated)
+
+        pipeline = [{'$group': {'_id': '$user.last_name', 'count': {'$sum': 1}}},
+                    {'$project': {'_id': 0, 'last_name': '$_id', 'count': 1}}]
+        stats = list(Post.aggregate_models(pipeline, as_=Stat, validate=True, allow_disk_use=True))
+        assert isinstance(stats[0], Stat)
+        assert (stats[0].last_name, stats[0].count) == ('bar', 100)
+
+        cursor = Post.aggregate_models([{'$sort': {'title': 1}}], batch_size=30)
+        assert [len(batch) for batch in cursor.batches()] == [30, 30, 30, 10]
+
+        with pytest.raises(ValidationError):
+            list(Post.aggregate_models([{'$project': {'count': {'$literal': 'x'}}}], as_=Stat, validate=True))
+
+    def test_aggregate_cursor(self):
+        class FakeCursor:
+            def __init__(self, docs):
+                self._data = deque(docs)
+                self.closed = False
+
+            def next(self):
+                if not self._data:
+                    raise StopIteration
+                return self._data.popleft()
+
+            __next__ = next
+
+            def close(self):
+                self.closed = True
+
+        class Stat(EmbeddedModel):
+            count: int
+
+        cursor = AggregateCursor(Stat, FakeCursor([{'count': i} for i in range(5)]), validate=True)
+        assert next(cursor).count == 0
+        assert [stat.count for stat in cursor.to_list(2)] == [1, 2]
+        assert [stat.count for batch in cursor.batches() for stat in batch] == [3, 4]
+        with cursor:
+            pass
+        assert cursor.closed
+
+        cursor = AggregateCursor(Post, FakeCursor([{'_id': 1, 'title': 1}]))
+        assert next(cursor).title == 1
+
+        cursor = AggregateCursor(Post, FakeCursor([{'_id': 1, 'title': 1}]), validate=True)
+        with pytest.raises(ValidationError):
+            next(cursor)
+
+        # every document is validated, not only the first one
+        cursor = AggregateCursor(Post, FakeCursor([{'_id': 1, 'title': 'a'}, {'_id': 2, 'title': 2}]), validate=True)
+        with pytest.raises(ValidationError) as err:
+            cursor.to_list()
+        assert err.value.index == 1
+
     def test_estimated_document_count(self, db_populated):
         Post.set_db(db_populated)
 
@@ -0,0 +1,146 @@
+import doctest
+
+import pytest
+
+import monom.projection
+from monom import *
+from monom.projection import ProjectionProfiler, include_field, loaded_names
+
+doctest.testmod(monom.projection)
+
+
+class User(EmbeddedModel):
+    name: str
+
+
+class Post(Model):
+    user: User
+    title: str
+    content: str
+
+    class Meta:
+        aliases = [('content', 'body')]
+
+
+def test_loaded_names():
+    names = ['user', 'title', 'body']
+    assert loaded_names(None, names) is None
+    assert loaded_names({}, names) is None
+    assert loaded_names({'title': 1, '_id': 0}, names) == {'title'}
+    assert loaded_names({'user.name': True}, names) == {'_id', 'user'}
+    assert loaded_names({'body': False, '_id': False}, names) == {'user', 'title'}
+    assert loaded_names({'_id': True}, names) is None
+
+
+def test_include_field():
+    assert include_field({'title': 1, '_id': 0}, 'v') == {'title': 1, '_id': 0, 'v': True}
+    assert include_field({'title': True, 'v.x': True}, 'v') == {'title': True, 'v': True}
+    assert include_field({'body': False, 'v': False}, 'v') == {'body': False}
+    assert include_field({'body': False}, 'v') == {'body': False}
+    assert include_field({'tags': {'$slice': 1}}, 'v') == {'tags': {'$slice': 1}}
+
+
+class TestLoadedFields:
+    def test_not_loaded(self):
+        post = Post.from_document({'_id': 1, 'title': 'foo'})
+        post._loaded = loaded_names(['title'], Post._get_plan().names)
+        assert post.loaded_fields == {'_id', 'title'}
+        assert post.title == 'foo'
+
+        with pytest.raises(AttributeError, match='was not loaded by the projection'):
+            _ = post.content
+
+    def test_missing(self):
+        post = Post.from_document({'_id': 1, 'title': 'foo'})
+        assert post.loaded_fields is None
+
+        with pytest.raises(AttributeError, match='has no value'):
+            _ = post.content
+
+
+class TestProjectionProfiler:
+    @staticmethod
+    def query(profiler, docs):
+        site = profiler.site(Post)
+        objs = []
+        for doc in docs:
+            obj = Post.from_document(doc)
+            site.observe(obj)
+            objs.append(obj)
+        return site, objs
+
+    def test_fields_read(self, caplog):
+        profiler = ProjectionProfiler(window=2)
+        docs = [{'_id': i, 'user': {'name': 'foo'}, 'title': 'bar', 'body': 'baz'} for i in range(2)]
+
+        site, objs = self.query(profiler, docs)
+        assert objs[0].title == 'bar'
+        assert objs[1].user.name == 'foo'
+        assert objs[1].get('title') == 'bar'
+        assert site.fields == {'title', 'user'}
+        assert not site.finished
+
+        assert self.query(profiler, [])[0] is site
+        assert site.finished
+        assert not site.applied
+        assert site.projection == {'_id': True, 'title': True, 'user': True}
+        assert profiler.suggestions() == {str(site): site.projection}
+        assert 'consider using the projection' in caplog.text
+
+        # reads are no longer recorded
+        _ = objs[0].content
+        assert site.fields == {'title', 'user'}
+
+    def test_aliases(self):
+        profiler = ProjectionProfiler(window=1)
+        site, objs = self.query(profiler, [{'_id': 1, 'body': 'baz'}])
+        _ = objs[0].content
+        assert site.fields == {'body'}
+
+    def test_whole_documents_read(self, caplog):
+        profiler = ProjectionProfiler(window=1)
+        site, objs = self.query(profiler, [{'_id': 1, 'title': 'bar'}])
+        objs[0].to_dict()
+
+        assert self.query(profiler, [])[0] is site
+        assert site.finished
+        assert site.projection is None
+        assert profiler.suggestions() == {}
+        assert 'no projection can be derived' in caplog.text
+
+    def test_version_field(self):
+        class Versioned(Model):
+            title: str
+            version: int
+
+            class Meta:
+                version_field = 'version'
+
+        profiler = ProjectionProfiler(window=1)
+        for _ in range(2):
+            site = profiler.site(Versioned)
+            if not site.finished:
+                obj = Versioned.from_document({'_id': 1, 'title': 'foo', 'version': 1})
+                site.observe(obj)
+                _ = obj.title
+        assert site.projection == {'_id': True, 'title': True, 'version': True}
+
+    def test_call_sites(self):
+        profiler = ProjectionProfiler(window=1)
+        site1 = profiler.site(Post)
+        site2 = profiler.site(Post)
+        assert site1 is not site2
+        assert site1.filename == __file__
+        assert site2.lineno == site1.lineno + 1
+
+    def test_apply(self, caplog):
+        profiler = ProjectionProfiler(window=1, apply=True)
+        site, objs = self.query(profiler, [{'_id': 1, 'title': 'bar'}])
+        _ = objs[0].title
+
+        assert self.query(profiler, [])[0] is site
+        assert site.applied
+        assert 'applying the projection' in caplog.text
+
+        site.widen('body')
+        assert site.projection == {'_id': True, 'title': True, 'body': True}
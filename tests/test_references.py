@@ -0,0 +1,105 @@
+from unittest import mock
+
+import pytest
+
+from monom import *
+from monom.fields import ArrayField, ReferenceField
+from monom.references import prefetch
+
+
+class Author(Model):
+    auto_build_index = False
+
+    name: str
+
+
+class Comment(EmbeddedModel):
+    text: str
+    author: Ref[Author]
+
+
+class Article(Model):
+    auto_build_index = False
+
+    title: str
+    author: Ref[Author]
+    comments: List[Comment]
+    related: List[Ref['Article']]
+
+
+@pytest.fixture
+def queries():
+    """Serve `Author.find({'_id': {'$in': [...]}})` from memory, recording the filters."""
+    authors = {1: {'_id': 1, 'name': 'foo'}, 2: {'_id': 2, 'name': 'bar'}}
+    filters = []
+
+    def find(filter=None, *args, **kw):
+        filters.append(filter)
+        return [Author.from_document(dict(authors[pk])) for pk in filter['_id']['$in'] if pk in authors]
+
+    with mock.patch.object(Author, 'find', find):
+        yield filters
+
+
+class TestReferenceField:
+    def test_hints(self):
+        assert isinstance(Article.author, ReferenceField) and Article.author.model is Author
+        assert isinstance(Article.related, ArrayField) and Article.related.field.model is Article
+
+    def test_convert(self):
+        author = Author.from_document({'_id': 1, 'name': 'foo'})
+        article = Article(title='foo', author=author)
+        assert article.get('author') == 1
+
+        article.author = author
+        assert article.author is author
+        article.author = 2
+        assert article.get('author') == 2
+
+        with pytest.raises(ValueError):
+            Article(author=Author(name='unsaved'))
+
+    def test_dereference(self, queries):
+        article = Article.from_document({'_id': 1, 'author': 1})
+        with mock.patch.object(Author, 'get', lambda pk: Author.from_document({'_id': pk})):
+            assert article.author.pk == 1
+            assert article.author is article.author
+
+        article = Article.from_document({'_id': 1, 'author': None})
+        assert article.author is None
+
+
+class TestPrefetch:
+    def test_prefetch(self, queries):
+        articles = [
+            Article.from_document({'_id': pk, 'author': pk % 2 + 1,
+                                   'comments': [{'text': 'a', 'author': 1}, {'text': 'b', 'author': 3}]})
+            for pk in range(10)
+        ]
+        prefetch(articles, 'author', 'comments.author')
+        assert queries == [{'_id': {'$in': [1, 2]}}, {'_id': {'$in': [1, 3]}}]
+        assert [article.author.name for article in articles[:2]] == ['foo', 'bar']
+        assert [comment.author and comment.author.name for comment in articles[0].comments] == ['foo', None]
+
+        # prefetched already
+        prefetch(articles, 'author')
+        assert len(queries) == 2
+
+    def test_invalid_path(self):
+        article = Article.from_document({'_id': 1, 'title': 'foo'})
+        for path in ('title', 'missing', 'comments'):
+            with pytest.raises(ValueError):
+                prefetch([article], path)
+
+    def test_cursor(self, db):
+        Author.set_db(db)
+        Article.set_db(db)
+        authors = [Author(name=str(i)).save() for i in range(3)]
+        for i in range(100):
+            Article(title=str(i), author=authors[i % 3], comments=[{'text': 'a', 'author': authors[0]}]).save()
+
+        with mock.patch.object(Author, 'find', wraps=Author.find) as find:
+            articles = list(Article.find().prefetch('author', 'comments.author'))
+        assert len(articles) == 100
+        assert find.call_count == 2
+        assert {article.author.name for article in articles} == {'0', '1', '2'}
@@ -0,0 +1,95 @@
+import doctest
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+from bson import Binary, Decimal128, Int64, json_util
+
+import monom.serialization
+from monom import *
+from monom.mongo import Cursor
+from monom.serialization import dumps, dumps_bytes
+
+
+class Attachment(EmbeddedModel):
+    data: bytes
+    created_on: datetime
+
+
+class Message(Model):
+    auto_build_index = False
+
+    sender: ObjectId
+    text: str
+    count: int
+    score: float
+    flagged: bool
+    sent_on: datetime
+    attachments: List[Attachment]
+    extra: dict
+
+
+def make_document(i: int = 0) -> dict:
+    return {
+        '_id': ObjectId(), 'sender': ObjectId(), 'text': 'héllo "{}"\n'.format(i), 'count': Int64(i),
+        'score': float('nan'), 'flagged': True, 'sent_on': datetime(2020, 1, 2, 3, 4, 5, 678901),
+        'attachments': [
+            {'data': b'\x00\xff', 'created_on': datetime(1960, 1, 1)},
+            {'data': Binary(b'x', 4), 'created_on': datetime(2020, 1, 1, tzinfo=timezone(timedelta(hours=8)))},
+        ],
+        'extra': {'price': Decimal128('1.5'), 'ids': (ObjectId(),), 'when': datetime(2021, 5, 6, 0, 0, 0, 999)},
+        'undeclared': {'n': 1.5},
+    }
+
+
+@pytest.fixture(params=[True, False], ids=['orjson', 'json'])
+def backend(request):
+    if request.param:
+        pytest.importorskip('orjson')
+        yield
+    else:
+        with mock.patch.object(monom.serialization, 'orjson', None):
+            yield
+
+
+def test_doctest():
+    assert doctest.testmod(monom.serialization).failed == 0
+
+
+def test_same_as_json_util(backend):
+    doc = make_document()
+    encoded = Message._get_plan().json_encoder(doc)
+    assert encoded == json.loads(json_util.dumps(doc))
+    assert dumps(encoded) == json_util.dumps(doc)
+    assert json.loads(dumps(encoded, compact=True)) == encoded
+    assert dumps_bytes(encoded).decode() == dumps(encoded, compact=True)
+    assert ' ' not in dumps({'a': [1, 2]}, compact=True)
+
+
+def test_unexpected_types():
+    encoded = Message._get_plan().json_encoder({'text': ObjectId('5f0000000000000000000000'), 'count': 1.5,
+                                                'sent_on': 'today', 'attachments': None})
+    assert encoded == {'text': {'$oid': '5f0000000000000000000000'}, 'count': 1.5, 'sent_on': 'today',
+                       'attachments': None}
+
+
+def test_to_json(backend):
+    message = Message.from_document(make_document())
+    assert message.to_json() == json_util.dumps(message.to_dict())
+    message = Message(sender=ObjectId('5f0000000000000000000000'), text='é', count=1, attachments=[])
+    assert message.to_json() == '{"sender": {"$oid": "5f0000000000000000000000"}, "text": "\\u00e9", "count": 1, ' \
+                                '"attachments": []}'
+    # arguments are passed to `json_dumps_func`
+    assert message.to_json(indent=2).startswith('{\n  ')
+
+
+def test_iter_ndjson(backend):
+    Message.set_db(MongoClient(connect=False).get_database('monom-test'))
+    batches = [[make_document(0), make_document(1)], [make_document(2)], []]
+    with mock.patch.object(Cursor, '_next_batch', side_effect=batches):
+        chunks = list(Message.find().iter_ndjson())
+
+    assert len(chunks) == 2 and all(chunk.endswith(b'\n') for chunk in chunks)
+    lines = b''.join(chunks).decode().splitlines()
+    assert [json.loads(line)['count'] for line in lines] == [0, 1, 2]
@@ -0,0 +1,163 @@
+from unittest import mock
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from monom import *
+from monom.batch import SaveError
+from monom.mongo import ConflictError
+from monom.session import current_session
+
+
+class Book(Model):
+    auto_build_index = False
+
+    title: str
+    tags: List[str]
+
+
+@pytest.fixture
+def offline():
+    Book.set_db(MongoClient(connect=False).get_database('monom-test'))
+    Book.set_collection('books')
+
+
+class TestIdentityMap:
+    def test_merge(self, offline):
+        session = Session()
+        book = Book.from_document({'_id': 1, 'title': 'foo'})
+        assert session.merge(book) is book
+        assert session.merge(Book.from_document({'_id': 1, 'title': 'bar'})) is book
+        assert session.lookup(Book, 1) is book
+        assert session.lookup(Book, 2) is None
+        assert book in session and len(session) == 1
+
+        with pytest.raises(ValueError):
+            session.add(Book.from_document({'_id': 1}))
+
+    def test_unhashable_or_missing_pk(self, offline):
+        session = Session()
+        first = Book.from_document({'_id': {'a': 1}})
+        second = Book.from_document({'_id': {'a': 1}})
+        new = Book(title='new')
+        for book in (first, second, new, new):
+            assert session.merge(book) is book
+        assert len(session) == 3
+        assert session.lookup(Book, {'a': 1}) is None
+
+    def test_dirty(self, offline):
+        session = Session()
+        clean = session.merge(Book.from_document({'_id': 1, 'title': 'foo'}))
+        changed = session.merge(Book.from_document({'_id': 2, 'title': 'foo'}))
+        deleted = session.merge(Book.from_document({'_id': 3, 'title': 'foo'}))
+        new = Book(title='new')
+        session.add(new)
+
+        changed.title = 'bar'
+        session.delete(deleted)
+        assert session.dirty == [changed, deleted, new]
+
+        session = Session(full_update=True)
+        session.merge(clean)
+        assert session.dirty == [clean]
+
+    def test_activation(self):
+        assert current_session() is None
+        with Session() as outer:
+            assert current_session() is outer
+            with pytest.raises(ZeroDivisionError):
+                with Session() as inner:
+                    assert current_session() is inner
+                    1 / 0
+            assert current_session() is outer
+            outer.clear()
+        assert current_session() is None
+
+    def test_get_on_instance(self):
+        book = Book(title='foo')
+        assert book.get('title') == 'foo'
+        assert book.get('tags', []) == []
+
+
+class TestSession:
+    def test_identity(self, db):
+        Book.set_db(db)
+        Book.set_collection('books')
+        pk = Book(title='foo').save().pk
+
+        with Session():
+            book = Book.find_one({'title': 'foo'})
+            assert Book.get(pk) is book
+            assert next(iter(Book.find())) is book
+        assert Book.get(pk) is not book
+
+    def test_commit(self, db):
+        Book.set_db(db)
+        Book.set_collection('books')
+        Book.insert_many([{'_id': i, 'title': str(i)} for i in range(3)])
+
+        with Session() as session:
+            first, second, third = Book.find().sort('_id')
+            first.title = 'changed'
+            session.delete(second)
+            new = Book(title='new')
+            session.add(new)
+        assert new.pk is not None and Book.get(new.pk).title == 'new'
+        assert Book.get(0).title == 'changed'
+        assert Book.get(1) is None
+        assert new in session and second not in session
+
+    def test_no_commit_on_error(self, db):
+        Book.set_db(db)
+        Book.set_collection('books')
+        pk = Book(title='foo').save().pk
+
+        with pytest.raises(RuntimeError):
+            with Session():
+                Book.get(pk).title = 'bar'
+                raise RuntimeError
+        assert Book.get(pk).title == 'foo'
+
+    def test_commit_errors(self, offline):
+        collection = mock.MagicMock()
+        collection.bulk_write.side_effect = BulkWriteError({
+            'nRemoved': 1, 'writeErrors': [{'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]
+        })
+        with mock.patch.object(Book, 'get_collection', return_value=collection):
+            with pytest.raises(SaveError) as err:
+                with Session() as session:
+                    deleted = session.merge(Book.from_document({'_id': 1, 'title': 'foo'}))
+                    session.delete(deleted)
+                    new = Book(_id=2, title='new')
+                    session.add(new)
+            assert err.value.result.errors[0].obj is new
+            # the models are kept for a retry
+            assert deleted._state == 'deleted' and new._state == 'before_save'
+            assert session.dirty == [new]
+
+            collection.bulk_write.side_effect = None
+            collection.bulk_write.return_value.bulk_api_result = {'nInserted': 1}
+            session.commit()
+            assert session.lookup(Book, 2) is new and deleted not in session
+
+    def test_commit_conflicts(self, offline):
+        class Counter(Model):
+            auto_build_index = False
+
+            value: int
+            version: int
+
+            class Meta:
+                version_field = 'version'
+
+        collection = mock.MagicMock()
+        collection.bulk_write.return_value.bulk_api_result = {'nMatched': 0}
+        collection.find.return_value = [{'_id': 1, 'version': 5}]
+        with mock.patch.object(Counter, 'get_collection', return_value=collection):
+            session = Session()
+            counter = session.merge(Counter.from_document({'_id': 1, 'value': 0, 'version': 1}))
+            counter.value = 1
+            with pytest.raises(ConflictError) as err:
+                session.commit()
+            assert err.value.obj is counter
+            assert session.dirty == [counter]
@@ -0,0 +1,107 @@
+from unittest import mock
+
+import bson
+import pytest
+from bson.raw_bson import RawBSONDocument
+
+from monom import *
+from monom.lazy import LazyDocument
+from monom.snapshot import diff, take_snapshot
+
+
+class Shot(Model):
+    auto_build_index = False
+    snapshot_changes = True
+
+    name: str
+    meta: dict
+    items: list
+
+
+def load(doc=None) -> Shot:
+    return Shot.from_document(doc or {'_id': 1, 'name': 'a', 'meta': {'x': {'y': 1}}, 'items': [{'k': 1}, 2]})
+
+
+@pytest.fixture
+def collection():
+    collection = mock.MagicMock()
+    collection.codec_options = bson.DEFAULT_CODEC_OPTIONS
+    with mock.patch.object(Shot, 'get_collection', return_value=collection):
+        yield collection
+
+
+class TestDiff:
+    def test_nested(self):
+        snapshot = take_snapshot({'a': {'b': [{'c': 1}]}, 'd': [1, 2]})
+        assert diff(snapshot, {'a': {'b': [{'c': 2}]}, 'd': [1, 2, 3]}) == {
+            '$set': {'a.b.0.c': 2}, '$push': {'d': {'$each': [3]}}}
+        assert diff(snapshot, {'a': {'b': [{'c': 1}]}, 'd': [2, 1]}) == {'$set': {'d.0': 2, 'd.1': 1}}
+        assert diff(snapshot, {'a': {'b': []}, 'd': [1, 2]}) == {'$set': {'a.b': []}}
+        assert diff(snapshot, {'a': {'b': [{'c': 1}]}, 'd': [1, 2]}) == {}
+
+    def test_invalid_keys(self):
+        assert diff({'a': {'x': 1}}, {'a': {'x': 1, 'y.z': 2}}) == {'$set': {'a': {'x': 1, 'y.z': 2}}}
+
+    def test_raw(self):
+        raw = bson.encode({'a': {'b': 1}, 'c': 2})
+        snapshot = take_snapshot(LazyDocument(RawBSONDocument(raw)))
+        assert snapshot is raw
+        assert diff(snapshot, {'a': {'b': 2}}) == {'$set': {'a.b': 2}, '$unset': {'c': ''}}
+
+
+class TestSnapshotChanges:
+    def test_changes_in_place(self):
+        shot = load()
+        assert not shot._is_dirty()
+        shot.name = 'a'
+        assert not shot._is_dirty()
+
+        # not seen by tracking attributes
+        shot._data['meta']['x']['y'] = 2
+        shot._data['items'][0]['k'] = 2
+        assert shot._is_dirty()
+        assert shot._get_tracked_update(shot._get_document()) == {'$set': {'meta.x.y': 2, 'items.0.k': 2}}
+
+    def test_save(self, collection):
+        shot = load()
+        shot.save()
+        collection.update_one.assert_not_called()
+
+        shot.meta['z'] = 1
+        del shot.name
+        shot.save()
+        collection.update_one.assert_called_once_with({'_id': 1}, {'$set': {'meta.z': 1}, '$unset': {'name': ''}})
+        assert not shot._is_dirty()
+
+        shot.save()
+        assert collection.update_one.call_count == 1
+
+    def test_new(self, collection):
+        shot = Shot(name='b', meta={}, items=[])
+        assert shot._snapshot is None
+        shot.save()
+        shot.items.append(1)
+        assert shot._get_tracked_update(shot._get_document()) == {'$push': {'items': {'$each': [1]}}}
+
+    def test_disabled(self, collection):
+        class NoShot(Model):
+            auto_build_index = False
+
+            meta: dict
+
+        obj = NoShot.from_document({'_id': 1, 'meta': {'x': 1}})
+        assert obj._snapshot is None
+        with mock.patch.object(NoShot, 'get_collection', return_value=collection):
+            obj.save()
+        collection.update_one.assert_not_called()
+
+
+def test_lazy(db):
+    Shot.set_db(db)
+    Shot(name='a', meta={'x': {'y': 1}}, items=[1]).save()
+
+    shot = next(Shot.find({}, lazy=True))
+    assert isinstance(shot._snapshot, bytes)
+    shot.meta['x']['y'] = 2
+    shot.save()
+    assert Shot.find_one({'_id': shot.pk}).meta == {'x': {'y': 2}}
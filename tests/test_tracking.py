@@ -0,0 +1,167 @@
+import copy
+
+import pytest
+
+from monom import *
+from monom.fields import ValidationError
+from monom.tracking import TrackedDict, TrackedList
+
+
+class Reply(EmbeddedModel):
+    text: str
+    tags: List[str]
+
+
+class Post(Model):
+    auto_build_index = False
+
+    tags: List[str]
+    meta: dict
+    comments: List[Reply]
+    extra: list
+
+
+def load() -> Post:
+    return Post.from_document({
+        '_id': 1,
+        'tags': ['a', 'b', 'c'],
+        'meta': {'x': {'y': 1}, 'z': 2},
+        'comments': [{'text': 't', 'tags': []}, {'text': 'u', 'tags': ['q']}],
+        'extra': [{'k': 1}, [1, 2]],
+    })
+
+
+def update_of(post: Post) -> dict:
+    return post._get_tracked_update(post._get_document())
+
+
+class TestTrackedList:
+    def test_push(self):
+        post = load()
+        post.tags.append('d')
+        post.tags += ['e']
+        assert update_of(post) == {'$push': {'tags': {'$each': ['d', 'e']}}}
+
+    def test_set_item(self):
+        post = load()
+        post.tags[-2] = 'B'
+        assert update_of(post) == {'$set': {'tags.1': 'B'}}
+
+    def test_pull(self):
+        post = load()
+        post.tags.remove('b')
+        assert update_of(post) == {'$pull': {'tags': {'$in': ['b']}}}
+
+        post = load()
+        post.tags.append('b')
+        post.tags.remove('b')
+        assert update_of(post) == {'$set': {'tags': ['a', 'c', 'b']}}
+
+    def test_mixed_or_reordered(self):
+        post = load()
+        post.tags.remove('a')
+        post.tags.append('d')
+        assert update_of(post) == {'$set': {'tags': ['b', 'c', 'd']}}
+
+        for mutate in (lambda tags: tags.sort(reverse=True), lambda tags: tags.insert(0, 'x'),
+                       lambda tags: tags.pop(), lambda tags: tags.__delitem__(0)):
+            post = load()
+            mutate(post.tags)
+            assert list(update_of(post)['$set']) == ['tags']
+
+    def test_nested(self):
+        post = load()
+        post.extra[0]['k'] = 2
+        post.extra[1].append(3)
+        assert update_of(post) == {'$set': {'extra.0.k': 2}, '$push': {'extra.1': {'$each': [3]}}}
+
+    def test_reset(self):
+        post = load()
+        post.extra.insert(0, 'x')
+        post._clear_tracked_fields()
+        assert not post._is_dirty()
+        post.extra[1]['k'] = 9
+        assert update_of(post) == {'$set': {'extra.1.k': 9}}
+
+    def test_assigned(self):
+        post = load()
+        post.tags = ['n']
+        post.tags.append('m')
+        assert update_of(post) == {'$set': {'tags': ['n', 'm']}}
+
+    def test_copy(self):
+        post = load()
+        assert isinstance(post.tags, TrackedList)
+        assert type(copy.deepcopy(post.tags)) is list
+        assert type(copy.copy(post.meta)) is dict
+
+
+class TestTrackedDict:
+    def test_set_and_unset(self):
+        post = load()
+        post.meta['x']['y'] = 5
+        del post.meta['z']
+        post.meta.setdefault('w', 0)
+        assert update_of(post) == {'$set': {'meta.x.y': 5, 'meta.w': 0}, '$unset': {'meta.z': ''}}
+
+    def test_replaced(self):
+        post = load()
+        post.meta['a.b'] = 1
+        assert update_of(post) == {'$set': {'meta': {'x': {'y': 1}, 'z': 2, 'a.b': 1}}}
+
+        post = load()
+        post.meta.clear()
+        assert update_of(post) == {'$set': {'meta': {}}}
+
+    def test_detached(self):
+        post = load()
+        x = post.meta['x']
+        post.meta['x'] = {'y': 2}
+        x['y'] = 3
+        assert update_of(post) == {'$set': {'meta.x': {'y': 2}}}
+        assert isinstance(post.meta['x'], TrackedDict)
+
+
+class TestTrackedModelList:
+    def test_models(self):
+        post = load()
+        post.comments[1].text = 'new'
+        post.comments[0].tags.append('n')
+        assert update_of(post) == {'$set': {'comments.1.text': 'new'}, '$push': {'comments.0.tags': {'$each': ['n']}}}
+
+    def test_push(self):
+        post = load()
+        post.comments.append(Reply(text='c', tags=[]))
+        assert update_of(post) == {'$push': {'comments': {'$each': [{'text': 'c', 'tags': []}]}}}
+        assert post.to_dict()['comments'][-1] == {'text': 'c', 'tags': []}
+
+        post.comments[0].text = 'z'
+        assert list(update_of(post)['$set']) == ['comments']
+
+    def test_structural(self):
+        post = load()
+        post.comments.pop(0)
+        assert update_of(post) == {'$set': {'comments': [{'text': 'u', 'tags': ['q']}]}}
+        assert post.to_dict()['comments'] == [{'text': 'u', 'tags': ['q']}]
+
+    def test_validation(self):
+        post = load()
+        with pytest.raises(ValidationError):
+            post.comments.append({'text': 1})
+
+
+def test_save(db):
+    Post.set_db(db)
+    post = Post(tags=['a', 'b'], meta={'x': 1}, comments=[{'text': 't', 'tags': []}], extra=[]).save()
+
+    post = Post.find_one({'_id': post.pk})
+    post.tags.append('c')
+    post.meta['y'] = 2
+    post.comments[0].tags.append('n')
+    post.save()
+
+    doc = Post.get_collection().find_one({'_id': post.pk})
+    assert doc['tags'] == ['a', 'b', 'c']
+    assert doc['meta'] == {'x': 1, 'y': 2}
+    assert doc['comments'][0]['tags'] == ['n']
+    assert not post._is_dirty()
@@ -177,6 +177,21 @@ def test_cached_property():
     assert f.i == 2
 
 
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+    assert cache.get('b', 42) == 42
+    assert len(cache) == 2
+    assert cache.pop('a') == 1
+    cache.clear()
+    assert len(cache) == 0
+
+
 def test_default_index_name():
     assert default_index_name([('a', 1), ('b', 1)]) == 'a_1_b_1'
     assert default_index_name([('a', -1), ('b', 1)]) == 'a_-1_b_1'